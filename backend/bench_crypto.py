@@ -0,0 +1,107 @@
+"""
+Saturate the encryption path and measure how responsive the event loop stays.
+
+The probe coroutine stands in for cheap endpoints like `/`: its latency is
+exactly what an unrelated request would see while crypto work is in flight.
+
+    python bench_crypto.py --jobs 2000 --concurrency 200
+
+With --max-loop-lag-ms the run fails (exit status 1) when the executor path's
+p99 probe lag goes over the budget, so blocking regressions show up in CI.
+"""
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives import serialization
+from encryption import CryptoExecutor, CryptoQueueFull, encrypt_with_public_key
+import argparse
+import asyncio
+import base64
+import statistics
+import sys
+import time
+
+
+def make_public_key(key_size: int) -> str:
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+    pem = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return base64.b64encode(pem).decode('utf-8')
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def probe(stop: asyncio.Event, samples: list, interval: float):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append((time.perf_counter() - started - interval) * 1000)
+
+
+async def run(mode: str, public_key: str, jobs: int, concurrency: int, executor: CryptoExecutor):
+    payload = {'status': 'completed', 'enclaves': [{'name': 'enclave', 'pcrs': {'pcr0': 'ab' * 48}}]}
+    semaphore = asyncio.Semaphore(concurrency)
+    rejected = 0
+
+    async def one():
+        nonlocal rejected
+        async with semaphore:
+            if mode == 'inline':
+                encrypt_with_public_key(public_key, payload)
+                await asyncio.sleep(0)
+            else:
+                try:
+                    await executor.encrypt(public_key, payload)
+                except CryptoQueueFull:
+                    rejected += 1
+
+    stop = asyncio.Event()
+    samples = []
+    probe_task = asyncio.create_task(probe(stop, samples, 0.005))
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(jobs)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe_task
+
+    print(f"\n[{mode}] {jobs} encryptions in {elapsed:.2f}s ({jobs / elapsed:.0f}/s), rejected={rejected}")
+    print(f"  probe lag ms: p50={statistics.median(samples):.2f} "
+          f"p99={percentile(samples, 99):.2f} max={max(samples):.2f}")
+    return percentile(samples, 99)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--key-size', type=int, default=2048)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-queue', type=int, default=256)
+    parser.add_argument('--max-batch', type=int, default=16)
+    parser.add_argument('--max-loop-lag-ms', type=float, default=None,
+                        help='fail if the executor run\'s p99 loop lag exceeds this')
+    args = parser.parse_args()
+
+    public_key = make_public_key(args.key_size)
+    executor = CryptoExecutor(max_workers=args.workers, max_queue=args.max_queue, max_batch=args.max_batch)
+    await executor.start()
+    try:
+        await run('inline', public_key, args.jobs, args.concurrency, executor)
+        p99 = await run('executor', public_key, args.jobs, args.concurrency, executor)
+        print(f"  executor stats: {executor.stats()}")
+    finally:
+        await executor.stop()
+
+    if args.max_loop_lag_ms is not None and p99 > args.max_loop_lag_ms:
+        print(f"FAIL: p99 loop lag {p99:.2f}ms exceeds {args.max_loop_lag_ms}ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
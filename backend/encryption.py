@@ -0,0 +1,322 @@
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives import serialization, hashes
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import asyncio
+import base64
+import json
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CryptoQueueFull(Exception):
+    """Raised when the crypto executor cannot accept more work"""
+
+
+class CryptoExecutorStopped(Exception):
+    """Raised for jobs still pending when the crypto executor shuts down"""
+
+
+@lru_cache(maxsize=int(os.getenv("PUBLIC_KEY_CACHE_SIZE", "1024")))
+def load_public_key(base64_public_key: str) -> RSAPublicKey:
+    """Decode and parse a base64 encoded PEM public key, caching repeat callers"""
+    # First decode the double-encoded public key
+    pem_data = base64.b64decode(base64_public_key).decode('utf-8')
+
+    # Now load the PEM formatted key
+    public_key_obj = serialization.load_pem_public_key(
+        pem_data.encode('utf-8')
+    )
+
+    # Verify that we have an RSA public key
+    if not isinstance(public_key_obj, RSAPublicKey):
+        raise ValueError("The provided key is not an RSA public key")
+
+    return public_key_obj
+
+
+def encrypt_with_public_key(base64_public_key: str, message: str) -> str:
+    """
+    Encrypt the message using the provided RSA public key in PEM format.
+    """
+    try:
+        public_key_obj = load_public_key(base64_public_key)
+
+        # Convert message to string if it's not already
+        if isinstance(message, (dict, list)):
+            message = json.dumps(message)
+
+        # Encrypt the message using RSA-OAEP padding
+        encrypted_data = public_key_obj.encrypt(
+            message.encode('utf-8'),
+            padding.OAEP(
+                mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                algorithm=hashes.SHA256(),
+                label=None
+            )
+        )
+
+        # Return base64 encoded encrypted data
+        return base64.b64encode(encrypted_data).decode('utf-8')
+
+    except Exception as e:
+        print(f"Encryption error: {str(e)}")
+        raise Exception(f"Encryption failed: {str(e)}")
+
+
+ENVELOPE_VERSION = 2
+
+
+def key_fingerprint(public_key_obj: RSAPublicKey) -> str:
+    """SHA-256 fingerprint of the DER encoded public key, used as a recipient id"""
+    der = public_key_obj.public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    digest = hashes.Hash(hashes.SHA256())
+    digest.update(der)
+    return digest.finalize().hex()
+
+
+def public_key_fingerprint(base64_public_key: str) -> str:
+    return key_fingerprint(load_public_key(base64_public_key))
+
+
+def envelope_aad(envelope: Dict[str, Any]) -> bytes:
+    """
+    Associated data for an envelope's payload: its header and recipient list,
+    so neither can be altered without the payload failing to decrypt.
+    """
+    header = {
+        'version': envelope['version'],
+        'alg': envelope['alg'],
+        'enc': envelope['enc'],
+        'kids': [recipient['kid'] for recipient in envelope['recipients']]
+    }
+    return json.dumps(header, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def encrypt_for_recipients(base64_public_keys: List[str], message: Any) -> Dict[str, Any]:
+    """
+    Encrypt the message once under a random AES-256-GCM data key and wrap that
+    key with RSA-OAEP for every recipient, so any listed party can open it.
+    The header and recipient list are authenticated as associated data.
+    """
+    try:
+        if not base64_public_keys:
+            raise ValueError("At least one recipient public key is required")
+
+        # Convert message to string if it's not already
+        if isinstance(message, (dict, list)):
+            message = json.dumps(message)
+
+        data_key = AESGCM.generate_key(bit_length=256)
+        nonce = os.urandom(12)
+
+        recipients = []
+        seen = set()
+        for base64_public_key in base64_public_keys:
+            kid = public_key_fingerprint(base64_public_key)
+            if kid in seen:
+                continue
+            seen.add(kid)
+            wrapped_key = load_public_key(base64_public_key).encrypt(
+                data_key,
+                padding.OAEP(
+                    mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                    algorithm=hashes.SHA256(),
+                    label=None
+                )
+            )
+            recipients.append({
+                'kid': kid,
+                'wrapped_key': base64.b64encode(wrapped_key).decode('utf-8')
+            })
+
+        envelope = {
+            'version': ENVELOPE_VERSION,
+            'alg': 'RSA-OAEP-256',
+            'enc': 'A256GCM',
+            'nonce': base64.b64encode(nonce).decode('utf-8'),
+            'recipients': recipients
+        }
+        ciphertext = AESGCM(data_key).encrypt(nonce, message.encode('utf-8'), envelope_aad(envelope))
+        envelope['ciphertext'] = base64.b64encode(ciphertext).decode('utf-8')
+        return envelope
+
+    except Exception as e:
+        print(f"Envelope encryption error: {str(e)}")
+        raise Exception(f"Envelope encryption failed: {str(e)}")
+
+
+def decrypt_envelope(envelope: Dict[str, Any], private_key) -> str:
+    """Open an envelope produced by encrypt_for_recipients with a recipient's RSA private key"""
+    if envelope.get('version') != ENVELOPE_VERSION:
+        raise ValueError(f"Unsupported envelope version: {envelope.get('version')}")
+    kid = key_fingerprint(private_key.public_key())
+    recipient = next((r for r in envelope['recipients'] if r['kid'] == kid), None)
+    if recipient is None:
+        raise ValueError("Private key does not match any recipient of this envelope")
+
+    oaep = padding.OAEP(
+        mgf=padding.MGF1(algorithm=hashes.SHA256()),
+        algorithm=hashes.SHA256(),
+        label=None
+    )
+    nonce = base64.b64decode(envelope['nonce'])
+    ciphertext = base64.b64decode(envelope['ciphertext'])
+    try:
+        data_key = private_key.decrypt(base64.b64decode(recipient['wrapped_key']), oaep)
+        return AESGCM(data_key).decrypt(nonce, ciphertext, envelope_aad(envelope)).decode('utf-8')
+    except (ValueError, InvalidTag):
+        raise ValueError("Envelope failed authentication")
+
+
+class CryptoExecutor:
+    """
+    Runs CPU-bound crypto work on a thread pool so it never blocks the event loop.
+
+    Jobs go through a bounded queue; a dispatcher drains up to `max_batch` jobs
+    at a time and hands them to a worker thread as a single batch.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_queue: int = 256, max_batch: int = 16):
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._dispatchers: List[asyncio.Task] = []
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'batches': 0,
+            'queue_latency_total': 0.0,
+            'queue_latency_max': 0.0,
+        }
+
+    async def start(self):
+        if self._pool is not None:
+            return
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="crypto")
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        # One dispatcher per worker thread keeps every thread busy without
+        # letting batches pile up behind each other
+        self._dispatchers = [asyncio.create_task(self._dispatch()) for _ in range(self.max_workers)]
+
+    async def stop(self):
+        for dispatcher in self._dispatchers:
+            dispatcher.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        self._dispatchers = []
+        # Nobody will run what's still queued; don't leave its callers waiting
+        if self._queue is not None:
+            while not self._queue.empty():
+                _, _, future, _ = self._queue.get_nowait()
+                self._fail(future, CryptoExecutorStopped("Crypto executor stopped"))
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        self._queue = None
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """Queue fn(*args) for the pool and wait for its result"""
+        if self._pool is None:
+            await self.start()
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((fn, args, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self._stats['rejected'] += 1
+            raise CryptoQueueFull(f"Crypto queue is full ({self.max_queue} pending jobs)")
+
+        self._stats['submitted'] += 1
+        return await future
+
+    async def encrypt(self, base64_public_key: str, message: Any) -> str:
+        return await self.run(encrypt_with_public_key, base64_public_key, message)
+
+    async def encrypt_for_recipients(self, base64_public_keys: List[str], message: Any) -> Dict[str, Any]:
+        return await self.run(encrypt_for_recipients, base64_public_keys, message)
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            dispatched_at = time.perf_counter()
+            for _, _, _, enqueued_at in batch:
+                latency = dispatched_at - enqueued_at
+                self._stats['queue_latency_total'] += latency
+                self._stats['queue_latency_max'] = max(self._stats['queue_latency_max'], latency)
+            self._stats['batches'] += 1
+
+            jobs = [(fn, args) for fn, args, _, _ in batch]
+            try:
+                results = await loop.run_in_executor(self._pool, _run_batch, jobs)
+            except asyncio.CancelledError:
+                for _, _, future, _ in batch:
+                    self._fail(future, CryptoExecutorStopped("Crypto executor stopped"))
+                raise
+            except Exception as e:
+                # e.g. the pool was shut down; fail this batch and keep dispatching
+                logger.error(f"Error running crypto batch: {e}")
+                for _, _, future, _ in batch:
+                    self._fail(future, e)
+                continue
+
+            for (_, _, future, _), (ok, value) in zip(batch, results):
+                if future.done():
+                    # Caller went away (e.g. client disconnected)
+                    continue
+                if ok:
+                    self._stats['completed'] += 1
+                    future.set_result(value)
+                else:
+                    self._stats['failed'] += 1
+                    future.set_exception(value)
+
+    def _fail(self, future: asyncio.Future, error: Exception):
+        if not future.done():
+            self._stats['failed'] += 1
+            future.set_exception(error)
+
+    def stats(self) -> Dict[str, Any]:
+        finished = self._stats['completed'] + self._stats['failed']
+        return {
+            'workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'max_batch': self.max_batch,
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+            'submitted': self._stats['submitted'],
+            'completed': self._stats['completed'],
+            'failed': self._stats['failed'],
+            'rejected': self._stats['rejected'],
+            'batches': self._stats['batches'],
+            'avg_batch_size': finished / self._stats['batches'] if self._stats['batches'] else 0.0,
+            'avg_queue_latency_ms': 1000 * self._stats['queue_latency_total'] / finished if finished else 0.0,
+            'max_queue_latency_ms': 1000 * self._stats['queue_latency_max'],
+        }
+
+
+def _run_batch(jobs: List[Tuple[Callable[..., Any], tuple]]) -> List[Tuple[bool, Any]]:
+    """Run a batch of jobs on a worker thread, capturing each result or error"""
+    results = []
+    for fn, args in jobs:
+        try:
+            results.append((True, fn(*args)))
+        except Exception as e:
+            results.append((False, e))
+    return results
@@ -0,0 +1,7 @@
+# The loop monitor is shared by both services; its source is observability/loop_monitor.py
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from observability.loop_monitor import LAG_BUCKETS_MS, LoopMonitor  # noqa: E402,F401
@@ -1,10 +1,12 @@
-from fastapi import FastAPI, Query, HTTPException
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
-from cryptography.hazmat.primitives import serialization, hashes
-from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
-import base64
+from fastapi import FastAPI, Query, HTTPException, Header
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from encryption import CryptoExecutor, CryptoQueueFull
+from profiling import SamplingProfiler, ProfilingMiddleware, profiled_in_thread
+from loop_monitor import LoopMonitor
 import requests
-import json
 from dotenv import load_dotenv
 import os
 
@@ -13,43 +15,46 @@ load_dotenv()
 
 app = FastAPI()
 
-def encrypt_with_public_key(base64_public_key: str, message: str) -> str:
-    """
-    Encrypt the message using the provided RSA public key in PEM format.
-    """
-    try:
-        # First decode the double-encoded public key
-        pem_data = base64.b64decode(base64_public_key).decode('utf-8')
-        
-        # Now load the PEM formatted key
-        public_key_obj = serialization.load_pem_public_key(
-            pem_data.encode('utf-8')
-        )
-
-        # Verify that we have an RSA public key
-        if not isinstance(public_key_obj, RSAPublicKey):
-            raise ValueError("The provided key is not an RSA public key")
-
-        # Convert message to string if it's not already
-        if isinstance(message, (dict, list)):
-            message = json.dumps(message)
-
-        # Encrypt the message using RSA-OAEP padding
-        encrypted_data = public_key_obj.encrypt(
-            message.encode('utf-8'),
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                algorithm=hashes.SHA256(),
-                label=None
-            )
-        )
-        
-        # Return base64 encoded encrypted data
-        return base64.b64encode(encrypted_data).decode('utf-8')
+# Opt-in profiling: requests with X-Profile: <PROFILE_TOKEN>, or a
+# PROFILE_SAMPLE_RATE fraction of all requests. Crypto batches can mix
+# several requests' jobs, so the whole crypto pool is sampled
+profiler = SamplingProfiler.from_env()
+app.add_middleware(ProfilingMiddleware, profiler=profiler, thread_prefixes=("crypto",))
 
-    except Exception as e:
-        print(f"Encryption error: {str(e)}")
-        raise Exception(f"Encryption failed: {str(e)}")
+# RSA work runs on a bounded thread pool instead of the event loop
+crypto_executor = CryptoExecutor(
+    max_workers=int(os.getenv("CRYPTO_WORKERS", "0")) or None,
+    max_queue=int(os.getenv("CRYPTO_MAX_QUEUE", "256")),
+    max_batch=int(os.getenv("CRYPTO_MAX_BATCH", "16"))
+)
+
+# Reports event-loop lag and the stack of anything that blocks the loop
+loop_monitor = LoopMonitor.from_env()
+
+@app.on_event("startup")
+async def start_crypto_executor():
+    await crypto_executor.start()
+    await loop_monitor.start()
+
+@app.on_event("shutdown")
+async def stop_crypto_executor():
+    await loop_monitor.stop()
+    await crypto_executor.stop()
+
+class MultiRecipientRequest(BaseModel):
+    publicKeys: List[str] = Field(..., min_length=1, max_length=int(os.getenv("MAX_RECIPIENTS", "32")))
+
+@profiled_in_thread(profiler)
+def fetch_deployment() -> dict:
+    """Request a single enclave deployment and return its details"""
+    url = os.getenv("ENCLAVE_DEPLOYMENT_URL")
+    if not url:
+        raise HTTPException(status_code=500, detail="ENCLAVE_DEPLOYMENT_URL environment variable is not set")
+
+    payload = {"number_of_enclaves": 1}
+    response = requests.post(url, json=payload)
+    response.raise_for_status()  # Raise exception for bad status codes
+    return response.json()
 
 @app.get("/api/test")
 async def get_test_data(publicKey: str = Query(...)):
@@ -57,19 +62,39 @@ async def get_test_data(publicKey: str = Query(...)):
     
     try:
         # Make request to enclave deployment endpoint
-        url = os.getenv("ENCLAVE_DEPLOYMENT_URL")
-        if not url:
-            raise HTTPException(status_code=500, detail="ENCLAVE_DEPLOYMENT_URL environment variable is not set")
-            
-        payload = {"number_of_enclaves": 1}
-        response = requests.post(url, json=payload)
-        response.raise_for_status()  # Raise exception for bad status codes
-        
-        data_to_encrypt = response.json()
-        encrypted_response = encrypt_with_public_key(publicKey, data_to_encrypt)
+        data_to_encrypt = await run_in_threadpool(fetch_deployment)
+        encrypted_response = await crypto_executor.encrypt(publicKey, data_to_encrypt)
         
         return {"data": encrypted_response}
         
+    except HTTPException:
+        raise
+    except CryptoQueueFull as e:
+        print(f"Crypto queue full: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except requests.RequestException as e:
+        print(f"Request error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to deploy enclaves: {str(e)}")
+    except Exception as e:
+        print(f"Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/test/multi")
+async def get_test_data_multi(request: MultiRecipientRequest):
+    """Deploy once and return an envelope that every listed recipient can open"""
+    print(f"Received {len(request.publicKeys)} recipient public keys")
+
+    try:
+        data_to_encrypt = await run_in_threadpool(fetch_deployment)
+        envelope = await crypto_executor.encrypt_for_recipients(request.publicKeys, data_to_encrypt)
+
+        return {"data": envelope}
+
+    except HTTPException:
+        raise
+    except CryptoQueueFull as e:
+        print(f"Crypto queue full: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except requests.RequestException as e:
         print(f"Request error: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to deploy enclaves: {str(e)}")
@@ -79,4 +104,33 @@ async def get_test_data(publicKey: str = Query(...)):
 
 @app.get("/")
 async def root():
-    return {"message": "FastAPI server is running"} 
\ No newline at end of file
+    return {"message": "FastAPI server is running"}
+
+@app.get("/crypto/stats")
+async def crypto_stats():
+    return crypto_executor.stats()
+
+@app.get("/metrics/loop")
+async def loop_metrics():
+    return loop_monitor.stats()
+
+def require_profile_token(token: Optional[str]):
+    if not profiler.token:
+        raise HTTPException(status_code=404, detail="Profiling is not enabled")
+    if not profiler.check_token(token):
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+# Plain functions: listing profiles is file I/O, so it runs in the threadpool
+@app.get("/admin/profiles")
+def list_profiles(x_profile: Optional[str] = Header(None)):
+    require_profile_token(x_profile)
+    return {"profiles": profiler.list_profiles()}
+
+@app.get("/admin/profiles/{name}")
+def get_profile(name: str, x_profile: Optional[str] = Header(None)):
+    """Download a profile in folded format (feed it to flamegraph.pl or speedscope)"""
+    require_profile_token(x_profile)
+    path = profiler.profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain", filename=name)
@@ -0,0 +1,7 @@
+# The profiler is shared by both services; its source is observability/profiling.py
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from observability.profiling import ProfileSession, SamplingProfiler, ProfilingMiddleware, profiled, profiled_in_thread  # noqa: E402,F401
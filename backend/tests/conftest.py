@@ -0,0 +1,30 @@
+import base64
+import os
+import sys
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+# The service's modules import each other by plain name (from encryption import ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _encode_public_key(private_key) -> str:
+    """Public key in the base64-wrapped PEM form the API takes"""
+    pem = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return base64.b64encode(pem).decode('utf-8')
+
+
+@pytest.fixture(scope='session')
+def rsa_keys():
+    """A few RSA private keys (generating them is slow, so they're shared)"""
+    return [rsa.generate_private_key(public_exponent=65537, key_size=2048) for _ in range(3)]
+
+
+@pytest.fixture(scope='session')
+def public_keys(rsa_keys):
+    return [_encode_public_key(key) for key in rsa_keys]
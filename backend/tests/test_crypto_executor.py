@@ -0,0 +1,131 @@
+import asyncio
+import base64
+import threading
+
+import pytest
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+
+from encryption import CryptoExecutor, CryptoExecutorStopped, CryptoQueueFull, load_public_key
+
+
+def block_until(event: threading.Event):
+    event.wait(5)
+    return 'unblocked'
+
+
+async def submit(executor, fn, *args):
+    """Queue a job and yield so it reaches the executor's queue"""
+    task = asyncio.create_task(executor.run(fn, *args))
+    await asyncio.sleep(0)
+    return task
+
+
+def test_jobs_queued_together_run_as_one_batch():
+    async def scenario():
+        executor = CryptoExecutor(max_workers=1, max_queue=16, max_batch=8)
+        await executor.start()
+        gate = threading.Event()
+        try:
+            blocker = await submit(executor, block_until, gate)
+            # Let the dispatcher pick up the blocker before queueing the rest
+            await asyncio.sleep(0.05)
+            jobs = [await submit(executor, pow, 2, n) for n in range(5)]
+            gate.set()
+            assert await blocker == 'unblocked'
+            assert await asyncio.gather(*jobs) == [1, 2, 4, 8, 16]
+            return executor.stats()
+        finally:
+            gate.set()
+            await executor.stop()
+
+    stats = asyncio.run(scenario())
+    assert stats['completed'] == 6
+    assert stats['batches'] == 2
+    assert stats['avg_batch_size'] == 3.0
+
+
+def test_failing_job_only_fails_its_own_caller():
+    async def scenario():
+        executor = CryptoExecutor(max_workers=1)
+        try:
+            results = await asyncio.gather(
+                executor.run(pow, 2, 3),
+                executor.run(int, 'not a number'),
+                return_exceptions=True
+            )
+            return results, executor.stats()
+        finally:
+            await executor.stop()
+
+    (ok, error), stats = asyncio.run(scenario())
+    assert ok == 8
+    assert isinstance(error, ValueError)
+    assert (stats['completed'], stats['failed']) == (1, 1)
+
+
+def test_full_queue_rejects_new_jobs():
+    async def scenario():
+        executor = CryptoExecutor(max_workers=1, max_queue=2, max_batch=1)
+        await executor.start()
+        gate = threading.Event()
+        try:
+            blocker = await submit(executor, block_until, gate)
+            await asyncio.sleep(0.05)
+            queued = [await submit(executor, pow, 2, n) for n in range(2)]
+            with pytest.raises(CryptoQueueFull):
+                await executor.run(pow, 2, 10)
+            stats = executor.stats()
+            gate.set()
+            await asyncio.gather(blocker, *queued)
+            return stats
+        finally:
+            gate.set()
+            await executor.stop()
+
+    stats = asyncio.run(scenario())
+    assert stats['rejected'] == 1
+    assert stats['queue_depth'] == 2
+
+
+def test_stop_fails_pending_jobs():
+    async def scenario():
+        executor = CryptoExecutor(max_workers=1, max_queue=8, max_batch=1)
+        await executor.start()
+        gate = threading.Event()
+        try:
+            running = await submit(executor, block_until, gate)
+            await asyncio.sleep(0.05)
+            queued = [await submit(executor, pow, 2, n) for n in range(3)]
+            # Neither the running batch nor the queued jobs may leave their callers waiting
+            await asyncio.wait_for(executor.stop(), timeout=1)
+            return await asyncio.wait_for(
+                asyncio.gather(running, *queued, return_exceptions=True), timeout=1
+            )
+        finally:
+            gate.set()
+
+    results = asyncio.run(scenario())
+    assert len(results) == 4
+    assert all(isinstance(result, CryptoExecutorStopped) for result in results)
+
+
+def test_encrypt_round_trip_and_key_cache(rsa_keys, public_keys):
+    private_key, public_key = rsa_keys[0], public_keys[0]
+
+    async def scenario():
+        executor = CryptoExecutor(max_workers=2)
+        try:
+            return await asyncio.gather(*(executor.encrypt(public_key, {'n': n}) for n in range(4)))
+        finally:
+            await executor.stop()
+
+    load_public_key.cache_clear()
+    ciphertexts = asyncio.run(scenario())
+    oaep = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+    assert [private_key.decrypt(base64.b64decode(c), oaep) for c in ciphertexts] == [
+        f'{{"n": {n}}}'.encode() for n in range(4)
+    ]
+    # The key is parsed once and then served from the cache
+    info = load_public_key.cache_info()
+    assert (info.misses, info.hits) == (1, 3)
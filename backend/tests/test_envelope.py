@@ -0,0 +1,63 @@
+import base64
+import json
+
+import pytest
+
+from encryption import decrypt_envelope, encrypt_for_recipients, public_key_fingerprint
+
+MESSAGE = {'enclave': 'enclave-abc', 'pcrs': {'pcr0': '00'}}
+
+
+def test_every_recipient_can_open_it(rsa_keys, public_keys):
+    envelope = encrypt_for_recipients(public_keys, MESSAGE)
+
+    assert [r['kid'] for r in envelope['recipients']] == [public_key_fingerprint(k) for k in public_keys]
+    for private_key in rsa_keys:
+        assert json.loads(decrypt_envelope(envelope, private_key)) == MESSAGE
+
+
+def test_duplicate_keys_are_wrapped_once(rsa_keys, public_keys):
+    envelope = encrypt_for_recipients([public_keys[0], public_keys[1], public_keys[0]], MESSAGE)
+    assert len(envelope['recipients']) == 2
+    assert json.loads(decrypt_envelope(envelope, rsa_keys[1])) == MESSAGE
+
+
+def test_non_recipient_is_rejected(rsa_keys, public_keys):
+    envelope = encrypt_for_recipients(public_keys[:2], MESSAGE)
+    with pytest.raises(ValueError, match='does not match any recipient'):
+        decrypt_envelope(envelope, rsa_keys[2])
+
+
+def test_only_the_matching_wrapped_key_is_unwrapped(rsa_keys, public_keys):
+    envelope = encrypt_for_recipients(public_keys[:2], MESSAGE)
+    # A corrupt entry for another recipient doesn't get in the way
+    envelope['recipients'][0]['wrapped_key'] = base64.b64encode(b'garbage').decode()
+    assert json.loads(decrypt_envelope(envelope, rsa_keys[1])) == MESSAGE
+
+
+def flip_last_byte(value: str) -> str:
+    raw = bytearray(base64.b64decode(value))
+    raw[-1] ^= 1
+    return base64.b64encode(bytes(raw)).decode()
+
+
+@pytest.mark.parametrize('tamper', [
+    lambda envelope: envelope.update(ciphertext=flip_last_byte(envelope['ciphertext'])),
+    lambda envelope: envelope.update(nonce=flip_last_byte(envelope['nonce'])),
+    lambda envelope: envelope.update(alg='RSA1_5'),
+    lambda envelope: envelope.update(enc='A128GCM'),
+    # Dropping a recipient changes the authenticated kid list
+    lambda envelope: envelope['recipients'].pop(0),
+], ids=['ciphertext', 'nonce', 'alg', 'enc', 'recipients'])
+def test_tampering_is_detected(rsa_keys, public_keys, tamper):
+    envelope = encrypt_for_recipients(public_keys[:2], MESSAGE)
+    tamper(envelope)
+    with pytest.raises(ValueError, match='failed authentication'):
+        decrypt_envelope(envelope, rsa_keys[1])
+
+
+def test_unknown_version_is_rejected(rsa_keys, public_keys):
+    envelope = encrypt_for_recipients(public_keys[:1], MESSAGE)
+    envelope['version'] = 1
+    with pytest.raises(ValueError, match='Unsupported envelope version'):
+        decrypt_envelope(envelope, rsa_keys[0])
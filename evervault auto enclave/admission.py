@@ -0,0 +1,222 @@
+import json
+import math
+import os
+import time
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+from dotenv import load_dotenv
+from store import get_store
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+JOBS_KEY = 'admission:jobs'
+ENCLAVE_SECONDS_KEY = 'admission:enclave_seconds'
+# Written by the autoscaler so estimates follow the live fleet size
+WORKER_SLOTS_KEY = 'admission:worker_slots'
+
+
+@dataclass
+class AdmissionDecision:
+    admitted: bool
+    status_code: int = 200
+    reason: str = ''
+    retry_after: int = 0
+    estimated_wait: float = 0.0
+    estimated_start_time: float = 0.0
+    details: Dict[str, Any] = field(default_factory=dict)
+
+
+class AdmissionController:
+    """
+    Decides whether a deployment request can be queued.
+
+    Every admitted job is recorded in a Redis hash (job id -> caller, enclave
+    count, admission time) until its task finishes, so queue depth, per-caller
+    usage and the estimated wait are derived from the same bookkeeping across
+    all API processes. Entries older than `job_ttl` are treated as lost and
+    dropped, so a crashed worker can't leak capacity forever.
+    """
+
+    def __init__(
+        self,
+        store=None,
+        max_pending_enclaves: int = 100,
+        max_pending_per_caller: int = 20,
+        max_estimated_wait: float = 3600,
+        worker_slots: int = 1,
+        default_enclave_seconds: float = 180,
+        job_ttl: float = 6 * 3600,
+        broker_queue: str = 'celery'
+    ):
+        self.store = store
+        self.max_pending_enclaves = max_pending_enclaves
+        self.max_pending_per_caller = max_pending_per_caller
+        self.max_estimated_wait = max_estimated_wait
+        self.worker_slots = max(1, worker_slots)
+        self.default_enclave_seconds = default_enclave_seconds
+        self.job_ttl = job_ttl
+        self.broker_queue = broker_queue
+
+    @classmethod
+    def from_env(cls) -> 'AdmissionController':
+        return cls(
+            max_pending_enclaves=int(os.getenv('MAX_PENDING_ENCLAVES', '100')),
+            max_pending_per_caller=int(os.getenv('MAX_PENDING_ENCLAVES_PER_CALLER', '20')),
+            max_estimated_wait=float(os.getenv('MAX_ESTIMATED_WAIT_SECONDS', '3600')),
+            worker_slots=int(os.getenv('WORKER_SLOTS', '1')),
+            default_enclave_seconds=float(os.getenv('DEFAULT_ENCLAVE_SECONDS', '180')),
+            job_ttl=float(os.getenv('ADMISSION_JOB_TTL_SECONDS', str(6 * 3600))),
+        )
+
+    def _store(self):
+        if self.store is None:
+            self.store = get_store()
+        return self.store
+
+    def _pending_jobs(self) -> Dict[str, Dict[str, Any]]:
+        store = self._store()
+        now = time.time()
+        jobs = {}
+        stale = []
+        for job_id, raw in store.hgetall(JOBS_KEY).items():
+            job = json.loads(raw)
+            if now - job['admitted_at'] > self.job_ttl:
+                stale.append(job_id)
+            else:
+                jobs[job_id] = job
+        if stale:
+            logger.warning(f"Dropping {len(stale)} stale admission entries")
+            store.hdel(JOBS_KEY, *stale)
+        return jobs
+
+    def enclave_seconds(self) -> float:
+        value = self._store().get(ENCLAVE_SECONDS_KEY)
+        return float(value) if value else self.default_enclave_seconds
+
+    def record_enclave_duration(self, seconds: float, alpha: float = 0.2):
+        """Fold an observed per-enclave deploy time into the moving average"""
+        current = self.enclave_seconds()
+        self._store().set(ENCLAVE_SECONDS_KEY, (1 - alpha) * current + alpha * seconds)
+
+    def current_worker_slots(self) -> int:
+        value = self._store().get(WORKER_SLOTS_KEY)
+        return max(1, int(value)) if value else self.worker_slots
+
+    def estimated_wait(self, pending_enclaves: int) -> float:
+        return pending_enclaves * self.enclave_seconds() / self.current_worker_slots()
+
+    def snapshot(self) -> Dict[str, Any]:
+        jobs = self._pending_jobs()
+        pending_enclaves = sum(job['enclaves'] for job in jobs.values())
+        try:
+            broker_depth = self._store().llen(self.broker_queue)
+        except Exception as e:
+            logger.error(f"Error reading broker queue depth: {e}")
+            broker_depth = None
+        estimated_wait = self.estimated_wait(pending_enclaves)
+        saturated = (
+            pending_enclaves >= self.max_pending_enclaves
+            or estimated_wait >= self.max_estimated_wait
+        )
+        oldest = min((job['admitted_at'] for job in jobs.values()), default=None)
+        return {
+            'pending_jobs': len(jobs),
+            'pending_enclaves': pending_enclaves,
+            'broker_queue_depth': broker_depth,
+            'oldest_job_age': time.time() - oldest if oldest else 0.0,
+            'enclave_seconds': self.enclave_seconds(),
+            'worker_slots': self.current_worker_slots(),
+            'estimated_wait': estimated_wait,
+            'max_pending_enclaves': self.max_pending_enclaves,
+            'max_estimated_wait': self.max_estimated_wait,
+            'saturated': saturated
+        }
+
+    def shard_loads(self) -> Dict[str, int]:
+        """Pending enclaves per credential shard"""
+        loads: Dict[str, int] = {}
+        for job in self._pending_jobs().values():
+            shard = job.get('shard')
+            if shard:
+                loads[shard] = loads.get(shard, 0) + job['enclaves']
+        return loads
+
+    def try_admit(self, job_id: str, caller: str, number_of_enclaves: int, shard: str = None) -> AdmissionDecision:
+        """
+        Admit the job and record it, or explain why not.
+
+        The check and the write are not atomic, so concurrent API processes may
+        overshoot the limits by a request or two; the limits are a safety valve,
+        not an exact quota.
+        """
+        jobs = self._pending_jobs()
+        pending_enclaves = sum(job['enclaves'] for job in jobs.values())
+        caller_enclaves = sum(job['enclaves'] for job in jobs.values() if job['caller'] == caller)
+        enclave_seconds = self.enclave_seconds()
+        estimated_wait = self.estimated_wait(pending_enclaves)
+        now = time.time()
+        details = {
+            'pending_enclaves': pending_enclaves,
+            'caller_pending_enclaves': caller_enclaves
+        }
+
+        if caller_enclaves + number_of_enclaves > self.max_pending_per_caller:
+            # The caller has to wait for enough of its own work to drain
+            excess = caller_enclaves + number_of_enclaves - self.max_pending_per_caller
+            retry_after = excess * enclave_seconds / self.current_worker_slots()
+            return AdmissionDecision(
+                admitted=False,
+                status_code=429,
+                reason=f"Caller quota of {self.max_pending_per_caller} pending enclaves exceeded",
+                retry_after=max(1, math.ceil(retry_after)),
+                estimated_wait=estimated_wait,
+                estimated_start_time=now + estimated_wait,
+                details=details
+            )
+
+        over_depth = pending_enclaves + number_of_enclaves - self.max_pending_enclaves
+        over_wait = estimated_wait - self.max_estimated_wait
+        if over_depth > 0 or over_wait > 0:
+            retry_after = max(over_depth * enclave_seconds / self.current_worker_slots(), over_wait)
+            return AdmissionDecision(
+                admitted=False,
+                status_code=503,
+                reason="Deployment queue is over capacity",
+                retry_after=max(1, math.ceil(retry_after)),
+                estimated_wait=estimated_wait,
+                estimated_start_time=now + estimated_wait,
+                details=details
+            )
+
+        self._store().hset(JOBS_KEY, job_id, json.dumps({
+            'caller': caller,
+            'enclaves': number_of_enclaves,
+            'shard': shard,
+            'admitted_at': now
+        }))
+        return AdmissionDecision(
+            admitted=True,
+            estimated_wait=estimated_wait,
+            estimated_start_time=now + estimated_wait,
+            details=details
+        )
+
+    def release(self, job_id: str):
+        """Forget a job once its task has finished, successfully or not"""
+        try:
+            self._store().hdel(JOBS_KEY, job_id)
+        except Exception as e:
+            logger.error(f"Error releasing admission for job {job_id}: {e}")
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController.from_env()
+    return _controller
@@ -0,0 +1,355 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from store import get_store
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ALLOWLIST_KEY = 'attestation:allowlist'
+CACHE_KEY = 'attestation:cache:{key}'
+
+# PCRs Evervault enclaves are pinned on: image, kernel/bootstrap, application
+# and signing certificate
+PCR_NAMES = ('pcr0', 'pcr1', 'pcr2', 'pcr8')
+
+# Files that differ between deploys of the same source and so don't count
+# towards its build hash
+BUILD_HASH_IGNORE = {'.git', 'enclave.toml', 'node_modules'}
+
+
+def source_hash(path: str) -> str:
+    """Deterministic hash of a template's source tree, identifying a build"""
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d not in BUILD_HASH_IGNORE)
+        for name in sorted(files):
+            if name in BUILD_HASH_IGNORE or name.endswith('.eif'):
+                continue
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path).encode('utf-8') + b'\0')
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    digest.update(chunk)
+            digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def pcr_tuple(pcrs: Dict[Any, Any]) -> Tuple[str, ...]:
+    """
+    Normalize PCRs to a lowercase hex tuple in PCR_NAMES order. Accepts the
+    'pcr0' string keys used in deploy results as well as the integer keys and
+    raw bytes of an attestation document.
+    """
+    values = []
+    for name in PCR_NAMES:
+        value = pcrs.get(name, pcrs.get(int(name[3:])))
+        if value is None:
+            raise ValueError(f"Missing {name.upper()}")
+        values.append(value.hex() if isinstance(value, (bytes, bytearray)) else str(value).lower())
+    return tuple(values)
+
+
+class PCRAllowList:
+    """
+    Trusted PCR tuples, grouped by the build they came from.
+
+    The shared store holds build hash -> list of tuples (a build can have more
+    than one, e.g. after a re-sign). Lookups go through an in-memory
+    tuple -> build index, refreshed from the store at most every
+    `refresh_interval` seconds, so checking an enclave's PCRs is one dict
+    lookup.
+    """
+
+    def __init__(self, store=None, refresh_interval: float = 10):
+        self.store = store
+        self.refresh_interval = refresh_interval
+        self._index: Dict[Tuple[str, ...], str] = {}
+        self._loaded_at = float('-inf')
+
+    def _store(self):
+        if self.store is None:
+            self.store = get_store()
+        return self.store
+
+    def _refresh(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._loaded_at < self.refresh_interval:
+            return
+        index = {}
+        for build_hash, raw in self._store().hgetall(ALLOWLIST_KEY).items():
+            for pcrs in json.loads(raw):
+                index[tuple(pcrs)] = build_hash
+        self._index = index
+        self._loaded_at = now
+
+    def add(self, build_hash: str, pcrs: Dict[Any, Any]):
+        entry = list(pcr_tuple(pcrs))
+        store = self._store()
+        raw = store.hget(ALLOWLIST_KEY, build_hash)
+        trusted = json.loads(raw) if raw else []
+        if entry not in trusted:
+            trusted.append(entry)
+            store.hset(ALLOWLIST_KEY, build_hash, json.dumps(trusted))
+        self._index[tuple(entry)] = build_hash
+
+    def remove(self, build_hash: str):
+        self._store().hdel(ALLOWLIST_KEY, build_hash)
+        self._refresh(force=True)
+
+    def load_file(self, path: str):
+        """Merge a JSON file of {build_hash: [{"pcr0": ..., ...}, ...]}"""
+        with open(path) as f:
+            for build_hash, entries in json.load(f).items():
+                for pcrs in entries:
+                    self.add(build_hash, pcrs)
+
+    def lookup(self, pcrs: Dict[Any, Any]) -> Optional[str]:
+        """Build hash the PCRs are trusted for, or None"""
+        self._refresh()
+        return self._index.get(pcr_tuple(pcrs))
+
+    def builds(self) -> Dict[str, List[Dict[str, str]]]:
+        return {
+            build_hash: [dict(zip(PCR_NAMES, pcrs)) for pcrs in json.loads(raw)]
+            for build_hash, raw in self._store().hgetall(ALLOWLIST_KEY).items()
+        }
+
+
+class AttestationError(Exception):
+    """Raised when an attestation document fails verification"""
+
+
+@dataclass
+class VerificationResult:
+    verified: bool
+    build_hash: Optional[str] = None
+    reason: str = ''
+    cached: bool = False
+    pcrs: Optional[Dict[str, str]] = None
+
+
+class AttestationVerifier:
+    """
+    Verifies Nitro attestation documents and PCRs against the allow-list.
+
+    A document is a COSE_Sign1 structure (CBOR) whose payload carries the
+    PCRs, the signing certificate and the CA bundle up to the AWS Nitro root.
+    Full verification walks that certificate chain and checks the ECDSA
+    signature. The chain result is cached in the shared store for `cache_ttl`
+    seconds (never past the leaf certificate's expiry), keyed by the
+    certificates, and every cache entry carries an HMAC under
+    `cache_secret`, so an entry written to Redis by anything without the
+    secret is ignored rather than trusted. Repeat documents from the same
+    enclave then only need the signature check and an allow-list lookup.
+
+    Parsing documents needs the optional cbor2 package.
+    """
+
+    def __init__(
+        self,
+        allowlist: PCRAllowList,
+        root_cert_pem: Optional[bytes] = None,
+        cache_secret: Optional[bytes] = None,
+        cache_ttl: float = 3600,
+        max_age: float = 600,
+        store=None
+    ):
+        self.allowlist = allowlist
+        self.root_cert_pem = root_cert_pem
+        if not cache_secret:
+            # Without a shared secret each process only trusts its own entries
+            cache_secret = secrets.token_bytes(32)
+        self.cache_secret = cache_secret
+        self.cache_ttl = cache_ttl
+        self.max_age = max_age
+        self.store = store
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @classmethod
+    def from_env(cls) -> 'AttestationVerifier':
+        allowlist = PCRAllowList()
+        allowlist_path = os.getenv('ATTESTATION_ALLOWLIST_PATH')
+        if allowlist_path:
+            try:
+                allowlist.load_file(allowlist_path)
+            except (OSError, ValueError) as e:
+                logger.error(f"Error loading PCR allow-list from {allowlist_path}: {e}")
+
+        root_cert_pem = None
+        root_cert_path = os.getenv('NITRO_ROOT_CERT_PATH')
+        if root_cert_path:
+            with open(root_cert_path, 'rb') as f:
+                root_cert_pem = f.read()
+
+        secret = os.getenv('ATTESTATION_CACHE_SECRET', '')
+        return cls(
+            allowlist,
+            root_cert_pem=root_cert_pem,
+            cache_secret=secret.encode('utf-8') if secret else None,
+            cache_ttl=float(os.getenv('ATTESTATION_CACHE_TTL_SECONDS', '3600')),
+            max_age=float(os.getenv('ATTESTATION_MAX_AGE_SECONDS', '600'))
+        )
+
+    def _store(self):
+        if self.store is None:
+            self.store = get_store()
+        return self.store
+
+    def _sign(self, key: str, value: Dict[str, Any]) -> str:
+        message = key.encode('utf-8') + b'\0' + json.dumps(value, sort_keys=True).encode('utf-8')
+        return hmac.new(self.cache_secret, message, hashlib.sha256).hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = self._store().get(CACHE_KEY.format(key=key))
+        if not raw:
+            return None
+        try:
+            entry = json.loads(raw)
+            value, mac = entry['value'], entry['mac']
+        except (ValueError, KeyError, TypeError):
+            return None
+        if not hmac.compare_digest(mac, self._sign(key, value)) or value['expires_at'] <= time.time():
+            return None
+        return value
+
+    def _cache_set(self, key: str, value: Dict[str, Any]):
+        ttl = int(value['expires_at'] - time.time())
+        if ttl <= 0:
+            return
+        entry = {'value': value, 'mac': self._sign(key, value)}
+        self._store().set(CACHE_KEY.format(key=key), json.dumps(entry), ex=ttl)
+
+    def check_pcrs(self, pcrs: Dict[Any, Any]) -> VerificationResult:
+        try:
+            normalized = dict(zip(PCR_NAMES, pcr_tuple(pcrs)))
+        except ValueError as e:
+            return VerificationResult(verified=False, reason=str(e))
+        build_hash = self.allowlist.lookup(normalized)
+        if build_hash is None:
+            return VerificationResult(verified=False, reason='PCRs are not on the allow-list', pcrs=normalized)
+        return VerificationResult(verified=True, build_hash=build_hash, pcrs=normalized)
+
+    def verify_document(self, document: bytes, nonce: Optional[bytes] = None) -> VerificationResult:
+        try:
+            payload, cached = self._verify_signature(document)
+        except AttestationError as e:
+            return VerificationResult(verified=False, reason=str(e))
+
+        if nonce is not None and payload.get('nonce') != nonce:
+            return VerificationResult(verified=False, reason='Nonce mismatch', cached=cached)
+        timestamp = payload.get('timestamp', 0) / 1000
+        if self.max_age and time.time() - timestamp > self.max_age:
+            return VerificationResult(verified=False, reason='Attestation document is too old', cached=cached)
+
+        result = self.check_pcrs(payload.get('pcrs', {}))
+        result.cached = cached
+        return result
+
+    def _verify_signature(self, document: bytes) -> Tuple[Dict[str, Any], bool]:
+        """Check the COSE signature and certificate chain; returns (payload, chain came from cache)"""
+        try:
+            import cbor2
+        except ImportError:
+            raise AttestationError("cbor2 is not installed; only PCR checks are available")
+        from cryptography import x509
+        from cryptography.exceptions import InvalidSignature
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import ec
+        from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+
+        try:
+            cose = cbor2.loads(document)
+            if isinstance(cose, cbor2.CBORTag):
+                cose = cose.value
+            protected, _, raw_payload, signature = cose
+            payload = cbor2.loads(raw_payload)
+            leaf_der = payload['certificate']
+            cabundle = payload['cabundle']
+        except Exception as e:
+            raise AttestationError(f"Malformed attestation document: {e}")
+
+        chain_key = hashlib.sha256(leaf_der + b''.join(cabundle)).hexdigest()
+        chain_cached = self._cache_get(chain_key) is not None
+        if chain_cached:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+            not_after = self._verify_chain(leaf_der, cabundle, payload.get('timestamp', 0) / 1000)
+            self._cache_set(chain_key, {'expires_at': min(time.time() + self.cache_ttl, not_after)})
+
+        # The signature covers this document specifically, so it is always checked
+        leaf = x509.load_der_x509_certificate(leaf_der)
+        sig_structure = cbor2.dumps(['Signature1', protected, b'', raw_payload])
+        half = len(signature) // 2
+        der_signature = encode_dss_signature(
+            int.from_bytes(signature[:half], 'big'),
+            int.from_bytes(signature[half:], 'big')
+        )
+        try:
+            leaf.public_key().verify(der_signature, sig_structure, ec.ECDSA(hashes.SHA384()))
+        except InvalidSignature:
+            raise AttestationError("Invalid attestation document signature")
+        return payload, chain_cached
+
+    def _verify_chain(self, leaf_der: bytes, cabundle: List[bytes], at: float) -> float:
+        """Validate root -> intermediates -> leaf at time `at`; returns the earliest expiry"""
+        from cryptography import x509
+        from cryptography.exceptions import InvalidSignature
+        from cryptography.hazmat.primitives.asymmetric import ec
+
+        if not self.root_cert_pem:
+            raise AttestationError("NITRO_ROOT_CERT_PATH is not configured")
+        root = x509.load_pem_x509_certificate(self.root_cert_pem)
+        chain = [x509.load_der_x509_certificate(der) for der in cabundle]
+        if not chain or chain[0].fingerprint(chain[0].signature_hash_algorithm) != root.fingerprint(root.signature_hash_algorithm):
+            raise AttestationError("Certificate chain does not start at the trusted root")
+        chain.append(x509.load_der_x509_certificate(leaf_der))
+
+        when = datetime.fromtimestamp(at, tz=timezone.utc)
+        for issuer, cert in zip(chain, chain[1:]):
+            try:
+                issuer.public_key().verify(
+                    cert.signature,
+                    cert.tbs_certificate_bytes,
+                    ec.ECDSA(cert.signature_hash_algorithm)
+                )
+            except InvalidSignature:
+                raise AttestationError(f"Bad signature on certificate {cert.subject.rfc4514_string()}")
+        for cert in chain:
+            if not cert.not_valid_before_utc <= when <= cert.not_valid_after_utc:
+                raise AttestationError(f"Certificate {cert.subject.rfc4514_string()} is not valid at the document time")
+        return min(cert.not_valid_after_utc.timestamp() for cert in chain)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'trusted_builds': len(self.allowlist.builds()),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'root_configured': self.root_cert_pem is not None
+        }
+
+
+_verifier: Optional[AttestationVerifier] = None
+
+
+def get_attestation_verifier() -> AttestationVerifier:
+    global _verifier
+    if _verifier is None:
+        _verifier = AttestationVerifier.from_env()
+    return _verifier
+
+
+def decode_document(value: str) -> bytes:
+    return base64.b64decode(value, validate=True)
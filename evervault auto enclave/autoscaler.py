@@ -0,0 +1,433 @@
+"""
+Queue-depth-driven autoscaler for the deploy worker fleet.
+
+Every `interval` seconds the controller reads the broker queue depth, the
+admission bookkeeping (pending jobs and enclaves, age of the oldest job) and
+the moving average of per-enclave deploy time, works out how many workers it
+takes to clear the backlog within TARGET_DRAIN_SECONDS, and scales a local
+fleet of `celery worker` processes towards that within the configured bounds.
+Scaling in is graceful: the worker stops consuming the queue first and is
+only shut down once its running jobs finish (or DRAIN_TIMEOUT_SECONDS runs
+out, after which Celery's warm shutdown still lets the current task finish).
+
+    python autoscaler.py                    # manage worker processes on this host
+    python autoscaler.py --dry-run          # only log decisions
+    python autoscaler.py --simulate         # in-process fleet, MemoryStore and fake_ev.py
+
+The simulation needs no Redis or Evervault account: jobs go through a
+MemoryStore list standing in for the broker, simulated workers run each
+enclave through fake_ev.py, and the real metrics and policy code drive them.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+import logging
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, List, Optional
+from dotenv import load_dotenv
+from admission import AdmissionController, WORKER_SLOTS_KEY
+from store import get_store
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ScalingMetrics:
+    queue_depth: int
+    pending_jobs: int
+    pending_enclaves: int
+    oldest_job_age: float
+    enclave_seconds: float
+
+
+def collect_metrics(admission: AdmissionController, store=None, queue: str = 'celery') -> ScalingMetrics:
+    store = store or get_store()
+    snapshot = admission.snapshot()
+    try:
+        queue_depth = store.llen(queue)
+    except Exception as e:
+        logger.error(f"Error reading queue depth: {e}")
+        queue_depth = 0
+    return ScalingMetrics(
+        queue_depth=queue_depth,
+        pending_jobs=snapshot['pending_jobs'],
+        pending_enclaves=snapshot['pending_enclaves'],
+        oldest_job_age=snapshot['oldest_job_age'],
+        enclave_seconds=snapshot['enclave_seconds']
+    )
+
+
+class ScalingPolicy:
+    """
+    Works out the worker count for the current backlog.
+
+    Enough slots to deploy every pending enclave within `target_drain` seconds,
+    but no more workers than there are jobs to run (a job runs on one slot).
+    If the oldest job has waited past `max_job_age` the fleet grows by at
+    least one regardless. Scale-up is immediate (after `up_cooldown`) and
+    moves at most `max_step` workers at a time; scale-in happens one worker
+    at a time, and only once the lower count has been wanted for
+    `down_cooldown` seconds, so bursts don't make the fleet flap.
+    """
+
+    def __init__(
+        self,
+        min_workers: int = 1,
+        max_workers: int = 8,
+        concurrency: int = 1,
+        target_drain: float = 900,
+        max_job_age: float = 600,
+        up_cooldown: float = 30,
+        down_cooldown: float = 300,
+        max_step: int = 4
+    ):
+        self.min_workers = min_workers
+        self.max_workers = max(min_workers, max_workers)
+        self.concurrency = max(1, concurrency)
+        self.target_drain = target_drain
+        self.max_job_age = max_job_age
+        self.up_cooldown = up_cooldown
+        self.down_cooldown = down_cooldown
+        self.max_step = max(1, max_step)
+        self._last_change = float('-inf')
+        self._lower_since: Optional[float] = None
+
+    @classmethod
+    def from_env(cls) -> 'ScalingPolicy':
+        return cls(
+            min_workers=int(os.getenv('AUTOSCALE_MIN_WORKERS', '1')),
+            max_workers=int(os.getenv('AUTOSCALE_MAX_WORKERS', '8')),
+            concurrency=int(os.getenv('AUTOSCALE_WORKER_CONCURRENCY', '1')),
+            target_drain=float(os.getenv('TARGET_DRAIN_SECONDS', '900')),
+            max_job_age=float(os.getenv('AUTOSCALE_MAX_JOB_AGE_SECONDS', '600')),
+            up_cooldown=float(os.getenv('AUTOSCALE_UP_COOLDOWN_SECONDS', '30')),
+            down_cooldown=float(os.getenv('AUTOSCALE_DOWN_COOLDOWN_SECONDS', '300')),
+            max_step=int(os.getenv('AUTOSCALE_MAX_STEP', '4'))
+        )
+
+    def wanted(self, metrics: ScalingMetrics, current: int) -> int:
+        """Worker count for this backlog, before cooldowns and step limits"""
+        jobs = max(metrics.pending_jobs, metrics.queue_depth)
+        slots = math.ceil(metrics.pending_enclaves * metrics.enclave_seconds / self.target_drain)
+        workers = min(math.ceil(slots / self.concurrency), math.ceil(jobs / self.concurrency))
+        if jobs and metrics.oldest_job_age > self.max_job_age:
+            workers = max(workers, current + 1)
+        return min(self.max_workers, max(self.min_workers, workers))
+
+    def desired(self, metrics: ScalingMetrics, current: int, now: float = None) -> int:
+        now = now if now is not None else time.monotonic()
+        wanted = self.wanted(metrics, current)
+
+        if wanted > current:
+            self._lower_since = None
+            if now - self._last_change < self.up_cooldown:
+                return current
+            self._last_change = now
+            return min(wanted, current + self.max_step)
+
+        if wanted < current:
+            if self._lower_since is None:
+                self._lower_since = now
+            if now - self._lower_since < self.down_cooldown or now - self._last_change < self.down_cooldown:
+                return current
+            self._lower_since = now
+            self._last_change = now
+            return current - 1
+
+        self._lower_since = None
+        return current
+
+
+class LocalProcessActuator:
+    """
+    Runs deploy workers as `celery worker` processes on this host.
+
+    Scaling in picks the newest worker, tells it to stop consuming the queue
+    (cancel_consumer) and sends SIGTERM once it has no active tasks or
+    `drain_timeout` has passed. SIGTERM is Celery's warm shutdown, so a task
+    that is still running gets to finish.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 1,
+        queue: str = 'celery',
+        drain_timeout: float = 3600,
+        worker_args: List[str] = None,
+        cwd: str = None
+    ):
+        self.concurrency = concurrency
+        self.queue = queue
+        self.drain_timeout = drain_timeout
+        self.worker_args = worker_args or []
+        self.cwd = cwd or os.path.dirname(os.path.abspath(__file__))
+        self.workers: Dict[str, subprocess.Popen] = {}
+        self.draining: Dict[str, float] = {}
+        self._next_id = 0
+
+    def active(self) -> int:
+        return len(self.workers) - len(self.draining)
+
+    def _spawn(self):
+        self._next_id += 1
+        hostname = f"autoscale-{os.getpid()}-{self._next_id}@{socket.gethostname()}"
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'celery', '-A', 'celery_app', 'worker',
+             '--concurrency', str(self.concurrency), '--hostname', hostname,
+             '--queues', self.queue, '--loglevel', 'INFO', *self.worker_args],
+            cwd=self.cwd,
+            start_new_session=True
+        )
+        self.workers[hostname] = process
+        logger.info(f"Started worker {hostname} (pid {process.pid})")
+
+    def _drain(self, hostname: str):
+        from celery_app import celery_app
+        try:
+            celery_app.control.cancel_consumer(self.queue, destination=[hostname], reply=False)
+        except Exception as e:
+            logger.error(f"Error cancelling consumer on {hostname}: {e}")
+        self.draining[hostname] = time.monotonic() + self.drain_timeout
+        logger.info(f"Draining worker {hostname}")
+
+    def _is_idle(self, hostname: str) -> bool:
+        from celery_app import celery_app
+        try:
+            active = celery_app.control.inspect(destination=[hostname], timeout=1).active() or {}
+        except Exception as e:
+            logger.error(f"Error inspecting {hostname}: {e}")
+            return False
+        return not active.get(hostname)
+
+    def scale_to(self, desired: int):
+        while self.active() < desired:
+            # Workers already sent SIGTERM are on their way out and can't be resumed
+            resumable = [name for name, deadline in self.draining.items() if deadline != float('inf')]
+            if resumable:
+                # Put a draining worker back to work rather than starting a new one
+                from celery_app import celery_app
+                hostname = resumable[0]
+                celery_app.control.add_consumer(self.queue, destination=[hostname], reply=False)
+                del self.draining[hostname]
+                logger.info(f"Resumed draining worker {hostname}")
+            else:
+                self._spawn()
+        while self.active() > desired:
+            hostname = [name for name in self.workers if name not in self.draining][-1]
+            self._drain(hostname)
+
+    def reap(self):
+        """Shut down drained workers and forget exited ones"""
+        now = time.monotonic()
+        for hostname, process in list(self.workers.items()):
+            if process.poll() is not None:
+                logger.info(f"Worker {hostname} exited with {process.returncode}")
+                del self.workers[hostname]
+                self.draining.pop(hostname, None)
+            elif hostname in self.draining and self.draining[hostname] != float('inf'):
+                if now >= self.draining[hostname] or self._is_idle(hostname):
+                    logger.info(f"Stopping drained worker {hostname}")
+                    process.send_signal(signal.SIGTERM)
+                    self.draining[hostname] = float('inf')
+
+    def shutdown(self):
+        for process in self.workers.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        for process in self.workers.values():
+            process.wait()
+
+
+class Autoscaler:
+    def __init__(
+        self,
+        policy: ScalingPolicy,
+        actuator,
+        metrics_fn: Callable[[], ScalingMetrics],
+        interval: float = 15,
+        store=None,
+        dry_run: bool = False
+    ):
+        self.policy = policy
+        self.actuator = actuator
+        self.metrics_fn = metrics_fn
+        self.interval = interval
+        self.store = store
+        self.dry_run = dry_run
+        self._stopped = threading.Event()
+
+    def step(self) -> Dict[str, object]:
+        self.actuator.reap()
+        metrics = self.metrics_fn()
+        current = self.actuator.active()
+        desired = self.policy.desired(metrics, current)
+        if desired != current:
+            logger.info(f"Scaling workers {current} -> {desired} ({asdict(metrics)})")
+            if not self.dry_run:
+                self.actuator.scale_to(desired)
+        if not self.dry_run:
+            # Publish the slots of workers actually running; the TTL drops the
+            # value (back to WORKER_SLOTS) if the autoscaler itself dies
+            try:
+                (self.store or get_store()).set(
+                    WORKER_SLOTS_KEY,
+                    max(1, self.actuator.active() * self.policy.concurrency),
+                    ex=max(60, int(self.interval * 4))
+                )
+            except Exception as e:
+                logger.error(f"Error publishing worker slots: {e}")
+        return {'current': current, 'desired': desired, **asdict(metrics)}
+
+    def run(self):
+        if not self.dry_run:
+            self.actuator.scale_to(self.policy.min_workers)
+        while not self._stopped.is_set():
+            try:
+                self.step()
+            except Exception as e:
+                logger.error(f"Autoscaler step failed: {e}")
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+
+
+class SimulatedActuator:
+    """
+    In-process worker fleet for --simulate: each worker is a set of threads
+    that take jobs off a store list (the broker stand-in) and run every
+    enclave through fake_ev.py. Draining workers finish their current job
+    and exit.
+    """
+
+    def __init__(self, store, admission: AdmissionController, concurrency: int = 1, queue: str = 'celery'):
+        self.store = store
+        self.admission = admission
+        self.concurrency = concurrency
+        self.queue = queue
+        self.workers: List[threading.Event] = []
+        self.fake_ev = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_ev.py')]
+
+    def active(self) -> int:
+        return sum(1 for stop in self.workers if not stop.is_set())
+
+    def scale_to(self, desired: int):
+        while self.active() < desired:
+            stop = threading.Event()
+            self.workers.append(stop)
+            for _ in range(self.concurrency):
+                threading.Thread(target=self._work, args=(stop,), daemon=True).start()
+        while self.active() > desired:
+            next(stop for stop in reversed(self.workers) if not stop.is_set()).set()
+
+    def reap(self):
+        self.workers = [stop for stop in self.workers if not stop.is_set()]
+
+    def shutdown(self):
+        for stop in self.workers:
+            stop.set()
+
+    def _work(self, stop: threading.Event):
+        import tempfile
+        while not stop.is_set():
+            raw = self.store.lpop(self.queue)
+            if raw is None:
+                stop.wait(0.2)
+                continue
+            job = json.loads(raw)
+            with tempfile.TemporaryDirectory() as workdir:
+                open(os.path.join(workdir, 'Dockerfile'), 'w').close()
+                for i in range(job['enclaves']):
+                    started = time.time()
+                    name = f"sim-{job['id'][:8]}-{i}"
+                    subprocess.run([*self.fake_ev, 'enclave', 'init', '-f', 'Dockerfile', '--name', name],
+                                   cwd=workdir, capture_output=True)
+                    subprocess.run([*self.fake_ev, 'enclave', 'deploy'], cwd=workdir, capture_output=True)
+                    self.admission.record_enclave_duration(time.time() - started)
+            self.admission.release(job['id'])
+
+
+def simulate(args):
+    os.environ.setdefault('FAKE_EV_DEPLOY_SECONDS', str(args.sim_enclave_seconds))
+    os.environ.setdefault('FAKE_EV_STATE', os.path.join('/tmp', f'fake_ev_sim_{os.getpid()}.json'))
+    from store import MemoryStore
+    store = MemoryStore()
+    admission = AdmissionController.from_env()
+    admission.store = store
+    admission.max_pending_enclaves = 10 ** 6
+    admission.max_pending_per_caller = 10 ** 6
+    admission.max_estimated_wait = float('inf')
+    policy = ScalingPolicy.from_env()
+    actuator = SimulatedActuator(store, admission, policy.concurrency)
+    autoscaler = Autoscaler(policy, actuator, lambda: collect_metrics(admission, store), args.interval, store=store)
+    actuator.scale_to(policy.min_workers)
+
+    started = time.monotonic()
+    next_burst = started
+    peak = 0
+    while time.monotonic() - started < args.duration:
+        now = time.monotonic()
+        if now >= next_burst and now - started < args.duration - args.burst_every:
+            for _ in range(args.burst_jobs):
+                job = {'id': str(uuid.uuid4()), 'enclaves': random.randint(1, args.max_enclaves_per_job)}
+                admission.try_admit(job['id'], 'sim', job['enclaves'])
+                store.rpush('celery', json.dumps(job))
+            next_burst = now + args.burst_every
+        state = autoscaler.step()
+        peak = max(peak, state['desired'])
+        print(f"t={now - started:6.1f}s queue={state['queue_depth']:3d} pending_jobs={state['pending_jobs']:3d} "
+              f"pending_enclaves={state['pending_enclaves']:3d} oldest={state['oldest_job_age']:6.1f}s "
+              f"enclave_s={state['enclave_seconds']:5.2f} workers={state['current']}->{state['desired']}")
+        time.sleep(args.interval)
+    actuator.shutdown()
+    print(f"peak workers: {peak}, final workers: {actuator.active()}, "
+          f"jobs left: {admission.snapshot()['pending_jobs']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--interval', type=float, default=float(os.getenv('AUTOSCALE_INTERVAL_SECONDS', '15')))
+    parser.add_argument('--dry-run', action='store_true', help='log decisions without starting or stopping workers')
+    parser.add_argument('--simulate', action='store_true', help='run an in-process simulation with fake_ev.py')
+    parser.add_argument('--duration', type=float, default=120, help='simulation length in seconds')
+    parser.add_argument('--burst-jobs', type=int, default=20, help='jobs per simulated burst')
+    parser.add_argument('--burst-every', type=float, default=40, help='seconds between simulated bursts')
+    parser.add_argument('--max-enclaves-per-job', type=int, default=3)
+    parser.add_argument('--sim-enclave-seconds', type=float, default=1.0, help='fake_ev deploy time')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.simulate:
+        simulate(args)
+        return
+
+    policy = ScalingPolicy.from_env()
+    actuator = LocalProcessActuator(
+        concurrency=policy.concurrency,
+        drain_timeout=float(os.getenv('DRAIN_TIMEOUT_SECONDS', '3600'))
+    )
+    admission = AdmissionController.from_env()
+    autoscaler = Autoscaler(policy, actuator, lambda: collect_metrics(admission), args.interval, dry_run=args.dry_run)
+    signal.signal(signal.SIGTERM, lambda *_: autoscaler.stop())
+    try:
+        autoscaler.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        autoscaler.stop()
+        actuator.shutdown()
+
+
+if __name__ == '__main__':
+    main()
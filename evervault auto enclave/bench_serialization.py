@@ -0,0 +1,93 @@
+"""
+Compare broker and result-backend payload sizes for deploy tasks.
+
+Encodes a representative deploy_enclaves_task message and result the way
+Celery does (kombu serializers and compression) and prints the bytes that go
+over the broker and sit in Redis for each configuration.
+
+    python bench_serialization.py --enclaves 10
+"""
+import argparse
+import os
+import time
+import uuid
+from kombu import compression
+from kombu.serialization import dumps
+
+
+def task_body(args):
+    # Celery message protocol 2 body: (args, kwargs, embed)
+    return (args, {}, {'callbacks': None, 'errbacks': None, 'chain': None, 'chord': None})
+
+
+def result_meta(number_of_enclaves: int, app_uuid: str):
+    enclaves = []
+    for i in range(number_of_enclaves):
+        name = f"enclave-20250101000000-{i}"
+        enclaves.append({
+            'name': name,
+            'domain': f"{name}.{app_uuid}.enclave.evervault.com",
+            'pcrs': {f'pcr{n}': os.urandom(48).hex() for n in (0, 1, 2, 8)},
+            'uuid': str(uuid.uuid4())
+        })
+    return {
+        'status': 'SUCCESS',
+        'result': {
+            'status': 'completed',
+            'enclaves': enclaves,
+            'message': f"Successfully deployed {number_of_enclaves} enclaves"
+        },
+        'traceback': None,
+        'children': [],
+        'date_done': '2025-01-01T00:00:00.000000',
+        'task_id': str(uuid.uuid4())
+    }
+
+
+def encoded_size(obj, serializer: str, method: str = None):
+    _, _, payload = dumps(obj, serializer=serializer)
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    if method:
+        payload, _ = compression.compress(payload, method)
+    return len(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--enclaves', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    api_key = 'ev:key:' + os.urandom(32).hex()
+    app_uuid = 'app_' + os.urandom(6).hex()
+    room_id = str(uuid.uuid4())
+    old_task = task_body([room_id, args.enclaves, api_key, app_uuid])
+    new_task = task_body([room_id, args.enclaves, 'default'])
+    result = result_meta(args.enclaves, app_uuid)
+
+    serializers = ['json']
+    try:
+        import msgpack  # noqa: F401
+        serializers.append('msgpack')
+    except ImportError:
+        print("msgpack not installed, skipping it")
+
+    print(f"{'payload':<34}{'serializer':<12}{'compression':<13}{'bytes':>8}{'encode us':>11}")
+    rows = [
+        ('task message (credentials inline)', old_task),
+        ('task message (credential ref)', new_task),
+        (f'result ({args.enclaves} enclaves)', result),
+    ]
+    for label, obj in rows:
+        for serializer in serializers:
+            for method in (None, 'zlib'):
+                started = time.perf_counter()
+                for _ in range(args.iterations):
+                    size = encoded_size(obj, serializer, method)
+                elapsed_us = (time.perf_counter() - started) / args.iterations * 1e6
+                print(f"{label:<34}{serializer:<12}{method or '-':<13}{size:>8}{elapsed_us:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
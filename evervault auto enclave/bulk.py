@@ -0,0 +1,84 @@
+import json
+import os
+import logging
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TEMPLATES = {
+    'hello-enclave': 'https://github.com/evervault/hello-enclave'
+}
+
+
+def get_templates() -> Dict[str, str]:
+    """
+    Enclave source templates that can be deployed, by name.
+
+    ENCLAVE_TEMPLATES may add more as a JSON object of name -> git URL (or a
+    local directory, handy for testing).
+    """
+    templates = dict(DEFAULT_TEMPLATES)
+    extra = os.getenv('ENCLAVE_TEMPLATES')
+    if extra:
+        try:
+            templates.update(json.loads(extra))
+        except ValueError as e:
+            logger.error(f"Ignoring invalid ENCLAVE_TEMPLATES: {e}")
+    return templates
+
+
+@dataclass
+class BuildNode:
+    """Fetch and verify one template's source; shared by every instance of that template"""
+    template: str
+    source: str
+
+
+@dataclass
+class DeployNode:
+    """Initialize and deploy one enclave from an already built template"""
+    index: int
+    template: str
+    egress: bool
+    name_prefix: str
+
+
+@dataclass
+class BulkPlan:
+    builds: List[BuildNode]
+    deploys: List[DeployNode]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'builds': [asdict(build) for build in self.builds],
+            'deploys': [asdict(deploy) for deploy in self.deploys]
+        }
+
+
+def plan_bulk_job(specs: List[Dict[str, Any]], templates: Dict[str, str] = None) -> BulkPlan:
+    """
+    Turn a list of enclave specs into a two-level DAG: one build node per
+    distinct template, and one deploy node per enclave that depends only on
+    its template's build node.
+    """
+    templates = templates if templates is not None else get_templates()
+    builds = {}
+    deploys = []
+    for spec in specs:
+        template = spec.get('template', 'hello-enclave')
+        if template not in templates:
+            raise ValueError(f"Unknown enclave template: {template}")
+        if template not in builds:
+            builds[template] = BuildNode(template=template, source=templates[template])
+        for _ in range(spec.get('count', 1)):
+            deploys.append(DeployNode(
+                index=len(deploys),
+                template=template,
+                egress=spec.get('egress', True),
+                name_prefix=spec.get('name_prefix', 'enclave')
+            ))
+    return BulkPlan(builds=list(builds.values()), deploys=deploys)
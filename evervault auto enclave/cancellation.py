@@ -0,0 +1,134 @@
+import os
+import signal
+import subprocess
+import time
+import logging
+from typing import Callable, List, Optional
+from store import get_store
+
+logger = logging.getLogger(__name__)
+
+CANCEL_KEY = 'cancel:{job_id}'
+
+
+class JobCancelled(Exception):
+    """Raised inside a task once its job has been cancelled"""
+
+
+class WorkerDraining(Exception):
+    """Raised inside a task when its worker is shutting down and the job should move to another worker"""
+
+
+def request_cancel(job_id: str, ttl: int = 24 * 3600, store=None):
+    """Flag a job as cancelled; the running task notices within a poll interval"""
+    store = store or get_store()
+    store.set(CANCEL_KEY.format(job_id=job_id), time.time(), ex=ttl)
+
+
+class CancellationToken:
+    """
+    Checks a job's cancellation flag, hitting the store at most once per
+    `poll_interval` seconds.
+
+    `hand_off`, if given, is polled alongside; once it returns True, running
+    commands are stopped with WorkerDraining so the job can resume elsewhere.
+    """
+
+    def __init__(
+        self,
+        job_id: Optional[str],
+        poll_interval: float = 0.2,
+        store=None,
+        hand_off: Optional[Callable[[], bool]] = None
+    ):
+        self.job_id = job_id
+        self.poll_interval = poll_interval
+        self.store = store
+        self.hand_off = hand_off
+        self._cancelled = False
+        self._checked_at = 0.0
+
+    def is_cancelled(self) -> bool:
+        if self._cancelled or self.job_id is None:
+            return self._cancelled
+        now = time.monotonic()
+        if now - self._checked_at >= self.poll_interval:
+            self._checked_at = now
+            store = self.store or get_store()
+            self._cancelled = bool(store.exists(CANCEL_KEY.format(job_id=self.job_id)))
+        return self._cancelled
+
+    def should_hand_off(self) -> bool:
+        return self.hand_off is not None and self.hand_off()
+
+    def raise_if_cancelled(self):
+        if self.is_cancelled():
+            raise JobCancelled(f"Job {self.job_id} was cancelled")
+
+    def sleep(self, seconds: float):
+        """Sleep, waking up early (and raising) if the job is cancelled"""
+        deadline = time.monotonic() + seconds
+        while True:
+            self.raise_if_cancelled()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(self.poll_interval, remaining))
+
+
+def kill_process_group(process: subprocess.Popen, grace_period: float = 0.5):
+    """SIGTERM the process group, then SIGKILL whatever is left after the grace period"""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        process.wait(timeout=grace_period)
+    except subprocess.TimeoutExpired:
+        pass
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+
+def run_cancellable(args: List[str], token: CancellationToken, **kwargs) -> subprocess.CompletedProcess:
+    """
+    Equivalent of subprocess.run(args, capture_output=True, text=True, check=True)
+    that kills the whole process group as soon as the job is cancelled.
+
+    The command runs in its own session so CLI helpers it spawns (docker
+    builds, etc.) go down with it.
+    """
+    token.raise_if_cancelled()
+    process = subprocess.Popen(
+        args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        start_new_session=True,
+        **kwargs
+    )
+    try:
+        while True:
+            try:
+                stdout, stderr = process.communicate(timeout=token.poll_interval)
+                break
+            except subprocess.TimeoutExpired:
+                if token.is_cancelled():
+                    logger.info(f"Killing {args[:3]} (pid {process.pid}) for cancelled job {token.job_id}")
+                    kill_process_group(process)
+                    raise JobCancelled(f"Job {token.job_id} was cancelled")
+                if token.should_hand_off():
+                    logger.info(f"Stopping {args[:3]} (pid {process.pid}) to hand job {token.job_id} to another worker")
+                    kill_process_group(process)
+                    raise WorkerDraining(f"Worker is draining, handing off job {token.job_id}")
+    except BaseException:
+        if process.poll() is None:
+            kill_process_group(process)
+        raise
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, args, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
@@ -1,4 +1,4 @@
-from celery import Celery
+from celery import Celery, Task
 from dotenv import load_dotenv
 import os
 import logging
@@ -16,15 +16,59 @@ celery_app = Celery(
     backend=os.getenv('REDIS_URL', 'redis://localhost:6379/0')
 )
 
+# Serialization: msgpack is more compact than JSON for our payloads but is an
+# optional dependency, so fall back to JSON when it isn't installed
+serializer = os.getenv('CELERY_SERIALIZER', 'json')
+if serializer == 'msgpack':
+    try:
+        import msgpack  # noqa: F401
+    except ImportError:
+        logger.warning("msgpack is not installed, falling back to JSON serialization")
+        serializer = 'json'
+
 # Optional configurations
 celery_app.conf.update(
-    task_serializer='json',
-    accept_content=['json'],
-    result_serializer='json',
+    task_serializer=serializer,
+    # Accept both so workers and producers can be switched over one at a time
+    accept_content=['json', 'msgpack'],
+    result_serializer=serializer,
+    # Results carry the full enclave list with PCR hex strings; task messages
+    # are small, so only results are compressed
+    result_compression=os.getenv('CELERY_RESULT_COMPRESSION') or None,
+    result_expires=int(os.getenv('CELERY_RESULT_EXPIRES_SECONDS', '86400')),
     timezone='UTC',
     enable_utc=True,
+    # Acknowledge deploy jobs only once they finish, so a job on a worker that
+    # dies mid-deploy is redelivered (and resumes from its checkpoint). Each
+    # worker process reserves one job at a time so a draining worker isn't
+    # sitting on queued jobs another worker could start.
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    worker_prefetch_multiplier=1,
+    # Must exceed the longest deploy job, or Redis redelivers it while it's still running
+    broker_transport_options={'visibility_timeout': int(os.getenv('VISIBILITY_TIMEOUT_SECONDS', '14400'))},
 )
 
+
+class ExpiringResultTask(Task):
+    """
+    Task base class that shortens the lifetime of its stored result.
+
+    Set `result_ttl` (seconds) on the task to expire its result sooner than the
+    global result_expires.
+    """
+    result_ttl = None
+
+    def after_return(self, status, retval, task_id, args, kwargs, einfo):
+        if self.result_ttl is None or self.ignore_result:
+            return
+        backend = self.backend
+        if hasattr(backend, 'expire') and hasattr(backend, 'get_key_for_task'):
+            try:
+                backend.expire(backend.get_key_for_task(task_id), self.result_ttl)
+            except Exception as e:
+                logger.error(f"Error setting result expiry for task {task_id}: {e}")
+
 # Auto-discover tasks in all modules
 celery_app.autodiscover_tasks(['tasks'])
 
@@ -0,0 +1,207 @@
+import bisect
+import hashlib
+import json
+import os
+import re
+import subprocess
+import time
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+from store import get_store
+from limiter import is_transient_cli_error
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CREDENTIAL_REF = 'default'
+
+# The app's key being refused says something about the shard, unlike a broken
+# template or Dockerfile
+AUTH_ERROR_PATTERN = re.compile(
+    r'\b(?:401 unauthorized|403 forbidden)\b|status(?: code)?[ :=]+(?:401|403)\b'
+    r'|invalid api key|api key (?:is )?(?:invalid|revoked|expired)',
+    re.IGNORECASE
+)
+
+
+def is_shard_error(error: Exception) -> bool:
+    """Whether a failed CLI call should count against its credential shard's health"""
+    if not isinstance(error, subprocess.CalledProcessError):
+        return False
+    return is_transient_cli_error(error) or AUTH_ERROR_PATTERN.search(error.stderr or '') is not None
+
+
+@dataclass(frozen=True)
+class Credentials:
+    ref: str
+    api_key: str
+    app_uuid: str
+
+
+def resolve_credentials(ref: str = DEFAULT_CREDENTIAL_REF) -> Credentials:
+    """
+    Look up Evervault credentials by reference in this process's environment.
+
+    Task messages only carry the reference, so API keys never pass through
+    the broker or sit in Redis. 'default' maps to EVERVAULT_API_KEY and
+    EVERVAULT_APP_UUID; any other ref maps to EVERVAULT_API_KEY_<REF> and
+    EVERVAULT_APP_UUID_<REF>.
+    """
+    if ref == DEFAULT_CREDENTIAL_REF:
+        key_var, uuid_var = 'EVERVAULT_API_KEY', 'EVERVAULT_APP_UUID'
+    else:
+        if not re.fullmatch(r'[A-Za-z0-9_-]+', ref):
+            raise ValueError(f"Invalid credential reference: {ref!r}")
+        suffix = ref.upper().replace('-', '_')
+        key_var, uuid_var = f'EVERVAULT_API_KEY_{suffix}', f'EVERVAULT_APP_UUID_{suffix}'
+
+    api_key = os.getenv(key_var)
+    app_uuid = os.getenv(uuid_var)
+    missing_vars = [var for var, value in ((key_var, api_key), (uuid_var, app_uuid)) if not value]
+    if missing_vars:
+        raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
+
+    return Credentials(ref=ref, api_key=api_key, app_uuid=app_uuid)
+
+
+HEALTH_KEY = 'credentials:health'
+
+
+class CredentialPool:
+    """
+    Spreads deployments across several Evervault apps so they don't all share
+    one app's quotas.
+
+    The pool is a list of credential refs (EVERVAULT_CREDENTIAL_POOL, e.g.
+    "default,eu,us2"). Placement is either 'least_loaded' (fewest pending
+    enclaves, taken from the admission bookkeeping) or 'hash' (a consistent
+    hash ring keyed by tenant, so a tenant keeps landing on the same app and
+    adding a shard only moves about 1/n of tenants). Shards that fail
+    `failure_threshold` deployments in a row are skipped for `cooldown`
+    seconds; health lives in the shared store so every API process and
+    worker sees the same view.
+    """
+
+    def __init__(
+        self,
+        refs: List[str],
+        placement: str = 'least_loaded',
+        failure_threshold: int = 3,
+        cooldown: float = 300,
+        virtual_nodes: int = 64,
+        store=None
+    ):
+        if not refs:
+            raise ValueError("Credential pool is empty")
+        if placement not in ('least_loaded', 'hash'):
+            raise ValueError(f"Unknown credential placement: {placement!r}")
+        self.refs = list(dict.fromkeys(refs))
+        self.placement = placement
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.store = store
+        self.ring = sorted(
+            (self._hash(f"{ref}#{i}"), ref)
+            for ref in self.refs
+            for i in range(virtual_nodes)
+        )
+        self.ring_keys = [point for point, _ in self.ring]
+
+    @classmethod
+    def from_env(cls) -> 'CredentialPool':
+        refs = [ref.strip() for ref in os.getenv('EVERVAULT_CREDENTIAL_POOL', DEFAULT_CREDENTIAL_REF).split(',')]
+        return cls(
+            refs=[ref for ref in refs if ref],
+            placement=os.getenv('CREDENTIAL_PLACEMENT', 'least_loaded'),
+            failure_threshold=int(os.getenv('CREDENTIAL_FAILURE_THRESHOLD', '3')),
+            cooldown=float(os.getenv('CREDENTIAL_COOLDOWN_SECONDS', '300')),
+        )
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+    def _store(self):
+        if self.store is None:
+            self.store = get_store()
+        return self.store
+
+    def health(self) -> Dict[str, Dict[str, Any]]:
+        raw = self._store().hgetall(HEALTH_KEY)
+        now = time.time()
+        health = {}
+        for ref in self.refs:
+            entry = json.loads(raw[ref]) if ref in raw else {'failures': 0, 'unhealthy_until': 0}
+            entry['healthy'] = entry['unhealthy_until'] <= now
+            health[ref] = entry
+        return health
+
+    def healthy_refs(self) -> List[str]:
+        health = self.health()
+        healthy = [ref for ref in self.refs if health[ref]['healthy']]
+        # With every shard cooling down, trying one beats refusing all work
+        return healthy or list(self.refs)
+
+    def pick(self, tenant: str, loads: Dict[str, int] = None) -> str:
+        """Choose the credential ref for a tenant's next deployment"""
+        healthy = self.healthy_refs()
+        if len(healthy) == 1:
+            return healthy[0]
+
+        if self.placement == 'hash':
+            start = bisect.bisect(self.ring_keys, self._hash(tenant))
+            for offset in range(len(self.ring)):
+                ref = self.ring[(start + offset) % len(self.ring)][1]
+                if ref in healthy:
+                    return ref
+
+        loads = loads or {}
+        return min(healthy, key=lambda ref: (loads.get(ref, 0), self.refs.index(ref)))
+
+    def record_success(self, ref: str):
+        try:
+            self._store().hdel(HEALTH_KEY, ref)
+        except Exception as e:
+            logger.error(f"Error recording success for credential {ref}: {e}")
+
+    def record_failure(self, ref: str):
+        """Count a failed deployment; trip the shard after failure_threshold in a row"""
+        try:
+            store = self._store()
+            raw = store.hget(HEALTH_KEY, ref)
+            entry = json.loads(raw) if raw else {'failures': 0, 'unhealthy_until': 0}
+            entry['failures'] += 1
+            if entry['failures'] >= self.failure_threshold:
+                logger.warning(f"Credential {ref} failed {entry['failures']} times, skipping it for {self.cooldown}s")
+                entry['unhealthy_until'] = time.time() + self.cooldown
+            store.hset(HEALTH_KEY, ref, json.dumps(entry))
+        except Exception as e:
+            logger.error(f"Error recording failure for credential {ref}: {e}")
+
+    def stats(self, loads: Dict[str, int] = None) -> Dict[str, Any]:
+        loads = loads or {}
+        health = self.health()
+        return {
+            'placement': self.placement,
+            'shards': {
+                ref: {
+                    'pending_enclaves': loads.get(ref, 0),
+                    'healthy': health[ref]['healthy'],
+                    'consecutive_failures': health[ref]['failures']
+                }
+                for ref in self.refs
+            }
+        }
+
+
+_pool: Optional[CredentialPool] = None
+
+
+def get_credential_pool() -> CredentialPool:
+    global _pool
+    if _pool is None:
+        _pool = CredentialPool.from_env()
+    return _pool
@@ -0,0 +1,87 @@
+import json
+import os
+import time
+import logging
+from typing import Any, Dict, Optional
+from store import get_store
+
+logger = logging.getLogger(__name__)
+
+DRAIN_KEY = 'worker:draining:{hostname}'
+CHECKPOINT_KEY = 'checkpoint:{job_id}'
+
+
+def start_drain(hostname: str, deadline_seconds: float, store=None):
+    """Mark a worker as draining; its tasks hand off at the next stage boundary or at the deadline"""
+    store = store or get_store()
+    deadline = time.time() + deadline_seconds
+    # The flag outlives the deadline so late checks still see it; worker_ready clears it
+    store.set(DRAIN_KEY.format(hostname=hostname), deadline, ex=int(deadline_seconds) + 3600)
+    logger.info(f"Worker {hostname} draining, in-flight steps have {deadline_seconds:.0f}s to finish")
+
+
+def clear_drain(hostname: str, store=None):
+    store = store or get_store()
+    store.delete(DRAIN_KEY.format(hostname=hostname))
+
+
+class DrainState:
+    """
+    A task's view of whether its worker is draining.
+
+    The flag lives in the shared store because the shutdown signal arrives
+    in the worker's main process while tasks run in pool children. It is
+    read at most once per `poll_interval` seconds.
+    """
+
+    def __init__(self, hostname: Optional[str], poll_interval: float = 1.0, store=None):
+        self.hostname = hostname
+        self.poll_interval = poll_interval
+        self.store = store
+        self._deadline: Optional[float] = None
+        self._checked_at = float('-inf')
+
+    def _poll(self) -> Optional[float]:
+        if self._deadline is not None or self.hostname is None:
+            return self._deadline
+        now = time.monotonic()
+        if now - self._checked_at >= self.poll_interval:
+            self._checked_at = now
+            try:
+                value = (self.store or get_store()).get(DRAIN_KEY.format(hostname=self.hostname))
+            except Exception as e:
+                logger.error(f"Error reading drain flag: {e}")
+                value = None
+            if value:
+                self._deadline = float(value)
+        return self._deadline
+
+    def draining(self) -> bool:
+        """True once the worker is shutting down: don't start new stages"""
+        return self._poll() is not None
+
+    def deadline_passed(self) -> bool:
+        """True once in-flight stages have had their time: stop them and hand off"""
+        deadline = self._poll()
+        return deadline is not None and time.time() >= deadline
+
+
+def save_checkpoint(job_id: str, checkpoint: Dict[str, Any], ttl: Optional[int] = None, store=None):
+    """Persist a job's progress so whichever worker runs it next can resume"""
+    store = store or get_store()
+    ttl = ttl or int(os.getenv('CHECKPOINT_TTL_SECONDS', str(6 * 3600)))
+    store.set(CHECKPOINT_KEY.format(job_id=job_id), json.dumps(checkpoint), ex=ttl)
+
+
+def load_checkpoint(job_id: str, store=None) -> Optional[Dict[str, Any]]:
+    store = store or get_store()
+    raw = store.get(CHECKPOINT_KEY.format(job_id=job_id))
+    return json.loads(raw) if raw else None
+
+
+def clear_checkpoint(job_id: str, store=None):
+    store = store or get_store()
+    try:
+        store.delete(CHECKPOINT_KEY.format(job_id=job_id))
+    except Exception as e:
+        logger.error(f"Error clearing checkpoint for job {job_id}: {e}")
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import os
+import time
+import logging
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+from store import get_store
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_EVENTS = {'deployment_complete', 'deployment_error', 'deployment_cancelled'}
+
+JOB_ROOM_KEY = 'events:job:{job_id}'
+STREAM_KEY = 'events:stream:{room}'
+CLOSED_KEY = 'events:closed:{room}'
+
+
+class JobEventBus:
+    """
+    Log of the events relayed to each deployment room, kept in the shared store.
+
+    The relay publishes every room broadcast here as well, so plain HTTP
+    subscribers (Server-Sent Events) get the same feed as Socket.IO clients,
+    whichever relay process they reach and across relay restarts. Each room's
+    log is a stream capped at `max_events` entries, and stream ids double as
+    event ids so a subscriber can resume with Last-Event-ID. Logs live for
+    `ttl` seconds after the job is registered or last published to, so jobs
+    still waiting in the queue keep theirs; finished jobs are kept for
+    `retention` seconds for late or reconnecting subscribers.
+
+    Subscribers poll the stream every `poll_interval` seconds and are woken
+    straight away by events published from this process.
+    """
+
+    def __init__(
+        self,
+        max_events: int = 200,
+        retention: float = 600,
+        ttl: float = 86400,
+        poll_interval: float = 0.5,
+        store=None
+    ):
+        self.max_events = max_events
+        self.retention = retention
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.store = store
+        self._waiters: Dict[str, Set[asyncio.Event]] = {}
+
+    @classmethod
+    def from_env(cls) -> 'JobEventBus':
+        return cls(
+            max_events=int(os.getenv('JOB_EVENTS_MAX', '200')),
+            retention=float(os.getenv('JOB_EVENTS_RETENTION_SECONDS', '600')),
+            ttl=float(os.getenv('JOB_EVENTS_TTL_SECONDS', '86400')),
+            poll_interval=float(os.getenv('JOB_EVENTS_POLL_MS', '500')) / 1000
+        )
+
+    def _store(self):
+        return self.store or get_store()
+
+    def register_job(self, job_id: str, room: str):
+        self._store().set(JOB_ROOM_KEY.format(job_id=job_id), room, ex=int(self.ttl))
+
+    def room_for(self, job_id: str) -> Optional[str]:
+        return self._store().get(JOB_ROOM_KEY.format(job_id=job_id))
+
+    def publish(self, room: str, event: str, data: dict) -> str:
+        """Append an event to the room's log (blocking store calls) and return its id"""
+        store = self._store()
+        key = STREAM_KEY.format(room=room)
+        event_id = store.xadd(key, {'event': event, 'data': json.dumps(data)}, maxlen=self.max_events, approximate=False)
+        if event in TERMINAL_EVENTS:
+            store.expire(key, int(self.retention))
+            store.set(CLOSED_KEY.format(room=room), event_id, ex=int(self.retention))
+        else:
+            store.expire(key, int(self.ttl))
+        return event_id
+
+    async def publish_async(self, room: str, event: str, data: dict) -> str:
+        event_id = await asyncio.to_thread(self.publish, room, event, data)
+        for waiter in self._waiters.get(room, ()):
+            waiter.set()
+        return event_id
+
+    def read(self, room: str, after: str = '') -> List[Tuple[str, str, dict]]:
+        """Retained events after the given id, oldest first"""
+        entries = self._store().xrange(STREAM_KEY.format(room=room), min=after or '-', count=self.max_events + 1)
+        return [
+            (entry_id, fields['event'], json.loads(fields['data']))
+            for entry_id, fields in entries
+            if entry_id != after
+        ]
+
+    def is_closed(self, room: str) -> bool:
+        return bool(self._store().exists(CLOSED_KEY.format(room=room)))
+
+    async def subscribe(
+        self, room: str, last_event_id: str = '', heartbeat: float = 15
+    ) -> AsyncIterator[Optional[Tuple[str, str, dict]]]:
+        """
+        Yield retained events after last_event_id, then live ones until the job
+        finishes. Yields None every `heartbeat` seconds without events so the
+        caller can keep the connection alive.
+        """
+        wake = asyncio.Event()
+        self._waiters.setdefault(room, set()).add(wake)
+        try:
+            first = True
+            last_sent = time.monotonic()
+            while True:
+                items = await asyncio.to_thread(self.read, room, last_event_id)
+                for event_id, event, data in items:
+                    last_event_id = event_id
+                    last_sent = time.monotonic()
+                    yield event_id, event, data
+                    if event in TERMINAL_EVENTS:
+                        return
+                # Resuming after the final event: nothing more will come
+                if first and not items and await asyncio.to_thread(self.is_closed, room):
+                    return
+                first = False
+
+                if time.monotonic() - last_sent >= heartbeat:
+                    last_sent = time.monotonic()
+                    yield None
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                wake.clear()
+        finally:
+            waiters = self._waiters.get(room)
+            if waiters is not None:
+                waiters.discard(wake)
+                if not waiters:
+                    del self._waiters[room]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'event_rooms_subscribed': len(self._waiters),
+            'event_subscribers': sum(len(waiters) for waiters in self._waiters.values())
+        }
+
+
+def format_sse(event_id: str, event: str, data: dict) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,134 @@
+"""
+Simulated Evervault CLI for running the deploy pipeline locally.
+
+Implements the subset of `ev` the worker uses: --version, enclave ls --json,
+enclave init, enclave deploy and enclave delete. Deploys sleep for a configurable time and
+write random PCRs to enclave.toml; enclaves are remembered in a JSON state
+file so `ls` sees them.
+
+    EV_CLI="python /path/to/fake_ev.py" celery -A celery_app worker
+
+FAKE_EV_DEPLOY_SECONDS   simulated deploy time (default 5)
+FAKE_EV_INIT_SECONDS     simulated init time (default 0.2)
+FAKE_EV_FAILURE_RATE     fraction of init/deploy calls that fail with a
+                         transient 503 (default 0)
+FAKE_EV_STATE            state file (default /tmp/fake_ev_state.json)
+"""
+import fcntl
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+VERSION = 'ev 4.0.0 (simulated)'
+
+
+def state_path() -> str:
+    return os.getenv('FAKE_EV_STATE', '/tmp/fake_ev_state.json')
+
+
+def update_state(fn):
+    """Read-modify-write the state file under an exclusive lock"""
+    with open(state_path(), 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        raw = f.read()
+        state = json.loads(raw) if raw else {'enclaves': []}
+        result = fn(state)
+        f.seek(0)
+        f.truncate()
+        json.dump(state, f)
+        return result
+
+
+def maybe_fail():
+    if random.random() < float(os.getenv('FAKE_EV_FAILURE_RATE', '0')):
+        print('Error: 503 Service Unavailable', file=sys.stderr)
+        sys.exit(1)
+
+
+def option(args, name):
+    if name in args:
+        index = args.index(name)
+        if index + 1 < len(args):
+            return args[index + 1]
+    return None
+
+
+def enclave_ls():
+    print(json.dumps(update_state(lambda state: state['enclaves'])))
+
+
+def enclave_init(args):
+    dockerfile = option(args, '-f')
+    name = option(args, '--name')
+    if not dockerfile or not name:
+        print('Error: -f and --name are required', file=sys.stderr)
+        sys.exit(2)
+    if not os.path.exists(dockerfile):
+        print(f'Error: {dockerfile} not found', file=sys.stderr)
+        sys.exit(1)
+    time.sleep(float(os.getenv('FAKE_EV_INIT_SECONDS', '0.2')))
+    maybe_fail()
+    with open('enclave.toml', 'w') as f:
+        f.write(f'version = 1\nname = "{name}"\nuuid = "enclave_{uuid.uuid4().hex[:12]}"\n')
+        f.write(f'app_uuid = "{os.getenv("EV_APP_UUID", "app_simulated")}"\n')
+        f.write(f'dockerfile = "{dockerfile}"\n')
+        f.write(f'[egress]\nenabled = {"true" if "--egress" in args else "false"}\n')
+    print(f'Enclave {name} initialized')
+
+
+def enclave_deploy():
+    if not os.path.exists('enclave.toml'):
+        print('Error: enclave.toml not found, run ev enclave init first', file=sys.stderr)
+        sys.exit(1)
+    time.sleep(float(os.getenv('FAKE_EV_DEPLOY_SECONDS', '5')))
+    maybe_fail()
+    with open('enclave.toml') as f:
+        config = f.read()
+    name = next(line.split('=')[1].strip().strip('"') for line in config.splitlines() if line.startswith('name'))
+    with open('enclave.toml', 'a') as f:
+        f.write('[attestation]\n')
+        for pcr in (0, 1, 2, 8):
+            f.write(f'PCR{pcr} = "{os.urandom(48).hex()}"\n')
+    update_state(lambda state: state['enclaves'].append({'name': name}))
+    print(f'Enclave {name} deployed')
+
+
+def enclave_delete(args):
+    name = option(args, '--name')
+    if not name:
+        print('Error: --name is required', file=sys.stderr)
+        sys.exit(2)
+
+    def remove(state):
+        before = len(state['enclaves'])
+        state['enclaves'] = [enclave for enclave in state['enclaves'] if enclave['name'] != name]
+        return before != len(state['enclaves'])
+
+    if not update_state(remove):
+        print(f'Error: enclave {name} not found', file=sys.stderr)
+        sys.exit(1)
+    print(f'Enclave {name} deleted')
+
+
+def main(args):
+    if args[:1] == ['--version']:
+        print(VERSION)
+    elif args[:2] == ['enclave', 'ls']:
+        enclave_ls()
+    elif args[:2] == ['enclave', 'init']:
+        enclave_init(args[2:])
+    elif args[:2] == ['enclave', 'deploy']:
+        enclave_deploy()
+    elif args[:2] == ['enclave', 'delete']:
+        enclave_delete(args[2:])
+    else:
+        print(f'Error: unsupported command: {" ".join(args)}', file=sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
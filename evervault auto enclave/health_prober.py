@@ -0,0 +1,308 @@
+import asyncio
+import heapq
+import os
+import socket
+import time
+import uuid
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import aiohttp
+from dotenv import load_dotenv
+from registry import list_enclaves, update_enclave
+from store import get_store
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_URL_TEMPLATE = 'https://{name}.{app_uuid}.enclave.evervault.com/health'
+LEADER_KEY = 'health_prober:leader'
+
+
+@dataclass
+class ProbeState:
+    name: str
+    url: str
+    room: Optional[str] = None
+    status: str = 'unknown'
+    interval: float = 0.0
+    consecutive_failures: int = 0
+    last_latency: Optional[float] = None
+    last_checked: Optional[float] = None
+    last_error: Optional[str] = None
+    in_flight: bool = False
+
+
+class HealthProber:
+    """
+    Periodically calls /health on every registered enclave.
+
+    All probes share one keep-alive connection pool and at most `concurrency`
+    requests are in flight. Each enclave is probed on its own schedule: the
+    interval doubles (up to `max_interval`) while the enclave stays healthy and
+    drops back to `min_interval` as soon as a probe fails or the status changes.
+    An enclave is only marked unhealthy after `failure_threshold` consecutive
+    failures, so a single dropped request doesn't flap its status.
+    """
+
+    def __init__(
+        self,
+        url_template: str = DEFAULT_URL_TEMPLATE,
+        concurrency: int = 100,
+        timeout: float = 5.0,
+        min_interval: float = 10.0,
+        max_interval: float = 300.0,
+        failure_threshold: int = 3,
+        refresh_interval: float = 30.0,
+        lease_ttl: float = 30.0,
+        on_change: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+        source: Callable[[], List[Dict[str, Any]]] = list_enclaves,
+        sink: Callable[..., Any] = update_enclave
+    ):
+        self.url_template = url_template
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.failure_threshold = failure_threshold
+        self.refresh_interval = refresh_interval
+        self.lease_ttl = lease_ttl
+        self.on_change = on_change
+        self.source = source
+        self.sink = sink
+        self.states: Dict[str, ProbeState] = {}
+        self._schedule: List = []
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._tasks = set()
+        self._stopped = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self.probes_sent = 0
+
+    @classmethod
+    def from_env(cls, **kwargs) -> 'HealthProber':
+        return cls(
+            url_template=os.getenv('HEALTH_URL_TEMPLATE', DEFAULT_URL_TEMPLATE),
+            concurrency=int(os.getenv('HEALTH_PROBE_CONCURRENCY', '100')),
+            timeout=float(os.getenv('HEALTH_PROBE_TIMEOUT', '5')),
+            min_interval=float(os.getenv('HEALTH_PROBE_MIN_INTERVAL', '10')),
+            max_interval=float(os.getenv('HEALTH_PROBE_MAX_INTERVAL', '300')),
+            failure_threshold=int(os.getenv('HEALTH_PROBE_FAILURE_THRESHOLD', '3')),
+            refresh_interval=float(os.getenv('HEALTH_PROBE_REFRESH_INTERVAL', '30')),
+            lease_ttl=float(os.getenv('HEALTH_PROBER_LEASE_SECONDS', '30')),
+            **kwargs
+        )
+
+    def url_for(self, enclave: Dict[str, Any]) -> str:
+        return self.url_template.format(
+            name=enclave['name'],
+            app_uuid=enclave.get('app_uuid', ''),
+            domain=enclave.get('domain', '')
+        )
+
+    async def refresh(self):
+        """Pick up newly registered enclaves and forget removed ones"""
+        enclaves = await asyncio.to_thread(self.source)
+        now = time.monotonic()
+        seen = set()
+        for enclave in enclaves:
+            name = enclave['name']
+            seen.add(name)
+            if name not in self.states:
+                self.states[name] = ProbeState(
+                    name=name,
+                    url=self.url_for(enclave),
+                    room=enclave.get('room'),
+                    status=enclave.get('health', 'unknown'),
+                    interval=self.min_interval
+                )
+                heapq.heappush(self._schedule, (now, name))
+        for name in set(self.states) - seen:
+            del self.states[name]
+
+    async def probe(self, state: ProbeState):
+        async with self._semaphore:
+            started = time.monotonic()
+            healthy = False
+            error = None
+            try:
+                async with self._session.get(state.url) as response:
+                    await response.read()
+                    healthy = 200 <= response.status < 300
+                    if not healthy:
+                        error = f"HTTP {response.status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = str(e) or type(e).__name__
+            self.probes_sent += 1
+            await self._record(state, healthy, time.monotonic() - started, error)
+
+    async def _record(self, state: ProbeState, healthy: bool, latency: float, error: Optional[str]):
+        previous = state.status
+        state.last_latency = latency
+        state.last_checked = time.time()
+        state.last_error = error
+
+        if healthy:
+            state.consecutive_failures = 0
+            state.status = 'healthy'
+        else:
+            state.consecutive_failures += 1
+            if state.consecutive_failures >= self.failure_threshold:
+                state.status = 'unhealthy'
+
+        if healthy and previous == 'healthy':
+            state.interval = min(self.max_interval, state.interval * 2)
+        else:
+            state.interval = self.min_interval
+
+        if state.status != previous:
+            logger.info(f"Enclave {state.name} is now {state.status} ({error or 'ok'})")
+            record = await asyncio.to_thread(
+                self.sink,
+                state.name,
+                health=state.status,
+                health_checked_at=state.last_checked,
+                health_latency=latency,
+                health_error=error
+            )
+            if self.on_change and record is not None:
+                try:
+                    await self.on_change(record)
+                except Exception as e:
+                    logger.error(f"Error publishing health change for {state.name}: {e}")
+
+    def _launch(self, state: ProbeState):
+        state.in_flight = True
+
+        async def run():
+            try:
+                await self.probe(state)
+            except Exception as e:
+                logger.error(f"Error probing enclave {state.name}: {e}")
+            finally:
+                state.in_flight = False
+                if state.name in self.states:
+                    heapq.heappush(self._schedule, (time.monotonic() + state.interval, state.name))
+                    self._wakeup.set()
+
+        task = asyncio.create_task(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def run(self):
+        # Start from a clean slate; a process can take over probing more than once
+        self.states = {}
+        self._schedule = []
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300, keepalive_timeout=60)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        next_refresh = 0.0
+        try:
+            while not self._stopped.is_set():
+                now = time.monotonic()
+                if now >= next_refresh:
+                    try:
+                        await self.refresh()
+                    except Exception as e:
+                        logger.error(f"Error refreshing enclave list: {e}")
+                    next_refresh = now + self.refresh_interval
+
+                while self._schedule and self._schedule[0][0] <= now:
+                    _, name = heapq.heappop(self._schedule)
+                    state = self.states.get(name)
+                    if state is not None and not state.in_flight:
+                        self._launch(state)
+
+                next_due = self._schedule[0][0] if self._schedule else next_refresh
+                wait = max(0.0, min(next_due, next_refresh) - time.monotonic())
+                # Sleep until the next probe is due, or until a finished probe
+                # has put an earlier one on the schedule
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+        finally:
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self._session.close()
+
+    async def run_as_leader(self, store=None):
+        """
+        Run the prober in only one of several relay processes.
+
+        Each process tries to take a lease in the shared store. The holder
+        probes and renews the lease every lease_ttl / 3 seconds; the others
+        retry at the same interval and take over once the holder stops
+        renewing (it shut down or died).
+        """
+        store = store or get_store()
+        owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        ttl = max(1, int(self.lease_ttl))
+        renew_every = self.lease_ttl / 3
+
+        async def wait(seconds: float):
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout=seconds)
+            except asyncio.TimeoutError:
+                pass
+
+        while not self._stopped.is_set():
+            try:
+                acquired = await asyncio.to_thread(store.set, LEADER_KEY, owner, ex=ttl, nx=True)
+            except Exception as e:
+                logger.error(f"Error taking the health prober lease: {e}")
+                acquired = False
+            if not acquired:
+                await wait(renew_every)
+                continue
+
+            logger.info(f"Health prober lease taken by {owner}")
+            probing = asyncio.create_task(self.run())
+            try:
+                while not probing.done() and not self._stopped.is_set():
+                    await wait(renew_every)
+                    try:
+                        if await asyncio.to_thread(store.get, LEADER_KEY) != owner:
+                            logger.warning("Lost the health prober lease, stopping probes")
+                            break
+                        await asyncio.to_thread(store.expire, LEADER_KEY, ttl)
+                    except Exception as e:
+                        logger.error(f"Error renewing the health prober lease: {e}")
+            finally:
+                crashed = probing.done() and not probing.cancelled() and probing.exception() is not None
+                probing.cancel()
+                await asyncio.gather(probing, return_exceptions=True)
+                try:
+                    if await asyncio.to_thread(store.get, LEADER_KEY) == owner:
+                        await asyncio.to_thread(store.delete, LEADER_KEY)
+                except Exception as e:
+                    logger.error(f"Error releasing the health prober lease: {e}")
+            if crashed:
+                logger.error(f"Health prober stopped: {probing.exception()}")
+                await wait(renew_every)
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        counts = {}
+        for state in self.states.values():
+            counts[state.status] = counts.get(state.status, 0) + 1
+        return {
+            'enclaves': len(self.states),
+            'in_flight': sum(1 for state in self.states.values() if state.in_flight),
+            'probes_sent': self.probes_sent,
+            'status_counts': counts
+        }
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(HealthProber.from_env().run_as_leader())
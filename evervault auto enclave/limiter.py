@@ -0,0 +1,199 @@
+import os
+import random
+import re
+import subprocess
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+from typing import Callable, Optional, Tuple, Type, TypeVar
+from dotenv import load_dotenv
+from store import get_store
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Control-plane pushback in the CLI's stderr, as opposed to a problem with the
+# enclave itself. Status codes only count next to an HTTP phrase: stdout and
+# verbose output are full of hex digests and PCRs that contain "503" or "429"
+TRANSIENT_ERROR_PATTERN = re.compile(
+    r'\b(?:status(?: code)?|http(?:/[\d.]+)?)[ :=]+(?:429|500|502|503|504)\b'
+    r'|\b(?:429 too many requests|500 internal server error|502 bad gateway'
+    r'|503 service unavailable|504 gateway time-?out)\b'
+    r'|too many requests|rate limit(?:ed)?|service unavailable|bad gateway|gateway time-?out'
+    r'|(?:connection|request|operation) timed out|connection reset|connection refused'
+    r'|temporarily unavailable',
+    re.IGNORECASE
+)
+
+
+def is_transient_cli_error(error: Exception) -> bool:
+    if not isinstance(error, subprocess.CalledProcessError):
+        return False
+    return TRANSIENT_ERROR_PATTERN.search(error.stderr or '') is not None
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limiter shared by every worker through the store.
+
+    In-flight operations hold leases in a Redis hash (lease id -> expiry) so a
+    worker that dies mid-operation only holds its slot until the lease expires.
+    The limit grows by roughly one slot per window of fast successes and is
+    cut multiplicatively when an operation is slow or hits a transient error,
+    at most once per `decrease_cooldown` so a burst of failures from the same
+    incident counts once.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        store=None,
+        min_limit: float = 1,
+        max_limit: float = 8,
+        initial_limit: float = 2,
+        target_latency: float = 300,
+        decrease_factor: float = 0.5,
+        decrease_cooldown: float = 30,
+        lease_ttl: float = 3600,
+        poll_interval: float = 1.0
+    ):
+        self.name = name
+        self.store = store
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.initial_limit = initial_limit
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.leases_key = f'limiter:{name}:leases'
+        self.limit_key = f'limiter:{name}:limit'
+        self.decreased_key = f'limiter:{name}:last_decrease'
+
+    @classmethod
+    def from_env(cls, name: str, target_latency: float) -> 'AdaptiveLimiter':
+        prefix = f'LIMITER_{name.upper()}_'
+        return cls(
+            name,
+            min_limit=float(os.getenv(prefix + 'MIN', os.getenv('LIMITER_MIN', '1'))),
+            max_limit=float(os.getenv(prefix + 'MAX', os.getenv('LIMITER_MAX', '8'))),
+            initial_limit=float(os.getenv(prefix + 'INITIAL', os.getenv('LIMITER_INITIAL', '2'))),
+            target_latency=float(os.getenv(prefix + 'TARGET_LATENCY', str(target_latency))),
+        )
+
+    def _store(self):
+        if self.store is None:
+            self.store = get_store()
+        return self.store
+
+    def limit(self) -> float:
+        value = self._store().get(self.limit_key)
+        return float(value) if value else self.initial_limit
+
+    def in_flight(self) -> int:
+        store = self._store()
+        now = time.time()
+        leases = store.hgetall(self.leases_key)
+        expired = [lease for lease, expiry in leases.items() if float(expiry) <= now]
+        if expired:
+            logger.warning(f"Limiter {self.name}: reclaiming {len(expired)} expired leases")
+            store.hdel(self.leases_key, *expired)
+        return len(leases) - len(expired)
+
+    def try_acquire(self) -> Optional[str]:
+        if self.in_flight() >= int(self.limit()):
+            return None
+        lease = str(uuid.uuid4())
+        self._store().hset(self.leases_key, lease, time.time() + self.lease_ttl)
+        # Another worker may have taken the last slot at the same time; back
+        # out rather than exceed the limit
+        if self.in_flight() > int(self.limit()):
+            self._store().hdel(self.leases_key, lease)
+            return None
+        return lease
+
+    def acquire(self, timeout: Optional[float] = None, should_stop: Optional[Callable[[], bool]] = None) -> str:
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            lease = self.try_acquire()
+            if lease:
+                return lease
+            if should_stop and should_stop():
+                raise InterruptedError(f"Stopped waiting for limiter {self.name}")
+            if deadline is not None and time.time() >= deadline:
+                raise TimeoutError(f"Timed out waiting for limiter {self.name}")
+            # Jitter the poll so waiting workers don't retry in lockstep
+            time.sleep(self.poll_interval * random.uniform(0.5, 1.5))
+
+    def release(self, lease: str, latency: float, success: bool, overloaded: bool = False):
+        self._store().hdel(self.leases_key, lease)
+        limit = self.limit()
+        if overloaded or (success and latency > self.target_latency):
+            self._decrease(limit)
+        elif success:
+            self._store().set(self.limit_key, min(self.max_limit, limit + 1 / max(limit, 1)))
+
+    def _decrease(self, limit: float):
+        store = self._store()
+        last = store.get(self.decreased_key)
+        if last and time.time() - float(last) < self.decrease_cooldown:
+            return
+        new_limit = max(self.min_limit, limit * self.decrease_factor)
+        store.set(self.limit_key, new_limit)
+        store.set(self.decreased_key, time.time())
+        logger.warning(f"Limiter {self.name}: decreasing limit {limit:.2f} -> {new_limit:.2f}")
+
+    @contextmanager
+    def slot(self, should_stop: Optional[Callable[[], bool]] = None):
+        """Hold a slot for the duration of the block and report the outcome"""
+        lease = self.acquire(should_stop=should_stop)
+        started = time.time()
+        try:
+            yield
+        except Exception as e:
+            self.release(lease, time.time() - started, success=False, overloaded=is_transient_cli_error(e))
+            raise
+        else:
+            self.release(lease, time.time() - started, success=True)
+
+    def stats(self):
+        return {'name': self.name, 'limit': self.limit(), 'in_flight': self.in_flight()}
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Full-jitter exponential backoff"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def call_with_retries(
+    fn: Callable[[], T],
+    attempts: int = 4,
+    base_delay: float = 2.0,
+    max_delay: float = 60.0,
+    retry_if: Callable[[Exception], bool] = is_transient_cli_error,
+    retry_on: Tuple[Type[Exception], ...] = (Exception,),
+    sleep: Callable[[float], None] = time.sleep
+) -> T:
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except retry_on as e:
+            if attempt == attempts - 1 or not retry_if(e):
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            logger.warning(f"Transient error (attempt {attempt + 1}/{attempts}), retrying in {delay:.1f}s: {e}")
+            sleep(delay)
+
+
+_limiters = {}
+
+
+def get_limiter(name: str, target_latency: float) -> AdaptiveLimiter:
+    if name not in _limiters:
+        _limiters[name] = AdaptiveLimiter.from_env(name, target_latency)
+    return _limiters[name]
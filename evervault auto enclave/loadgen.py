@@ -0,0 +1,161 @@
+"""
+Connection-scale benchmark for the /deployment namespace.
+
+Opens many Socket.IO clients against a running relay, spreads them over rooms
+and drives synthetic deployment_update traffic from a publisher client (the
+role a Celery worker plays). Reports the relay's RSS per connection, broadcast
+latency percentiles and relay CPU time per event, using /metrics/rooms.
+
+    uvicorn main:app --port 8000
+    python loadgen.py --url http://localhost:8000 --clients 5000 --rooms 500 --events 2000
+
+Run the relay and the load generator on separate cores (or machines) so they
+don't compete for CPU; raise `ulimit -n` above the client count on both sides.
+
+The relay's own event-loop lag during the run comes from /metrics/loop; with
+--max-loop-lag-ms the run fails (exit status 1) when its p99 goes over the
+budget or the relay reports any blocked-loop stall.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+import aiohttp
+import socketio
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def fetch_metrics(session: aiohttp.ClientSession, url: str, path: str = '/metrics/rooms'):
+    async with session.get(f"{url}{path}") as response:
+        return await response.json()
+
+
+async def connect_client(url: str, room: str, transports, latencies: list):
+    client = socketio.AsyncClient(reconnection=False)
+    joined = asyncio.get_running_loop().create_future()
+
+    @client.on('joined', namespace='/deployment')
+    async def on_joined(data):
+        if not joined.done():
+            joined.set_result(data)
+
+    @client.on('deployment_update_client', namespace='/deployment')
+    async def on_update(data):
+        latencies.append((time.time() - data['sent_at']) * 1000)
+
+    await client.connect(url, namespaces=['/deployment'], transports=transports)
+    await client.emit('join', room, namespace='/deployment')
+    await joined
+    return client
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--rooms', type=int, default=100)
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--event-rate', type=float, default=200, help='events per second from the publisher')
+    parser.add_argument('--connect-batch', type=int, default=100, help='clients connected concurrently')
+    parser.add_argument('--transports', default='websocket', help='comma separated, e.g. polling,websocket')
+    parser.add_argument('--json', action='store_true', help='print the summary as JSON')
+    parser.add_argument('--max-loop-lag-ms', type=float, default=None,
+                        help="fail if the relay's p99 loop lag exceeds this or its loop stalls")
+    args = parser.parse_args()
+
+    transports = args.transports.split(',')
+    rooms = [str(uuid.uuid4()) for _ in range(args.rooms)]
+    latencies = []
+    clients = []
+
+    async with aiohttp.ClientSession() as session:
+        before = await fetch_metrics(session, args.url)
+        loop_before = await fetch_metrics(session, args.url, '/metrics/loop')
+
+        started = time.perf_counter()
+        for offset in range(0, args.clients, args.connect_batch):
+            batch = range(offset, min(offset + args.connect_batch, args.clients))
+            clients.extend(await asyncio.gather(*(
+                connect_client(args.url, rooms[i % args.rooms], transports, latencies) for i in batch
+            )))
+        connect_seconds = time.perf_counter() - started
+        connected = await fetch_metrics(session, args.url)
+
+        publisher = socketio.AsyncClient(reconnection=False)
+        await publisher.connect(args.url, namespaces=['/deployment'], transports=['websocket'])
+        interval = 1 / args.event_rate
+        started = time.perf_counter()
+        for seq in range(args.events):
+            await publisher.emit('deployment_update', {
+                'room': rooms[seq % args.rooms],
+                'status': 'deploying',
+                'message': 'loadgen',
+                'seq': seq,
+                'sent_at': time.time()
+            }, namespace='/deployment')
+            await asyncio.sleep(max(0.0, started + (seq + 1) * interval - time.perf_counter()))
+
+        expected = sum(
+            len(range(r, args.clients, args.rooms)) for r in (seq % args.rooms for seq in range(args.events))
+        )
+        deadline = time.perf_counter() + 30
+        while len(latencies) < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+        after = await fetch_metrics(session, args.url)
+        loop_after = await fetch_metrics(session, args.url, '/metrics/loop')
+
+        await publisher.disconnect()
+        for offset in range(0, len(clients), args.connect_batch):
+            await asyncio.gather(*(client.disconnect() for client in clients[offset:offset + args.connect_batch]))
+
+    summary = {
+        'clients': args.clients,
+        'rooms': args.rooms,
+        'transports': transports,
+        'connect_seconds': round(connect_seconds, 2),
+        'rss_per_connection_kb': round((connected['rss_bytes'] - before['rss_bytes']) / args.clients / 1024, 1),
+        'relay_rss_mb': round(connected['rss_bytes'] / 2**20, 1),
+        'events': args.events,
+        'deliveries': len(latencies),
+        'expected_deliveries': expected,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50), 2),
+            'p90': round(percentile(latencies, 90), 2),
+            'p99': round(percentile(latencies, 99), 2),
+            'max': round(max(latencies, default=0.0), 2)
+        },
+        'relay_cpu_ms_per_event': round(
+            (after['cpu_seconds'] - connected['cpu_seconds']) * 1000 / args.events, 3
+        ),
+        'relay_cpu_us_per_delivery': round(
+            (after['cpu_seconds'] - connected['cpu_seconds']) * 1e6 / max(1, len(latencies)), 1
+        ),
+        # p99 over the relay's recent window, which the run dominates
+        'relay_loop_lag_p99_ms': loop_after['lag_ms']['p99'],
+        'relay_loop_stalls': loop_after['blocked_total'] - loop_before['blocked_total']
+    }
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        for key, value in summary.items():
+            print(f"{key:>28}: {value}")
+
+    if args.max_loop_lag_ms is not None and (
+        summary['relay_loop_lag_p99_ms'] > args.max_loop_lag_ms or summary['relay_loop_stalls']
+    ):
+        print(f"FAIL: relay loop lag p99 {summary['relay_loop_lag_p99_ms']}ms "
+              f"(budget {args.max_loop_lag_ms}ms), {summary['relay_loop_stalls']} stalls", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,12 +1,36 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Header
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
 from pydantic import BaseModel, Field
 import os
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
 import socketio
 import uuid
-from tasks import deploy_enclaves_task
+from tasks import deploy_enclaves_task, deploy_bulk_task
+from bulk import plan_bulk_job
+from admission import get_admission_controller
+from credentials import resolve_credentials, get_credential_pool
+from cancellation import request_cancel
+from celery_app import celery_app
+from celery import states as celery_states
+from health_prober import HealthProber
+from rooms import RoomManager, RoomFull, current_rss_bytes
+from events import JobEventBus, format_sse
+from profiling import SamplingProfiler, ProfilingMiddleware, profiled, profiled_in_thread
+from loop_monitor import LoopMonitor
+from attestation import get_attestation_verifier, decode_document
+from registry import get_enclave
+from starlette.concurrency import run_in_threadpool
+from dataclasses import asdict
+import binascii
+import re
+from typing import Dict, List, Optional
+import asyncio
+import time
+from datetime import datetime, timezone
 import logging
+import logging.handlers
+import queue
 
 # Load environment variables
 load_dotenv()
@@ -16,16 +40,55 @@ logging_level = logging.DEBUG if os.getenv('DEBUG', 'false').lower() == 'true' e
 logging.basicConfig(level=logging_level)
 logger = logging.getLogger(__name__)
 
+# Relay handlers log on every event; while the app runs, records go through a
+# queue to a background thread so a slow stderr/log pipe can't stall the event loop
+log_queue = queue.SimpleQueue()
+log_listener: Optional[logging.handlers.QueueListener] = None
+log_handlers: List[logging.Handler] = []
+
+
+def start_log_listener():
+    global log_listener
+    if log_listener is not None:
+        return
+    root = logging.getLogger()
+    log_handlers[:] = root.handlers
+    log_listener = logging.handlers.QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    log_listener.start()
+
+
+def stop_log_listener():
+    """Put the original handlers back, then flush whatever is still queued"""
+    global log_listener
+    if log_listener is None:
+        return
+    logging.getLogger().handlers = list(log_handlers)
+    log_listener.stop()
+    log_listener = None
+
 # Create FastAPI app
 fastapi_app = FastAPI()
 
+# Opt-in profiling: requests with X-Profile: <PROFILE_TOKEN>, or a
+# PROFILE_SAMPLE_RATE fraction of requests and Socket.IO events
+profiler = SamplingProfiler.from_env()
+
 
-# Create Socket.IO server
+# Create Socket.IO server (see relay.production.env for the tuned production profile)
+message_queue = os.getenv('SIO_MESSAGE_QUEUE')
 sio = socketio.AsyncServer(
     async_mode='asgi',
     cors_allowed_origins='*',
     logger=logging_level == logging.DEBUG,
-    engineio_logger=logging_level == logging.DEBUG
+    engineio_logger=logging_level == logging.DEBUG,
+    ping_interval=float(os.getenv('SIO_PING_INTERVAL', '25')),
+    ping_timeout=float(os.getenv('SIO_PING_TIMEOUT', '20')),
+    transports=os.getenv('SIO_TRANSPORTS', 'polling,websocket').split(','),
+    max_http_buffer_size=int(os.getenv('SIO_MAX_HTTP_BUFFER_SIZE', '1000000')),
+    # Needed when running more than one relay worker so broadcasts reach
+    # clients connected to other processes
+    client_manager=socketio.AsyncRedisManager(message_queue) if message_queue else None
 )
 
 # Add CORS middleware
@@ -36,14 +99,58 @@ fastapi_app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+fastapi_app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+MAX_ENCLAVES_PER_REQUEST = int(os.getenv('MAX_ENCLAVES_PER_REQUEST', '10'))
 
 class EnclaveRequest(BaseModel):
-    number_of_enclaves: int = Field(..., gt=0, description="Number of enclaves to deploy")
+    number_of_enclaves: int = Field(
+        ...,
+        gt=0,
+        le=MAX_ENCLAVES_PER_REQUEST,
+        description="Number of enclaves to deploy"
+    )
+
+class BulkEnclaveSpec(BaseModel):
+    template: str = Field('hello-enclave', description="Template name (see ENCLAVE_TEMPLATES)")
+    egress: bool = Field(True, description="Enable egress for these enclaves")
+    name_prefix: str = Field(
+        'enclave',
+        pattern=r'^[a-z][a-z0-9-]{0,30}$',
+        description="Prefix for the generated enclave names"
+    )
+    count: int = Field(1, gt=0, description="Number of enclaves with this spec")
+
+class BulkDeployRequest(BaseModel):
+    enclaves: List[BulkEnclaveSpec] = Field(..., min_length=1)
+
+class VerifyItem(BaseModel):
+    name: Optional[str] = Field(None, description="Registered enclave name; its recorded PCRs are checked")
+    attestation_document: Optional[str] = Field(None, description="Base64 COSE_Sign1 attestation document")
+    pcrs: Optional[Dict[str, str]] = Field(None, description="PCRs to check, e.g. {'pcr0': '...'}")
+    nonce: Optional[str] = Field(None, description="Hex nonce the document must carry")
+
+class VerifyRequest(BaseModel):
+    enclaves: List[VerifyItem] = Field(..., min_length=1, max_length=int(os.getenv('MAX_VERIFY_BATCH', '256')))
 
 class JobResponse(BaseModel):
     job_id: str
     socket_room: str
     socket_server_url: str
+    estimated_wait_seconds: float = 0.0
+    estimated_start_time: str = ''
+
+
+def get_caller_id(request: Request) -> str:
+    """Identify the caller for per-caller quotas"""
+    caller = request.headers.get('X-Caller-ID')
+    if caller:
+        return caller
+    return request.client.host if request.client else 'unknown'
+
+
+def isoformat(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat()
 
 
 @fastapi_app.get("/")
@@ -51,37 +158,87 @@ async def root():
     return {"message": "Hello World"}
 
 
-@fastapi_app.post("/deploy-enclaves", response_model=JobResponse)
-async def deploy_enclaves(request: EnclaveRequest):
+# Endpoints that call the (blocking) store or broker are plain functions, so
+# FastAPI runs them in its threadpool instead of on the event loop.
+# profiled_in_thread lets a request's profile sample that worker thread
+
+@fastapi_app.get("/health/queue")
+@profiled_in_thread(profiler)
+def queue_health():
+    """Queue health for load balancers: 503 while this deployment queue is saturated"""
+    snapshot = get_admission_controller().snapshot()
+    return JSONResponse(status_code=503 if snapshot['saturated'] else 200, content=snapshot)
+
+
+def start_deployment(task, build_args, number_of_enclaves: int, http_request: Request) -> JobResponse:
+    """
+    Admit a deployment job and queue it. build_args(room_id, credential_ref)
+    returns the Celery task args.
+    """
     try:
-        # Get credentials from environment variables
-        api_key = os.getenv("EVERVAULT_API_KEY")
-        app_uuid = os.getenv("EVERVAULT_APP_UUID")
+        # Place the job on one of the configured Evervault apps
+        admission = get_admission_controller()
+        caller = get_caller_id(http_request)
+        credential_ref = get_credential_pool().pick(caller, admission.shard_loads())
 
-        if not api_key or not app_uuid:
-            raise HTTPException(
-                status_code=500,
-                detail="Missing required environment variables: EVERVAULT_API_KEY and/or EVERVAULT_APP_UUID"
-            )
+        # Fail fast if the credentials aren't configured; the worker resolves
+        # the same reference itself, so the keys never go through the broker
+        try:
+            credentials = resolve_credentials(credential_ref)
+        except ValueError as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
         # Generate unique room ID for this deployment
         room_id = str(uuid.uuid4())
+        job_id = str(uuid.uuid4())
 
-        # Start Celery task
-        task = deploy_enclaves_task.delay(
-            room_id,
-            request.number_of_enclaves,
-            api_key,
-            app_uuid
+        # Refuse work we can't start in a reasonable time instead of queueing it
+        decision = admission.try_admit(
+            job_id,
+            caller,
+            number_of_enclaves,
+            shard=credentials.ref
         )
+        if not decision.admitted:
+            logger.warning(f"Rejecting deployment request: {decision.reason}")
+            raise HTTPException(
+                status_code=decision.status_code,
+                detail={
+                    'message': decision.reason,
+                    'retry_after_seconds': decision.retry_after,
+                    'estimated_wait_seconds': decision.estimated_wait,
+                    'estimated_start_time': isoformat(decision.estimated_start_time),
+                    **decision.details
+                },
+                headers={'Retry-After': str(decision.retry_after)}
+            )
+
+        # Register the job's room before queueing it, so every queued job can
+        # be cancelled and followed; if either step fails nothing is queued
+        # and the admission slot is given back
+        try:
+            event_bus.register_job(job_id, room_id)
+            result = task.apply_async(
+                args=build_args(room_id, credentials.ref),
+                # The worker profiles the task too when the caller asked for it
+                kwargs={'profile': True} if profiler.check_token(http_request.headers.get('X-Profile')) else {},
+                task_id=job_id
+            )
+        except Exception:
+            admission.release(job_id)
+            raise
 
         socket_server_url = os.getenv('SOCKET_IO_SERVER_URL', 'http://localhost:8000')
         return JobResponse(
-            job_id=task.id,
+            job_id=result.id,
             socket_room=room_id,
-            socket_server_url=socket_server_url
+            socket_server_url=socket_server_url,
+            estimated_wait_seconds=decision.estimated_wait,
+            estimated_start_time=isoformat(decision.estimated_start_time)
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error starting deployment: {str(e)}")
         raise HTTPException(
@@ -89,66 +246,329 @@ async def deploy_enclaves(request: EnclaveRequest):
             detail=f"Error starting deployment: {str(e)}"
         )
 
+
+@fastapi_app.get("/health/credentials")
+@profiled_in_thread(profiler)
+def credentials_health():
+    """Pending load and health of each credential shard"""
+    return get_credential_pool().stats(get_admission_controller().shard_loads())
+
+
+def require_profile_token(token: Optional[str]):
+    if not profiler.token:
+        raise HTTPException(status_code=404, detail="Profiling is not enabled")
+    if not profiler.check_token(token):
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+
+# Plain functions: listing profiles is file I/O, so it runs in the threadpool
+@fastapi_app.get("/admin/profiles")
+def list_profiles(x_profile: Optional[str] = Header(None)):
+    """Profiles written by this process (workers write theirs to their own PROFILE_DIR)"""
+    require_profile_token(x_profile)
+    return {"profiles": profiler.list_profiles()}
+
+
+@fastapi_app.get("/admin/profiles/{name}")
+def get_profile(name: str, x_profile: Optional[str] = Header(None)):
+    """Download a profile in folded format (feed it to flamegraph.pl or speedscope)"""
+    require_profile_token(x_profile)
+    path = profiler.profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain", filename=name)
+
+
+@fastapi_app.post("/deploy-enclaves", response_model=JobResponse)
+@profiled_in_thread(profiler)
+def deploy_enclaves(request: EnclaveRequest, http_request: Request):
+    return start_deployment(
+        deploy_enclaves_task,
+        lambda room_id, credential_ref: (room_id, request.number_of_enclaves, credential_ref),
+        request.number_of_enclaves,
+        http_request
+    )
+
+
+@fastapi_app.post("/deploy-enclaves/bulk", response_model=JobResponse)
+@profiled_in_thread(profiler)
+def deploy_enclaves_bulk(request: BulkDeployRequest, http_request: Request):
+    """
+    Deploy a mix of enclaves (different templates, egress settings and name
+    prefixes) as one job. Each distinct template is fetched once and shared by
+    all of its enclaves.
+    """
+    total = sum(spec.count for spec in request.enclaves)
+    if total > MAX_ENCLAVES_PER_REQUEST:
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {MAX_ENCLAVES_PER_REQUEST} enclaves per request, got {total}"
+        )
+    specs = [spec.model_dump() for spec in request.enclaves]
+    try:
+        plan_bulk_job(specs)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    return start_deployment(
+        deploy_bulk_task,
+        lambda room_id, credential_ref: (room_id, specs, credential_ref),
+        total,
+        http_request
+    )
+
+async def publish_enclave_health(record):
+    """Tell the room that deployed an enclave when its health changes"""
+    if record.get('room'):
+        data = {
+            'room': record['room'],
+            'name': record['name'],
+            'health': record['health'],
+            'error': record.get('health_error')
+        }
+        await event_bus.publish_async(record['room'], 'enclave_health', data)
+        await sio.emit('enclave_health_client', data, room=record['room'], namespace='/deployment')
+
+
+health_prober = HealthProber.from_env(on_change=publish_enclave_health)
+room_manager = RoomManager.from_env()
+event_bus = JobEventBus.from_env()
+background_tasks = []
+loop_monitor = LoopMonitor.from_env()
+
+
+@fastapi_app.get("/health/enclaves")
+async def enclaves_health():
+    return health_prober.stats()
+
+
+@fastapi_app.get("/metrics/rooms")
+async def rooms_metrics():
+    return {
+        **room_manager.stats(),
+        **event_bus.stats(),
+        'rss_bytes': current_rss_bytes(),
+        'cpu_seconds': time.process_time()
+    }
+
+
+def verify_item(item: VerifyItem) -> Dict:
+    verifier = get_attestation_verifier()
+    if item.attestation_document:
+        try:
+            document = decode_document(item.attestation_document)
+            nonce = bytes.fromhex(item.nonce) if item.nonce else None
+        except (binascii.Error, ValueError) as e:
+            return {'name': item.name, 'verified': False, 'reason': f"Invalid encoding: {e}"}
+        result = verifier.verify_document(document, nonce)
+    elif item.pcrs:
+        result = verifier.check_pcrs(item.pcrs)
+    elif item.name:
+        record = get_enclave(item.name)
+        if record is None or not record.get('pcrs'):
+            return {'name': item.name, 'verified': False, 'reason': 'Unknown enclave'}
+        result = verifier.check_pcrs(record['pcrs'])
+    else:
+        return {'name': None, 'verified': False, 'reason': 'Nothing to verify'}
+    return {'name': item.name, **asdict(result)}
+
+
+@fastapi_app.post("/verify")
+async def verify_enclaves(request: VerifyRequest):
+    """
+    Verify a batch of enclaves: attestation documents (signature, certificate
+    chain, nonce, freshness and PCRs), bare PCRs, or registered enclaves by
+    name. PCRs must match a trusted tuple on the allow-list.
+    """
+    # Signature checks are CPU work, so keep them off the event loop
+    results = await run_in_threadpool(profiled_in_thread(profiler)(lambda: [verify_item(item) for item in request.enclaves]))
+    return {
+        'results': results,
+        'verified': sum(1 for result in results if result['verified']),
+        'failed': sum(1 for result in results if not result['verified'])
+    }
+
+
+@fastapi_app.get("/attestation/allowlist")
+@profiled_in_thread(profiler)
+def attestation_allowlist():
+    """Trusted PCR tuples by build hash, plus verifier cache stats"""
+    verifier = get_attestation_verifier()
+    return {'builds': verifier.allowlist.builds(), **verifier.stats()}
+
+
+@fastapi_app.get("/metrics/loop")
+async def loop_metrics():
+    """Event-loop lag histogram and the stacks of recent loop stalls"""
+    return loop_monitor.stats()
+
+
+@fastapi_app.get("/jobs/{job_id}/events")
+async def job_events(
+    job_id: str,
+    last_event_id: Optional[str] = Header(None, alias='Last-Event-ID')
+):
+    """Server-Sent Events feed of a job's progress, resumable with Last-Event-ID"""
+    room = await asyncio.to_thread(event_bus.room_for, job_id)
+    if room is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    after = last_event_id or ''
+    if after and not re.fullmatch(r'\d+-\d+', after):
+        raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+
+    async def stream():
+        yield "retry: 3000\n\n"
+        async for item in event_bus.subscribe(room, after):
+            if item is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield format_sse(*item)
+
+    return StreamingResponse(
+        stream(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+async def on_startup():
+    start_log_listener()
+    await loop_monitor.start()
+    background_tasks.append(asyncio.create_task(evict_idle_rooms()))
+    if os.getenv('ENABLE_HEALTH_PROBER', 'false').lower() == 'true':
+        logger.info("Starting enclave health prober")
+        # Every relay process starts it; only the lease holder actually probes
+        background_tasks.append(asyncio.create_task(health_prober.run_as_leader()))
+
+
+async def on_shutdown():
+    health_prober.stop()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await loop_monitor.stop()
+    stop_log_listener()
+
+
+@fastapi_app.delete("/jobs/{job_id}", status_code=202)
+@profiled_in_thread(profiler)
+def cancel_job(job_id: str):
+    """
+    Cancel a deployment. A running task kills its CLI subprocess group and
+    reports deployment_cancelled to the room; a queued one is revoked. Jobs
+    that have already finished get a 409 with their final state.
+
+    The job keeps its admission slot until the worker has actually stopped it
+    (the task releases it on its way out, or on_task_revoked does for a job
+    that never started).
+    """
+    # Every job started here registers its room, so that doubles as the list of known jobs
+    room = event_bus.room_for(job_id)
+    if room is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    # The result may have expired already; a closed event log still means the job is over
+    state = celery_app.AsyncResult(job_id).state
+    if state in celery_states.READY_STATES or event_bus.is_closed(room):
+        raise HTTPException(
+            status_code=409,
+            detail={'message': f"Job {job_id} has already finished", 'job_id': job_id, 'status': state}
+        )
+    try:
+        request_cancel(job_id)
+        celery_app.control.revoke(job_id)
+    except Exception as e:
+        logger.error(f"Error cancelling job {job_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error cancelling job: {str(e)}")
+    return {'job_id': job_id, 'status': 'cancelling'}
+
+
 @sio.on('connect', namespace='/deployment')
 async def connect(sid, environ):
     logger.info(f"Client connected: {sid}")
 
 @sio.on('join', namespace='/deployment')
+@profiled(profiler, 'sio:join')
 async def join(sid, room):
     logger.info(f"Client {sid} joining room: {room}")
+    try:
+        room_manager.join(sid, room)
+    except RoomFull as e:
+        logger.warning(f"Rejecting join from {sid}: {e}")
+        await sio.emit('join_error', {'room': room, 'error': str(e)}, room=sid, namespace='/deployment')
+        return
     await sio.enter_room(sid, room, namespace='/deployment')
-    # Get all rooms for this sid to verify
-    rooms = await sio.rooms(sid, namespace='/deployment')
-    logger.info(f"Client {sid} is now in rooms: {rooms}")
     await sio.emit('joined', {'room': room, 'sid': sid}, room=sid, namespace='/deployment')
-    logger.info(f"Client {sid} joined room {room}")
+    logger.info(f"Client {sid} joined room {room} ({room_manager.subscribers(room)} subscribers)")
+
+
+async def broadcast(event, data, terminal=False):
+    """Relay a worker event to its room, closing the room after terminal events"""
+    room = data.get('room')
+    if not room:
+        logger.error(f"No room specified in {event}")
+        return
+    logger.debug(f"Broadcasting {event} to room {room}: {data}")
+    room_manager.touch(room)
+    await event_bus.publish_async(room, event, data)
+    await sio.emit(f'{event}_client', data, room=room, namespace='/deployment')
+    if terminal:
+        room_manager.close(room)
+        await sio.close_room(room, namespace='/deployment')
+        logger.info(f"Closed room {room} after {event}")
 
 
 @sio.on('deployment_update', namespace='/deployment')
+@profiled(profiler, 'sio:deployment_update')
 async def deployment_update(sid, data):
-    logger.info(f"Deployment update received: {data}")
-    room = data.get('room')
-    if room:
-        logger.info(f"Broadcasting update to room {room}")
-        # print all the connected clients to this room 
-        logger.info(f"Connected clients to room {room}: {sio.rooms(room, namespace='/deployment')}")
-        await sio.emit('deployment_update_client', data, room=room, namespace='/deployment')
-    else:
-        logger.error("No room specified in deployment update")
+    await broadcast('deployment_update', data)
 
 @sio.on('deployment_complete', namespace='/deployment')
+@profiled(profiler, 'sio:deployment_complete')
 async def deployment_complete(sid, data):
-    logger.info(f"Deployment complete received: {data}")
-    room = data.get('room')
-    if room:
-        logger.info(f"Broadcasting completion to room {room}")
-        await sio.emit('deployment_complete_client', data, room=room, namespace='/deployment')
-    else:
-        logger.error("No room specified in deployment complete")
+    logger.info(f"Deployment complete received for room {data.get('room')}")
+    await broadcast('deployment_complete', data, terminal=True)
 
 @sio.on('deployment_error', namespace='/deployment')
+@profiled(profiler, 'sio:deployment_error')
 async def deployment_error(sid, data):
-    logger.info(f"Deployment error received: {data}")
-    room = data.get('room')
-    if room:
-        logger.info(f"Broadcasting error to room {room}")
-        await sio.emit('deployment_error_client', data, room=room, namespace='/deployment')
-    else:
-        logger.error("No room specified in deployment error")
+    logger.info(f"Deployment error received for room {data.get('room')}")
+    await broadcast('deployment_error', data, terminal=True)
+
+@sio.on('deployment_cancelled', namespace='/deployment')
+@profiled(profiler, 'sio:deployment_cancelled')
+async def deployment_cancelled(sid, data):
+    logger.info(f"Deployment cancelled received for room {data.get('room')}")
+    await broadcast('deployment_cancelled', data, terminal=True)
 
 @sio.on('disconnect', namespace='/deployment')
 async def disconnect(sid):
+    room_manager.disconnect(sid)
     logger.info(f"Client disconnected: {sid}")
 
 @sio.on('*', namespace='/deployment')
 async def catch_all(event, sid, data):
-    logger.info(f"Caught event: {event} from {sid} with data: {data}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Caught event: {event} from {sid} with data: {str(data)[:500]}")
+
+
+async def evict_idle_rooms():
+    """Periodically close rooms that have seen no traffic for ROOM_IDLE_TTL_SECONDS"""
+    interval = float(os.getenv('ROOM_SWEEP_INTERVAL_SECONDS', '60'))
+    while True:
+        await asyncio.sleep(interval)
+        for room in room_manager.idle_rooms():
+            room_manager.close(room)
+            room_manager.evicted_total += 1
+            await sio.close_room(room, namespace='/deployment')
+            logger.info(f"Evicted idle room {room}")
 
 # Create the ASGI app by mounting both Socket.IO and FastAPI
 app = socketio.ASGIApp(
     socketio_server=sio,
     other_asgi_app=fastapi_app,
-    socketio_path='socket.io'
+    socketio_path='socket.io',
+    on_startup=on_startup,
+    on_shutdown=on_shutdown
 )
 
 
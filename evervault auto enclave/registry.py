@@ -0,0 +1,50 @@
+import json
+import time
+import logging
+from typing import Any, Dict, List, Optional
+from store import get_store
+
+logger = logging.getLogger(__name__)
+
+ENCLAVES_KEY = 'enclaves'
+
+
+def register_enclave(enclave: Dict[str, Any], app_uuid: str, room_id: Optional[str] = None, store=None):
+    """Record a deployed enclave so background services (health prober, etc.) can find it"""
+    store = store or get_store()
+    record = dict(enclave)
+    record.update({
+        'app_uuid': app_uuid,
+        'room': room_id,
+        'registered_at': time.time(),
+        'health': record.get('health', 'unknown')
+    })
+    store.hset(ENCLAVES_KEY, enclave['name'], json.dumps(record))
+    return record
+
+
+def get_enclave(name: str, store=None) -> Optional[Dict[str, Any]]:
+    store = store or get_store()
+    raw = store.hget(ENCLAVES_KEY, name)
+    return json.loads(raw) if raw else None
+
+
+def list_enclaves(store=None) -> List[Dict[str, Any]]:
+    store = store or get_store()
+    return [json.loads(raw) for raw in store.hgetall(ENCLAVES_KEY).values()]
+
+
+def update_enclave(name: str, store=None, **fields) -> Optional[Dict[str, Any]]:
+    """Merge fields into an enclave record; returns None if the enclave is unknown"""
+    store = store or get_store()
+    record = get_enclave(name, store)
+    if record is None:
+        return None
+    record.update(fields)
+    store.hset(ENCLAVES_KEY, name, json.dumps(record))
+    return record
+
+
+def remove_enclave(name: str, store=None):
+    store = store or get_store()
+    store.hdel(ENCLAVES_KEY, name)
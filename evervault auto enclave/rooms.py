@@ -0,0 +1,115 @@
+import os
+import resource
+import time
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Set
+
+logger = logging.getLogger(__name__)
+
+
+class RoomFull(Exception):
+    """Raised when a room already has the maximum number of subscribers"""
+
+
+@dataclass
+class RoomState:
+    members: Set[str] = field(default_factory=set)
+    created_at: float = field(default_factory=lambda: time.time())
+    last_activity: float = field(default_factory=lambda: time.time())
+
+
+class RoomManager:
+    """
+    Bookkeeping for /deployment rooms in this relay process.
+
+    Socket.IO keeps its own membership tables; this mirrors them so rooms can
+    be capped, closed on terminal events and evicted once idle. A room exists
+    here only while it has subscribers.
+    """
+
+    def __init__(self, max_subscribers: int = 100, idle_ttl: float = 3600):
+        self.max_subscribers = max_subscribers
+        self.idle_ttl = idle_ttl
+        self.rooms: Dict[str, RoomState] = {}
+        self.member_rooms: Dict[str, Set[str]] = {}
+        self.closed_total = 0
+        self.evicted_total = 0
+
+    @classmethod
+    def from_env(cls) -> 'RoomManager':
+        return cls(
+            max_subscribers=int(os.getenv('MAX_ROOM_SUBSCRIBERS', '100')),
+            idle_ttl=float(os.getenv('ROOM_IDLE_TTL_SECONDS', '3600'))
+        )
+
+    def join(self, sid: str, room: str):
+        state = self.rooms.get(room)
+        if state is None:
+            state = self.rooms[room] = RoomState()
+        elif sid not in state.members and len(state.members) >= self.max_subscribers:
+            raise RoomFull(f"Room {room} already has {self.max_subscribers} subscribers")
+        state.members.add(sid)
+        state.last_activity = time.time()
+        self.member_rooms.setdefault(sid, set()).add(room)
+
+    def leave(self, sid: str, room: str):
+        state = self.rooms.get(room)
+        if state is not None:
+            state.members.discard(sid)
+            if not state.members:
+                del self.rooms[room]
+        rooms = self.member_rooms.get(sid)
+        if rooms is not None:
+            rooms.discard(room)
+            if not rooms:
+                del self.member_rooms[sid]
+
+    def disconnect(self, sid: str):
+        for room in list(self.member_rooms.get(sid, ())):
+            self.leave(sid, room)
+
+    def touch(self, room: str):
+        state = self.rooms.get(room)
+        if state is not None:
+            state.last_activity = time.time()
+
+    def subscribers(self, room: str) -> int:
+        state = self.rooms.get(room)
+        return len(state.members) if state is not None else 0
+
+    def close(self, room: str) -> Set[str]:
+        """Forget a room and return the sids that were in it"""
+        state = self.rooms.pop(room, None)
+        if state is None:
+            return set()
+        for sid in state.members:
+            rooms = self.member_rooms.get(sid)
+            if rooms is not None:
+                rooms.discard(room)
+                if not rooms:
+                    del self.member_rooms[sid]
+        self.closed_total += 1
+        return state.members
+
+    def idle_rooms(self, now: float = None) -> List[str]:
+        now = now if now is not None else time.time()
+        return [room for room, state in self.rooms.items() if now - state.last_activity > self.idle_ttl]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'rooms': len(self.rooms),
+            'subscriptions': sum(len(state.members) for state in self.rooms.values()),
+            'subscribed_clients': len(self.member_rooms),
+            'rooms_closed_total': self.closed_total,
+            'rooms_evicted_total': self.evicted_total
+        }
+
+
+def current_rss_bytes() -> int:
+    """Resident set size of this process (falls back to peak RSS where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
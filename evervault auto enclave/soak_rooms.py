@@ -0,0 +1,136 @@
+"""
+Soak test for room lifecycle in the /deployment namespace.
+
+Runs many short synthetic jobs against a running relay (join -> update ->
+complete) and samples /metrics/rooms along the way. Fails if the relay's RSS
+keeps growing after warm-up or rooms are left behind.
+
+    uvicorn main:app --port 8000
+    python soak_rooms.py --url http://localhost:8000 --jobs 100000
+"""
+import argparse
+import asyncio
+import sys
+import time
+import uuid
+import aiohttp
+import socketio
+
+
+class Subscriber:
+    def __init__(self, url: str):
+        self.url = url
+        self.client = socketio.AsyncClient(reconnection=False)
+        self.waiters = {}
+        self.client.on('joined', self._resolve('joined'), namespace='/deployment')
+        self.client.on('deployment_complete_client', self._resolve('complete'), namespace='/deployment')
+
+    def _resolve(self, kind):
+        async def handler(data):
+            future = self.waiters.pop((kind, data['room']), None)
+            if future is not None and not future.done():
+                future.set_result(data)
+        return handler
+
+    def wait_for(self, kind: str, room: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[(kind, room)] = future
+        return future
+
+    async def connect(self):
+        await self.client.connect(self.url, namespaces=['/deployment'], transports=['websocket'])
+
+
+async def fetch_metrics(session: aiohttp.ClientSession, url: str):
+    async with session.get(f"{url}/metrics/rooms") as response:
+        return await response.json()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--jobs', type=int, default=100000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--sample-every', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=10000, help='jobs to run before taking the RSS baseline')
+    parser.add_argument('--max-growth-mb', type=float, default=10.0)
+    args = parser.parse_args()
+
+    publisher = socketio.AsyncClient(reconnection=False)
+    await publisher.connect(args.url, namespaces=['/deployment'], transports=['websocket'])
+    subscribers = [Subscriber(args.url) for _ in range(args.concurrency)]
+    await asyncio.gather(*(subscriber.connect() for subscriber in subscribers))
+
+    completed = 0
+    baseline = None
+    samples = []
+    started = time.perf_counter()
+
+    async with aiohttp.ClientSession() as session:
+        async def run_jobs(subscriber: Subscriber, count: int):
+            nonlocal completed
+            for _ in range(count):
+                room = str(uuid.uuid4())
+                joined = subscriber.wait_for('joined', room)
+                await subscriber.client.emit('join', room, namespace='/deployment')
+                await joined
+                done = subscriber.wait_for('complete', room)
+                await publisher.emit('deployment_update', {
+                    'room': room, 'status': 'deploying', 'message': 'soak'
+                }, namespace='/deployment')
+                await publisher.emit('deployment_complete', {
+                    'room': room, 'data': {'status': 'completed', 'enclaves': []}
+                }, namespace='/deployment')
+                await done
+                completed += 1
+
+        async def sample():
+            nonlocal baseline
+            next_sample = 0
+            while completed < args.jobs:
+                if completed >= next_sample:
+                    metrics = await fetch_metrics(session, args.url)
+                    samples.append((completed, metrics))
+                    if baseline is None and completed >= args.warmup:
+                        baseline = metrics['rss_bytes']
+                    print(f"{completed:>8} jobs  rss={metrics['rss_bytes'] / 2**20:7.1f}MB  "
+                          f"rooms={metrics['rooms']}  subscriptions={metrics['subscriptions']}")
+                    next_sample += args.sample_every
+                await asyncio.sleep(0.5)
+
+        # The first jobs % concurrency subscribers take one extra job each
+        counts = [
+            args.jobs // args.concurrency + (1 if i < args.jobs % args.concurrency else 0)
+            for i in range(args.concurrency)
+        ]
+        sampler = asyncio.create_task(sample())
+        try:
+            await asyncio.gather(*(run_jobs(subscriber, count) for subscriber, count in zip(subscribers, counts)))
+        finally:
+            sampler.cancel()
+            await asyncio.gather(sampler, return_exceptions=True)
+        final = await fetch_metrics(session, args.url)
+
+    for subscriber in subscribers:
+        await subscriber.client.disconnect()
+    await publisher.disconnect()
+
+    elapsed = time.perf_counter() - started
+    print(f"\n{completed} jobs in {elapsed:.1f}s ({completed / elapsed:.0f} jobs/s)")
+    print(f"final: {final}")
+
+    failed = False
+    if final['rooms'] != 0:
+        print(f"FAIL: {final['rooms']} rooms left open")
+        failed = True
+    if baseline is not None:
+        growth_mb = (final['rss_bytes'] - baseline) / 2**20
+        print(f"rss growth after warm-up: {growth_mb:.1f}MB (limit {args.max_growth_mb}MB)")
+        if growth_mb > args.max_growth_mb:
+            print("FAIL: rss kept growing")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
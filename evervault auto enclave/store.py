@@ -0,0 +1,234 @@
+import fnmatch
+import os
+import threading
+import time
+import logging
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+_store = None
+_store_lock = threading.Lock()
+
+
+class MemoryStore:
+    """
+    In-process stand-in for the subset of the Redis API used by this service.
+
+    Useful for running the API and a worker in one process (or tests) without
+    Redis. State is not shared between processes.
+    """
+
+    def __init__(self):
+        self._data: Dict[str, Any] = {}
+        self._expiry: Dict[str, float] = {}
+        self._lock = threading.RLock()
+
+    def _purge(self, name: str):
+        deadline = self._expiry.get(name)
+        if deadline is not None and deadline <= time.time():
+            self._data.pop(name, None)
+            self._expiry.pop(name, None)
+
+    def _get(self, name: str, default=None):
+        self._purge(name)
+        return self._data.get(name, default)
+
+    def ping(self) -> bool:
+        return True
+
+    def get(self, name: str) -> Optional[str]:
+        with self._lock:
+            return self._get(name)
+
+    def set(self, name: str, value, ex: Optional[int] = None, nx: bool = False):
+        with self._lock:
+            if nx and self._get(name) is not None:
+                return None
+            self._data[name] = str(value)
+            if ex:
+                self._expiry[name] = time.time() + ex
+            else:
+                self._expiry.pop(name, None)
+            return True
+
+    def delete(self, *names: str) -> int:
+        with self._lock:
+            removed = 0
+            for name in names:
+                self._purge(name)
+                if name in self._data:
+                    removed += 1
+                self._data.pop(name, None)
+                self._expiry.pop(name, None)
+            return removed
+
+    def exists(self, *names: str) -> int:
+        with self._lock:
+            return sum(1 for name in names if self._get(name) is not None)
+
+    def expire(self, name: str, seconds: int) -> bool:
+        with self._lock:
+            if self._get(name) is None:
+                return False
+            self._expiry[name] = time.time() + seconds
+            return True
+
+    def keys(self, pattern: str = '*') -> List[str]:
+        with self._lock:
+            for name in list(self._data):
+                self._purge(name)
+            return [name for name in self._data if fnmatch.fnmatchcase(name, pattern)]
+
+    def incrby(self, name: str, amount: int = 1) -> int:
+        with self._lock:
+            value = int(self._get(name, 0)) + amount
+            self._data[name] = str(value)
+            return value
+
+    def incr(self, name: str, amount: int = 1) -> int:
+        return self.incrby(name, amount)
+
+    def decrby(self, name: str, amount: int = 1) -> int:
+        return self.incrby(name, -amount)
+
+    def decr(self, name: str, amount: int = 1) -> int:
+        return self.incrby(name, -amount)
+
+    def incrbyfloat(self, name: str, amount: float = 1.0) -> float:
+        with self._lock:
+            value = float(self._get(name, 0)) + amount
+            self._data[name] = repr(value)
+            return value
+
+    def hget(self, name: str, key: str) -> Optional[str]:
+        with self._lock:
+            return self._get(name, {}).get(key)
+
+    def hset(self, name: str, key: Optional[str] = None, value=None, mapping: Optional[Dict[str, Any]] = None) -> int:
+        with self._lock:
+            hash_ = self._get(name)
+            if hash_ is None:
+                hash_ = self._data[name] = {}
+            items = dict(mapping or {})
+            if key is not None:
+                items[key] = value
+            added = sum(1 for k in items if k not in hash_)
+            hash_.update({k: str(v) for k, v in items.items()})
+            return added
+
+    def hgetall(self, name: str) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._get(name, {}))
+
+    def hdel(self, name: str, *keys: str) -> int:
+        with self._lock:
+            hash_ = self._get(name, {})
+            removed = sum(1 for key in keys if hash_.pop(key, None) is not None)
+            if not hash_:
+                self._data.pop(name, None)
+            return removed
+
+    def hincrby(self, name: str, key: str, amount: int = 1) -> int:
+        with self._lock:
+            hash_ = self._get(name)
+            if hash_ is None:
+                hash_ = self._data[name] = {}
+            value = int(hash_.get(key, 0)) + amount
+            hash_[key] = str(value)
+            return value
+
+    def hlen(self, name: str) -> int:
+        with self._lock:
+            return len(self._get(name, {}))
+
+    def llen(self, name: str) -> int:
+        with self._lock:
+            return len(self._get(name, []))
+
+    def rpush(self, name: str, *values) -> int:
+        with self._lock:
+            list_ = self._get(name)
+            if list_ is None:
+                list_ = self._data[name] = []
+            list_.extend(str(v) for v in values)
+            return len(list_)
+
+    def lpush(self, name: str, *values) -> int:
+        with self._lock:
+            list_ = self._get(name)
+            if list_ is None:
+                list_ = self._data[name] = []
+            for value in values:
+                list_.insert(0, str(value))
+            return len(list_)
+
+    def lpop(self, name: str) -> Optional[str]:
+        with self._lock:
+            list_ = self._get(name, [])
+            return list_.pop(0) if list_ else None
+
+    def lrange(self, name: str, start: int, end: int) -> List[str]:
+        with self._lock:
+            list_ = self._get(name, [])
+            end = len(list_) if end == -1 else end + 1
+            return list_[start:end]
+
+    def xadd(self, name: str, fields: Dict[str, Any], id: str = '*', maxlen: Optional[int] = None, approximate: bool = True) -> str:
+        with self._lock:
+            stream = self._get(name)
+            if stream is None:
+                stream = self._data[name] = []
+            ms = int(time.time() * 1000)
+            seq = 0
+            if stream:
+                last_ms, last_seq = stream[-1][1]
+                if ms <= last_ms:
+                    ms, seq = last_ms, last_seq + 1
+            entry_id = f"{ms}-{seq}"
+            stream.append((entry_id, (ms, seq), {k: str(v) for k, v in fields.items()}))
+            if maxlen is not None and len(stream) > maxlen:
+                del stream[:len(stream) - maxlen]
+            return entry_id
+
+    def xrange(self, name: str, min: str = '-', max: str = '+', count: Optional[int] = None) -> List[tuple]:
+        def bound(value: str, default):
+            if value in ('-', '+'):
+                return default
+            ms, _, seq = value.partition('-')
+            return (int(ms), int(seq or 0))
+
+        with self._lock:
+            low = bound(min, (0, 0))
+            high = bound(max, (float('inf'), 0))
+            entries = [(entry_id, dict(fields)) for entry_id, key, fields in self._get(name, [])
+                       if low <= key <= high]
+            return entries[:count] if count else entries
+
+
+def get_store():
+    """
+    Return the shared key/value store.
+
+    Uses Redis at REDIS_URL unless USE_LOCAL_STORE=true, in which case an
+    in-process MemoryStore stands in for it.
+    """
+    global _store
+    if _store is not None:
+        return _store
+
+    with _store_lock:
+        if _store is None:
+            if os.getenv('USE_LOCAL_STORE', 'false').lower() == 'true':
+                logger.info("Using in-process local store")
+                _store = MemoryStore()
+            else:
+                import redis
+                _store = redis.Redis.from_url(
+                    os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+                    decode_responses=True
+                )
+    return _store
@@ -1,7 +1,11 @@
 from celery_app import celery_app
 import subprocess
 import os
+import shlex
 import tempfile
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, Any
 import socketio
 import json
@@ -9,6 +13,18 @@ from datetime import datetime
 import time
 import logging
 from dotenv import load_dotenv
+from admission import get_admission_controller
+from limiter import get_limiter, call_with_retries
+from registry import register_enclave
+from credentials import Credentials, resolve_credentials, get_credential_pool, is_shard_error, DEFAULT_CREDENTIAL_REF
+from celery_app import ExpiringResultTask
+from cancellation import CancellationToken, JobCancelled, WorkerDraining, run_cancellable
+from drain import DrainState, start_drain, clear_drain, save_checkpoint, load_checkpoint, clear_checkpoint
+from celery.signals import task_revoked, task_prerun, task_postrun, worker_shutting_down, worker_ready
+from celery.exceptions import Retry, MaxRetriesExceededError
+from profiling import SamplingProfiler
+from bulk import get_templates, plan_bulk_job
+from attestation import get_attestation_verifier, source_hash
 
 # Load environment variables
 load_dotenv()
@@ -19,17 +35,6 @@ logging.basicConfig(level=logging_level)
 logger = logging.getLogger(__name__)
 
 
-
-# initial export of env variables
-print(f"API Key: {os.getenv('EVERVAULT_API_KEY')}")
-print(f"App UUID: {os.getenv('EVERVAULT_APP_UUID')}")
-
-
-# If you need to set environment variables, use os.environ instead:
-os.environ["EV_API_KEY"] = os.getenv('EVERVAULT_API_KEY')
-os.environ["EV_APP_UUID"] = os.getenv('EVERVAULT_APP_UUID')
-
-
 # Initialize Socket.IO client
 sio = socketio.Client(logger=logging_level == logging.DEBUG, engineio_logger=logging_level == logging.DEBUG)
 
@@ -46,11 +51,14 @@ def on_connect_error(data):
 def on_disconnect():
     logger.info("Disconnected from Socket.IO server")
 
+# Evervault CLI command; point it at fake_ev.py to run the pipeline locally
+EV_CLI = shlex.split(os.getenv('EV_CLI', 'ev'))
+
 def get_existing_enclaves(env: Dict[str, str]) -> list:
     """Get list of existing enclaves"""
     try:
         result = subprocess.run(
-            ["ev", "enclave", "ls", "--json"],
+            [*EV_CLI, "enclave", "ls", "--json"],
             capture_output=True,
             text=True,
             check=True,
@@ -72,71 +80,314 @@ def generate_unique_enclave_name(base_name: str, existing_enclaves: list) -> str
             return name
         counter += 1
 
+# Bulk deploys emit from several threads
+emit_lock = threading.Lock()
+
 def safe_emit(event, data, namespace):
     try:
         if sio.connected:
             logger.info(f"Emitting {event} with data: {data}")
-            sio.emit(event, data, namespace=namespace)
+            with emit_lock:
+                sio.emit(event, data, namespace=namespace)
             logger.info(f"Emitted {event} successfully")
         else:
             logger.error("Socket not connected when trying to emit")
     except Exception as e:
         logger.error(f"Error emitting {event}: {e}")
 
-def get_env_with_credentials() -> Dict[str, str]:
+def get_env_with_credentials(credentials: Credentials) -> Dict[str, str]:
     """Get environment variables with required credentials"""
     env = os.environ.copy()
-    
-    # Check for required environment variables
-    required_vars = ['EVERVAULT_API_KEY', 'EVERVAULT_APP_UUID']
-    missing_vars = [var for var in required_vars if not os.getenv(var)]
-    
-    if missing_vars:
-        raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
-    
+
     # Set Evervault environment variables
-    env["EV_API_KEY"] = os.getenv('EVERVAULT_API_KEY')
-    env["EV_APP_UUID"] = os.getenv('EVERVAULT_APP_UUID')
-    
+    env["EV_API_KEY"] = credentials.api_key
+    env["EV_APP_UUID"] = credentials.app_uuid
+
     return env
 
-@celery_app.task(bind=True)
-def deploy_enclaves_task(self, room_id: str, number_of_enclaves: int, api_key: str, app_uuid: str) -> Dict[str, Any]:
+def run_ev_command(args: list, limiter_name: str, target_latency: float, token: CancellationToken, **kwargs) -> subprocess.CompletedProcess:
+    """
+    Run an Evervault CLI command under the shared adaptive limiter, retrying
+    transient control-plane errors with jittered backoff. Each attempt takes
+    its own slot so backoff sleeps don't hold capacity. Waiting, backoff and
+    the command itself all stop as soon as the job is cancelled.
+    """
+    limiter = get_limiter(limiter_name, target_latency)
+    attempts = int(os.getenv('EV_RETRY_ATTEMPTS', '4'))
+    base_delay = float(os.getenv('EV_RETRY_BASE_DELAY', '2'))
+    max_delay = float(os.getenv('EV_RETRY_MAX_DELAY', '60'))
+
+    def attempt():
+        with limiter.slot(should_stop=lambda: token.is_cancelled() or token.should_hand_off()):
+            return run_cancellable(args, token, **kwargs)
+
+    try:
+        return call_with_retries(
+            attempt,
+            attempts=attempts,
+            base_delay=base_delay,
+            max_delay=max_delay,
+            sleep=token.sleep
+        )
+    except InterruptedError:
+        if token.should_hand_off():
+            raise WorkerDraining(f"Worker is draining, handing off job {token.job_id}")
+        raise JobCancelled(f"Job {token.job_id} was cancelled")
+
+def ensure_ev_cli(room_id: str):
+    """Verify the Evervault CLI is installed and report its version"""
+    try:
+        version_result = subprocess.run(
+            [*EV_CLI, "--version"],
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        print(f"Evervault CLI version: {version_result.stdout}")
+        safe_emit('deployment_update', {
+            'room': room_id,
+            'status': 'setup',
+            'message': f'Evervault CLI version: {version_result.stdout}'
+        }, '/deployment')
+    except subprocess.CalledProcessError as e:
+        raise Exception("Evervault CLI not found. Please install it using: curl https://cli.evervault.com/v4/install -sL | sh")
+
+def fetch_template(source: str, dest: str, env: Dict[str, str], token: CancellationToken, required_files: list = ()) -> str:
+    """
+    Clone a template repository (or copy a local template directory) into dest
+    and check it has a Dockerfile and any other required files. Returns the
+    Dockerfile path.
+    """
+    if os.path.isdir(source):
+        shutil.copytree(source, dest, ignore=shutil.ignore_patterns('.git', 'node_modules'))
+    else:
+        run_cancellable(["git", "clone", source, dest], token, env=env)
+
+    # Verify the Dockerfile exists
+    dockerfile_path = os.path.join(dest, "Dockerfile")
+    if not os.path.exists(dockerfile_path):
+        raise Exception(f"Dockerfile not found at {dockerfile_path}")
+
+    # Verify other required files
+    for file in required_files:
+        file_path = os.path.join(dest, file)
+        if not os.path.exists(file_path):
+            raise Exception(f"Required file {file} not found at {file_path}")
+
+    return dockerfile_path
+
+def parse_enclave_toml(enclave_toml: str):
+    """Extract UUID and PCRs from enclave.toml"""
+    if not os.path.exists(enclave_toml):
+        raise Exception(f"enclave.toml not found at {enclave_toml}")
+
+    uuid = None
+    pcrs = {}
+    with open(enclave_toml, "r") as f:
+        config_content = f.read()
+        for line in config_content.split("\n"):
+            if line.startswith("uuid"):
+                uuid = line.split("=")[1].strip().strip('"')
+            elif line.startswith("PCR"):
+                pcr_num = line[3]
+                pcr_value = line.split("=")[1].strip().strip('"')
+                pcrs[f"pcr{pcr_num}"] = pcr_value
+    return uuid, pcrs
+
+def shard_limiter_name(operation: str, credential_ref: str) -> str:
+    """Each Evervault app has its own quotas, so each shard gets its own limiters"""
+    if credential_ref == DEFAULT_CREDENTIAL_REF:
+        return operation
+    return f"{operation}_{credential_ref.replace('-', '_')}"
+
+def deploy_enclave(
+    workdir: str,
+    enclave_name: str,
+    egress: bool,
+    credentials: Credentials,
+    env: Dict[str, str],
+    token: CancellationToken,
+    notify=lambda status: None,
+    build_hash: str = None
+) -> Dict[str, Any]:
+    """
+    Run ev enclave init and deploy for one enclave in workdir and return its
+    details. Pass the template's build_hash when workdir is reused between
+    enclaves, since the CLI leaves its own files behind.
+    """
+    dockerfile_path = os.path.join(workdir, "Dockerfile")
+    pool = get_credential_pool()
+    # Hash the source before the CLI starts writing into the directory
+    build_hash = build_hash or source_hash(workdir)
+
+    # Initialize enclave
+    notify('initializing')
+    init_args = [*EV_CLI, "enclave", "init", "-f", dockerfile_path, "--name", enclave_name]
+    if egress:
+        init_args.append("--egress")
+    try:
+        run_ev_command(init_args, shard_limiter_name('init', credentials.ref), 60, token, cwd=workdir, env=env)
+    except subprocess.CalledProcessError as e:
+        if is_shard_error(e):
+            pool.record_failure(credentials.ref)
+        raise Exception(f"Failed to initialize enclave: {e.stdout}\n{e.stderr}")
+
+    # Deploy enclave
+    notify('deploying')
+    enclave_started = time.time()
+    try:
+        run_ev_command([*EV_CLI, "enclave", "deploy", "-v"], shard_limiter_name('deploy', credentials.ref), 900, token, cwd=workdir, env=env)
+    except subprocess.CalledProcessError as e:
+        if is_shard_error(e):
+            pool.record_failure(credentials.ref)
+        raise Exception(f"Failed to deploy enclave: {e.stdout}\n{e.stderr}")
+
+    get_admission_controller().record_enclave_duration(time.time() - enclave_started)
+    pool.record_success(credentials.ref)
+
+    # Parse the enclave.toml file to get PCRs and other info
+    uuid, pcrs = parse_enclave_toml(os.path.join(workdir, "enclave.toml"))
+    enclave = {
+        'name': enclave_name,
+        # The domain belongs to whichever app (shard) the enclave was deployed to
+        'domain': f"{enclave_name}.{credentials.app_uuid}.enclave.evervault.com",
+        'pcrs': pcrs,
+        'uuid': uuid,
+        'build_hash': build_hash
+    }
+    trust_deployed_pcrs(enclave)
+    return enclave
+
+def clean_up_partial_enclaves(
+    names: list,
+    existing_enclaves: list,
+    credentials: Credentials,
+    env: Dict[str, str],
+    token: CancellationToken
+) -> list:
+    """
+    Delete enclaves a previous attempt at this job started but never finished
+    (its deploy was killed at the drain deadline, or its worker died), so the
+    name can be deployed again. Returns the names that couldn't be removed.
+    """
+    existing_names = {enclave.get('name') for enclave in existing_enclaves}
+    leaked = []
+    for name in names:
+        if name not in existing_names:
+            continue
+        try:
+            run_ev_command(
+                [*EV_CLI, "enclave", "delete", "--name", name, "--force"],
+                shard_limiter_name('delete', credentials.ref), 60, token, env=env
+            )
+            logger.info(f"Deleted partially deployed enclave {name}")
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Could not delete partially deployed enclave {name}: {e.stderr}")
+            leaked.append(name)
+    return leaked
+
+def trust_deployed_pcrs(enclave: Dict[str, Any]):
+    """Add the PCRs of an enclave we built ourselves to the attestation allow-list"""
+    if os.getenv('ATTESTATION_TRUST_DEPLOYED', 'false').lower() != 'true':
+        return
+    try:
+        get_attestation_verifier().allowlist.add(enclave['build_hash'], enclave['pcrs'])
+    except ValueError as e:
+        logger.warning(f"Not adding {enclave['name']} to the PCR allow-list: {e}")
+    except Exception as e:
+        logger.error(f"Error updating PCR allow-list for {enclave['name']}: {e}")
+
+def record_deployed_enclave(enclave: Dict[str, Any], app_uuid: str, room_id: str):
+    try:
+        register_enclave(enclave, app_uuid, room_id)
+    except Exception as e:
+        logger.error(f"Error registering enclave {enclave['name']}: {e}")
+
+def report_failure(room_id: str, error_message: str):
+    try:
+        if sio.connected:
+            safe_emit('deployment_error', {
+                'room': room_id,
+                'error': error_message
+            }, '/deployment')
+    except:
+        pass
+    finally:
+        if sio.connected:
+            sio.disconnect()
+
+def hand_off(task, room_id: str, checkpoint: Dict[str, Any]):
+    """
+    Save the job's progress and requeue it under the same task id so another
+    worker resumes it. Raises celery's Retry (or an error once the job has
+    been handed off MAX_HANDOFFS times).
+    """
+    save_checkpoint(task.request.id, checkpoint)
+    logger.info(f"Handing off job {task.request.id} for room {room_id}")
+    safe_emit('deployment_update', {
+        'room': room_id,
+        'status': 'handoff',
+        'message': 'Worker is restarting, moving the deployment to another worker'
+    }, '/deployment')
+    if sio.connected:
+        sio.disconnect()
+    max_handoffs = int(os.getenv('MAX_HANDOFFS', '10'))
+    try:
+        task.retry(countdown=0, max_retries=max_handoffs)
+    except MaxRetriesExceededError:
+        raise Exception(f"Deployment was handed off more than {max_handoffs} times")
+
+def report_cancelled(room_id: str):
+    # The temporary working directory has already been removed on the way out
+    logger.info(f"Deployment for room {room_id} cancelled")
+    safe_emit('deployment_cancelled', {
+        'room': room_id,
+        'message': 'Deployment cancelled'
+    }, '/deployment')
+    if sio.connected:
+        sio.disconnect()
+
+@celery_app.task(bind=True, base=ExpiringResultTask, result_ttl=int(os.getenv('DEPLOY_RESULT_TTL_SECONDS', '86400')))
+def deploy_enclaves_task(self, room_id: str, number_of_enclaves: int, credential_ref: str = DEFAULT_CREDENTIAL_REF, profile: bool = False) -> Dict[str, Any]:
+    admission = get_admission_controller()
+    drain = DrainState(self.request.hostname)
+    token = CancellationToken(self.request.id, hand_off=drain.deadline_passed)
+    # Resume where a draining (or lost) worker left off
+    checkpoint = load_checkpoint(self.request.id) or {}
+    deployed_enclaves = checkpoint.get('enclaves', [])
+    # Name of the enclave being deployed, so a resumed job can clean it up
+    in_flight = checkpoint.get('in_flight')
+    handed_off = False
     try:
+        token.raise_if_cancelled()
         logger.info(f"Starting deployment for room {room_id}")
         socket_server_url = os.getenv('SOCKET_IO_SERVER_URL', 'http://localhost:8000')
         sio.connect(socket_server_url, namespaces=['/deployment'], socketio_path='socket.io')
         logger.info("Connected to Socket.IO server")
 
-        deployed_enclaves = []
-        env = get_env_with_credentials()
+        credentials = resolve_credentials(credential_ref)
+        app_uuid = credentials.app_uuid
+        env = get_env_with_credentials(credentials)
 
         # Send initial status
         safe_emit('deployment_update', {
             'room': room_id,
             'status': 'started',
-            'message': f'Starting deployment for room {room_id}'
+            'message': f'Starting deployment for room {room_id}' if not deployed_enclaves else
+                       f'Resuming deployment for room {room_id} ({len(deployed_enclaves)} of {number_of_enclaves} enclaves done)'
         }, '/deployment')
 
         # First, verify ev CLI is installed
-        try:
-            version_result = subprocess.run(
-                ["ev", "--version"],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            print(f"Evervault CLI version: {version_result.stdout}")
-            safe_emit('deployment_update', {
-                'room': room_id,
-                'status': 'setup',
-                'message': f'Evervault CLI version: {version_result.stdout}'
-            }, '/deployment')
-        except subprocess.CalledProcessError as e:
-            raise Exception("Evervault CLI not found. Please install it using: curl https://cli.evervault.com/v4/install -sL | sh")
+        ensure_ev_cli(room_id)
 
         # Get existing enclaves
-        existing_enclaves = get_existing_enclaves(env)
+        existing_enclaves = get_existing_enclaves(env) + [{'name': enclave['name']} for enclave in deployed_enclaves]
+        if in_flight:
+            if clean_up_partial_enclaves([in_flight], existing_enclaves, credentials, env, token):
+                # Couldn't delete it; leave the name taken and pick a new one
+                in_flight = None
+            else:
+                existing_enclaves = [enclave for enclave in existing_enclaves if enclave.get('name') != in_flight]
         
         with tempfile.TemporaryDirectory() as temp_dir:
             # Clone repository
@@ -149,95 +400,41 @@ def deploy_enclaves_task(self, room_id: str, number_of_enclaves: int, api_key: s
                 'message': 'Cloning hello-enclave repository'
             }, '/deployment')
 
-            clone_result = subprocess.run(
-                ["git", "clone", "https://github.com/evervault/hello-enclave", clone_path],
-                check=True,
-                env=env,
-                capture_output=True,
-                text=True
+            fetch_template(
+                get_templates()[repo_name],
+                clone_path,
+                env,
+                token,
+                required_files=["index.js", "package.json", "package-lock.json"]
             )
-
-            # Verify the Dockerfile exists
-            dockerfile_path = os.path.join(clone_path, "Dockerfile")
-            if not os.path.exists(dockerfile_path):
-                raise Exception(f"Dockerfile not found at {dockerfile_path}")
-
-            # Verify other required files
-            required_files = ["index.js", "package.json", "package-lock.json"]
-            for file in required_files:
-                file_path = os.path.join(clone_path, file)
-                if not os.path.exists(file_path):
-                    raise Exception(f"Required file {file} not found at {file_path}")
-
-            for i in range(number_of_enclaves):
-                enclave_name = generate_unique_enclave_name(f"enclave", existing_enclaves)
-                print(f"Initializing enclave {i+1} of {number_of_enclaves}: {enclave_name}")
-                safe_emit('deployment_update', {
-                    'room': room_id,
-                    'status': 'initializing',
-                    'message': f'Initializing enclave {i+1} of {number_of_enclaves}: {enclave_name}'
-                }, '/deployment')
-
-                # Initialize enclave
-                try:
-                    init_result = subprocess.run(
-                        ["ev", "enclave", "init",
-                         "-f", dockerfile_path,
-                         "--name", enclave_name,
-                         "--egress"],
-                        cwd=clone_path,
-                        env=env,
-                        capture_output=True,
-                        text=True,
-                        check=True
-                    )
-                except subprocess.CalledProcessError as e:
-                    raise Exception(f"Failed to initialize enclave: {e.stdout}\n{e.stderr}")
-
-                print(f"Deploying enclave {i+1} of {number_of_enclaves}: {enclave_name}")
-                safe_emit('deployment_update', {
-                    'room': room_id,
-                    'status': 'deploying',
-                    'message': f'Deploying enclave {i+1} of {number_of_enclaves}: {enclave_name}'
-                }, '/deployment')
-
-                # Deploy enclave
-                try:
-                    deploy_result = subprocess.run(
-                        ["ev", "enclave", "deploy", "-v"],
-                        cwd=clone_path,
-                        env=env,
-                        capture_output=True,
-                        text=True,
-                        check=True
-                    )
-                except subprocess.CalledProcessError as e:
-                    raise Exception(f"Failed to deploy enclave: {e.stdout}\n{e.stderr}")
-
-                # Parse the enclave.toml file to get PCRs and other info
-                enclave_toml = os.path.join(clone_path, "enclave.toml")
-                if not os.path.exists(enclave_toml):
-                    raise Exception(f"enclave.toml not found at {enclave_toml}")
-
-                # Extract UUID and PCRs from enclave.toml
-                uuid = None
-                pcrs = {}
-                with open(enclave_toml, "r") as f:
-                    config_content = f.read()
-                    for line in config_content.split("\n"):
-                        if line.startswith("uuid"):
-                            uuid = line.split("=")[1].strip().strip('"')
-                        elif line.startswith("PCR"):
-                            pcr_num = line[3]
-                            pcr_value = line.split("=")[1].strip().strip('"')
-                            pcrs[f"pcr{pcr_num}"] = pcr_value
-
-                deployed_enclaves.append({
-                    'name': enclave_name,
-                    'domain': f"{enclave_name}.{app_uuid}.enclave.evervault.com",
-                    'pcrs': pcrs,
-                    'uuid': uuid
-                })
+            # Every enclave reuses clone_path, so hash it before the CLI writes into it
+            build_hash = source_hash(clone_path)
+
+            for i in range(len(deployed_enclaves), number_of_enclaves):
+                # Don't start another enclave on a worker that is shutting down
+                if drain.draining():
+                    raise WorkerDraining(f"Worker is draining, handing off job {self.request.id}")
+
+                # Redeploy an interrupted enclave under its old name
+                enclave_name = in_flight or generate_unique_enclave_name(f"enclave", existing_enclaves)
+                in_flight = enclave_name
+                save_checkpoint(self.request.id, {'enclaves': deployed_enclaves, 'in_flight': in_flight})
+
+                def notify(status):
+                    verb = 'Initializing' if status == 'initializing' else 'Deploying'
+                    print(f"{verb} enclave {i+1} of {number_of_enclaves}: {enclave_name}")
+                    safe_emit('deployment_update', {
+                        'room': room_id,
+                        'status': status,
+                        'message': f'{verb} enclave {i+1} of {number_of_enclaves}: {enclave_name}'
+                    }, '/deployment')
+
+                deployed_enclaves.append(
+                    deploy_enclave(clone_path, enclave_name, True, credentials, env, token, notify, build_hash)
+                )
+                record_deployed_enclave(deployed_enclaves[-1], app_uuid, room_id)
+                in_flight = None
+                save_checkpoint(self.request.id, {'enclaves': deployed_enclaves})
 
                 # Add the newly created enclave to our list of existing enclaves
                 existing_enclaves.append({'name': enclave_name})
@@ -252,12 +449,13 @@ def deploy_enclaves_task(self, room_id: str, number_of_enclaves: int, api_key: s
 
                 # Add a small delay between deployments
                 if i < number_of_enclaves - 1:
-                    time.sleep(2)
+                    token.sleep(2)
 
         # Send final success response
         final_response = {
             'status': 'completed',
             'enclaves': deployed_enclaves,
+            'credential_ref': credentials.ref,
             'message': f"Successfully deployed {number_of_enclaves} enclaves"
         }
         print(f"Final response: {final_response}")
@@ -269,21 +467,296 @@ def deploy_enclaves_task(self, room_id: str, number_of_enclaves: int, api_key: s
         sio.disconnect()
         return final_response
 
-    except Exception as e:
-        error_message = str(e)
+    except JobCancelled:
+        report_cancelled(room_id)
+        return {'status': 'cancelled', 'enclaves': deployed_enclaves}
+
+    except WorkerDraining:
         try:
-            if sio.connected:
-                safe_emit('deployment_error', {
+            hand_off(self, room_id, {'enclaves': deployed_enclaves, 'in_flight': in_flight})
+        except Retry:
+            handed_off = True
+            raise
+        except Exception as e:
+            report_failure(room_id, str(e))
+            raise
+
+    except Exception as e:
+        report_failure(room_id, str(e))
+        raise
+    finally:
+        # A handed-off job is still admitted; the worker that resumes it releases it
+        if not handed_off:
+            admission.release(self.request.id)
+            clear_checkpoint(self.request.id)
+
+@celery_app.task(bind=True, base=ExpiringResultTask, result_ttl=int(os.getenv('DEPLOY_RESULT_TTL_SECONDS', '86400')))
+def deploy_bulk_task(self, room_id: str, specs: list, credential_ref: str = DEFAULT_CREDENTIAL_REF, profile: bool = False) -> Dict[str, Any]:
+    """
+    Deploy a heterogeneous batch of enclaves as one job.
+
+    The plan is a two-level DAG: each distinct template is fetched and
+    verified once, then every enclave is initialized and deployed in its own
+    copy of that template's source, in parallel (bounded by
+    BULK_MAX_PARALLEL and the shared CLI limiter). Enclave failures don't stop
+    the rest of the batch; the result lists successes and failures.
+
+    `profile` (here and on deploy_enclaves_task) is handled by the
+    task_prerun/task_postrun hooks below.
+    """
+    admission = get_admission_controller()
+    drain = DrainState(self.request.hostname)
+    token = CancellationToken(self.request.id, hand_off=drain.deadline_passed)
+    # Enclaves finished (or failed) before a handoff, keyed by plan index
+    checkpoint = load_checkpoint(self.request.id) or {}
+    done = checkpoint.get('done', {})
+    deployed_enclaves = list(done.values())
+    failures = checkpoint.get('failures', [])
+    names = checkpoint.get('names')
+    # Plan indexes whose deploy had started, so a resumed job can clean them up
+    in_flight = set(checkpoint.get('in_flight', []))
+    # Deploy threads update the progress too
+    progress_lock = threading.Lock()
+    handed_off = False
+    try:
+        token.raise_if_cancelled()
+        plan = plan_bulk_job(specs)
+        total = len(plan.deploys)
+        logger.info(f"Starting bulk deployment of {total} enclaves from {len(plan.builds)} templates for room {room_id}")
+        socket_server_url = os.getenv('SOCKET_IO_SERVER_URL', 'http://localhost:8000')
+        sio.connect(socket_server_url, namespaces=['/deployment'], socketio_path='socket.io')
+
+        credentials = resolve_credentials(credential_ref)
+        app_uuid = credentials.app_uuid
+        env = get_env_with_credentials(credentials)
+
+        safe_emit('deployment_update', {
+            'room': room_id,
+            'status': 'started',
+            'message': f'Starting bulk deployment of {total} enclaves from {len(plan.builds)} templates',
+            'plan': plan.to_dict()
+        }, '/deployment')
+
+        ensure_ev_cli(room_id)
+
+        # Names are picked up front so parallel deploys can't collide
+        existing_enclaves = get_existing_enclaves(env)
+        if not names:
+            names = []
+            for deploy in plan.deploys:
+                names.append(generate_unique_enclave_name(deploy.name_prefix, existing_enclaves))
+                existing_enclaves.append({'name': names[-1]})
+        elif in_flight:
+            leaked = clean_up_partial_enclaves(
+                [names[index] for index in sorted(in_flight)], existing_enclaves, credentials, env, token
+            )
+            for index in sorted(in_flight):
+                if names[index] in leaked:
+                    names[index] = generate_unique_enclave_name(plan.deploys[index].name_prefix, existing_enclaves)
+                    existing_enclaves.append({'name': names[index]})
+            in_flight.clear()
+
+        def save_progress():
+            save_checkpoint(self.request.id, {
+                'names': names, 'done': done, 'failures': failures, 'in_flight': sorted(in_flight)
+            })
+        failed_names = {failure['name'] for failure in failures}
+        remaining = [node for node in plan.deploys
+                     if str(node.index) not in done and names[node.index] not in failed_names]
+        needed_templates = {node.template for node in remaining}
+
+        max_parallel = int(os.getenv('BULK_MAX_PARALLEL', '4'))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            def build(node):
+                safe_emit('deployment_update', {
                     'room': room_id,
-                    'error': error_message
+                    'status': 'cloning',
+                    'message': f'Fetching template {node.template}'
                 }, '/deployment')
-        except:
-            pass
-        finally:
-            if sio.connected:
-                sio.disconnect()
-        raise
+                dockerfile_path = fetch_template(node.source, os.path.join(temp_dir, 'templates', node.template), env, token)
+                return dockerfile_path, source_hash(os.path.dirname(dockerfile_path))
+
+            def run_deploy(node, build_future):
+                # Don't start new enclaves on a draining worker; None marks this
+                # one as left for the worker that resumes the job
+                if drain.draining():
+                    return None
+                # Waits only on this enclave's own template
+                dockerfile_path, build_hash = build_future.result()
+                template_path = os.path.dirname(dockerfile_path)
+                workdir = os.path.join(temp_dir, 'enclaves', names[node.index])
+                shutil.copytree(template_path, workdir)
+                token.raise_if_cancelled()
+                with progress_lock:
+                    in_flight.add(node.index)
+                    save_progress()
+
+                def notify(status):
+                    safe_emit('deployment_update', {
+                        'room': room_id,
+                        'status': status,
+                        'message': f'{status.capitalize()} enclave {names[node.index]} ({node.template})'
+                    }, '/deployment')
+
+                return deploy_enclave(workdir, names[node.index], node.egress, credentials, env, token, notify, build_hash)
+
+            # Separate pools so deploys blocked on a build never starve the builds
+            # Pool threads are named after the job so its profile can sample them
+            with ThreadPoolExecutor(max_workers=max(1, len(plan.builds)), thread_name_prefix=f'build-{self.request.id}') as build_pool, \
+                    ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix=f'deploy-{self.request.id}') as deploy_pool:
+                build_futures = {
+                    node.template: build_pool.submit(build, node)
+                    for node in plan.builds if node.template in needed_templates
+                }
+                deploy_futures = {
+                    deploy_pool.submit(run_deploy, node, build_futures[node.template]): node
+                    for node in remaining
+                }
+                # Keep collecting after a handoff starts, so enclaves that were
+                # already deploying are recorded and checkpointed before leaving
+                draining = False
+                for future in as_completed(deploy_futures):
+                    node = deploy_futures[future]
+                    try:
+                        enclave = future.result()
+                    except JobCancelled:
+                        for pending in deploy_futures:
+                            pending.cancel()
+                        raise
+                    except WorkerDraining:
+                        # Stopped at the drain deadline; the next worker redoes it
+                        draining = True
+                        continue
+                    except Exception as e:
+                        with progress_lock:
+                            failures.append({'name': names[node.index], 'template': node.template, 'error': str(e)})
+                            in_flight.discard(node.index)
+                            save_progress()
+                        safe_emit('deployment_update', {
+                            'room': room_id,
+                            'status': 'enclave_failed',
+                            'message': f'Failed to deploy enclave {names[node.index]}: {e}'
+                        }, '/deployment')
+                        continue
+                    if enclave is None:
+                        draining = True
+                        continue
+                    enclave['template'] = node.template
+                    deployed_enclaves.append(enclave)
+                    record_deployed_enclave(enclave, app_uuid, room_id)
+                    with progress_lock:
+                        done[str(node.index)] = enclave
+                        in_flight.discard(node.index)
+                        save_progress()
+                    safe_emit('deployment_update', {
+                        'room': room_id,
+                        'status': 'enclave_completed',
+                        'message': f'Successfully deployed enclave {len(deployed_enclaves)} of {total}',
+                        'enclave': enclave
+                    }, '/deployment')
+
+        if draining:
+            raise WorkerDraining(f"Worker is draining, handing off job {self.request.id}")
+
+        if not deployed_enclaves:
+            raise Exception(f"All {total} enclave deployments failed: {failures[0]['error'] if failures else ''}")
 
-@celery_app.task
+        final_response = {
+            'status': 'completed' if not failures else 'partial',
+            'enclaves': deployed_enclaves,
+            'failures': failures,
+            'credential_ref': credentials.ref,
+            'message': f"Successfully deployed {len(deployed_enclaves)} of {total} enclaves"
+        }
+        safe_emit('deployment_complete', {
+            'room': room_id,
+            'data': final_response
+        }, '/deployment')
+
+        sio.disconnect()
+        return final_response
+
+    except JobCancelled:
+        report_cancelled(room_id)
+        return {'status': 'cancelled', 'enclaves': deployed_enclaves, 'failures': failures}
+
+    except WorkerDraining:
+        try:
+            hand_off(self, room_id, {'names': names, 'done': done, 'failures': failures, 'in_flight': sorted(in_flight)})
+        except Retry:
+            handed_off = True
+            raise
+        except Exception as e:
+            report_failure(room_id, str(e))
+            raise
+
+    except Exception as e:
+        report_failure(room_id, str(e))
+        raise
+    finally:
+        if not handed_off:
+            admission.release(self.request.id)
+            clear_checkpoint(self.request.id)
+
+@worker_shutting_down.connect
+def on_worker_shutting_down(sender=None, **kwargs):
+    """
+    Start draining on warm shutdown (SIGTERM): running deploy jobs finish the
+    enclave they're on and hand the rest off. Past DRAIN_DEADLINE_SECONDS the
+    in-flight CLI call is killed too, so the job is handed off before the
+    orchestrator's own kill timeout loses it.
+    """
+    start_drain(sender, float(os.getenv('DRAIN_DEADLINE_SECONDS', '300')))
+
+@worker_ready.connect
+def on_worker_ready(sender=None, **kwargs):
+    # A restarted worker reusing the hostname must not inherit the old drain flag
+    clear_drain(sender.hostname)
+
+@task_revoked.connect
+def on_task_revoked(sender=None, request=None, **kwargs):
+    """Release a job revoked before it ever started running, and tell its room"""
+    if sender not in (deploy_enclaves_task, deploy_bulk_task) or request is None:
+        return
+    # The task body never runs, so its usual release in `finally` doesn't either
+    get_admission_controller().release(request.id)
+    clear_checkpoint(request.id)
+    args = getattr(request, 'args', None) or []
+    if not args:
+        return
+    try:
+        socket_server_url = os.getenv('SOCKET_IO_SERVER_URL', 'http://localhost:8000')
+        if not sio.connected:
+            sio.connect(socket_server_url, namespaces=['/deployment'], socketio_path='socket.io')
+        safe_emit('deployment_cancelled', {
+            'room': args[0],
+            'message': 'Deployment cancelled before it started'
+        }, '/deployment')
+        sio.disconnect()
+    except Exception as e:
+        logger.error(f"Error reporting revoked task: {e}")
+
+# Profile deploy tasks started with profile=True, plus a PROFILE_TASK_SAMPLE_RATE
+# fraction of all of them. Only the task's own thread is sampled.
+task_profiler = SamplingProfiler.from_env()
+task_profiler.sample_rate = float(os.getenv('PROFILE_TASK_SAMPLE_RATE', '0'))
+task_profiles = {}
+
+@task_prerun.connect
+def start_task_profile(sender=None, task_id=None, kwargs=None, **extra):
+    if sender not in (deploy_enclaves_task, deploy_bulk_task):
+        return
+    if (kwargs or {}).get('profile') or task_profiler.should_profile():
+        # Bulk jobs do their work in their build/deploy pools, so sample those too
+        prefixes = (f'build-{task_id}', f'deploy-{task_id}') if sender == deploy_bulk_task else ()
+        task_profiles[task_id] = task_profiler.start(f"{sender.name.rsplit('.', 1)[-1]}-{task_id}", thread_prefixes=prefixes)
+
+@task_postrun.connect
+def stop_task_profile(sender=None, task_id=None, **extra):
+    session = task_profiles.pop(task_id, None)
+    if session is not None:
+        task_profiler.stop(session)
+
+@celery_app.task(base=ExpiringResultTask, result_ttl=300)
 def test_task():
     return "Hello from Celery!"
\ No newline at end of file
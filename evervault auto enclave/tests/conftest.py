@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# The service's modules import each other by plain name (from store import ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Never talk to a real Redis from the unit tests
+os.environ['USE_LOCAL_STORE'] = 'true'
+
+from store import MemoryStore  # noqa: E402
+
+
+@pytest.fixture
+def store():
+    return MemoryStore()
@@ -0,0 +1,136 @@
+import json
+import time
+from unittest import mock
+
+import pytest
+from fastapi.testclient import TestClient
+
+from admission import JOBS_KEY, WORKER_SLOTS_KEY, AdmissionController
+
+
+@pytest.fixture
+def admission(store):
+    return AdmissionController(
+        store=store, max_pending_enclaves=10, max_pending_per_caller=4,
+        max_estimated_wait=3600, default_enclave_seconds=60
+    )
+
+
+def test_admits_and_records_jobs(admission):
+    decision = admission.try_admit('job-1', 'alice', 2, shard='default')
+    assert decision.admitted
+    assert decision.estimated_wait == 0
+
+    decision = admission.try_admit('job-2', 'bob', 3)
+    # Two enclaves ahead of it at 60s each on one worker slot
+    assert decision.estimated_wait == 120
+    assert admission.snapshot()['pending_enclaves'] == 5
+    assert admission.shard_loads() == {'default': 2}
+
+
+def test_caller_quota_returns_429(admission):
+    assert admission.try_admit('job-1', 'alice', 3).admitted
+    decision = admission.try_admit('job-2', 'alice', 2)
+
+    assert not decision.admitted
+    assert decision.status_code == 429
+    # One enclave over quota: one enclave's worth of waiting
+    assert decision.retry_after == 60
+    assert decision.details['caller_pending_enclaves'] == 3
+    # Other callers are unaffected
+    assert admission.try_admit('job-3', 'bob', 2).admitted
+
+
+def test_global_capacity_returns_503(admission):
+    for i in range(3):
+        assert admission.try_admit(f'job-{i}', f'caller-{i}', 3).admitted
+    decision = admission.try_admit('job-4', 'caller-4', 2)
+
+    assert not decision.admitted
+    assert decision.status_code == 503
+    assert decision.retry_after == 60
+
+
+def test_estimated_wait_limit_returns_503(admission):
+    admission.max_estimated_wait = 100
+    assert admission.try_admit('job-1', 'alice', 2).admitted
+    decision = admission.try_admit('job-2', 'bob', 1)
+    assert (decision.admitted, decision.status_code) == (False, 503)
+    assert decision.retry_after == 20
+    assert admission.snapshot()['saturated'] is True
+
+
+def test_estimates_follow_published_worker_slots(admission, store):
+    admission.try_admit('job-1', 'alice', 4)
+    store.set(WORKER_SLOTS_KEY, 4)
+    assert admission.snapshot()['estimated_wait'] == 60
+
+
+def test_release_frees_capacity(admission):
+    assert admission.try_admit('job-1', 'alice', 4).admitted
+    assert not admission.try_admit('job-2', 'alice', 1).admitted
+    admission.release('job-1')
+    assert admission.try_admit('job-2', 'alice', 1).admitted
+
+
+def test_stale_entries_are_dropped(admission, store):
+    store.hset(JOBS_KEY, 'lost-job', json.dumps({
+        'caller': 'alice', 'enclaves': 4, 'shard': None, 'admitted_at': time.time() - admission.job_ttl - 1
+    }))
+    assert admission.try_admit('job-1', 'alice', 4).admitted
+    assert store.hget(JOBS_KEY, 'lost-job') is None
+
+
+@pytest.fixture
+def api(admission, monkeypatch):
+    import main
+
+    monkeypatch.setenv('EVERVAULT_API_KEY', 'ev:key:test')
+    monkeypatch.setenv('EVERVAULT_APP_UUID', 'app_test')
+    monkeypatch.setattr(main, 'get_admission_controller', lambda: admission)
+    monkeypatch.setattr(main.event_bus, 'store', admission.store)
+    return main
+
+
+def test_rejection_carries_retry_after(api, admission):
+    admission.try_admit('job-1', 'alice', 4)
+    response = TestClient(api.fastapi_app).post(
+        '/deploy-enclaves', json={'number_of_enclaves': 1}, headers={'X-Caller-ID': 'alice'}
+    )
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '60'
+    assert response.json()['detail']['retry_after_seconds'] == 60
+
+
+def test_job_is_registered_before_it_is_queued(api, admission):
+    rooms_at_enqueue = []
+
+    def apply_async(**kwargs):
+        rooms_at_enqueue.append(api.event_bus.room_for(kwargs['task_id']))
+        return mock.Mock(id=kwargs['task_id'])
+
+    with mock.patch.object(api.deploy_enclaves_task, 'apply_async', side_effect=apply_async):
+        response = TestClient(api.fastapi_app).post('/deploy-enclaves', json={'number_of_enclaves': 1})
+
+    assert response.status_code == 200
+    # The room was already known when the task could start
+    assert rooms_at_enqueue == [response.json()['socket_room']]
+    assert admission.snapshot()['pending_jobs'] == 1
+
+
+def test_failed_registration_queues_nothing_and_releases_admission(api, admission, monkeypatch):
+    monkeypatch.setattr(api.event_bus, 'register_job', mock.Mock(side_effect=ConnectionError('store down')))
+    with mock.patch.object(api.deploy_enclaves_task, 'apply_async') as apply_async:
+        response = TestClient(api.fastapi_app).post('/deploy-enclaves', json={'number_of_enclaves': 1})
+
+    assert response.status_code == 500
+    apply_async.assert_not_called()
+    assert admission.snapshot()['pending_jobs'] == 0
+
+
+def test_failed_enqueue_releases_admission(api, admission):
+    with mock.patch.object(api.deploy_enclaves_task, 'apply_async', side_effect=ConnectionError('broker down')):
+        response = TestClient(api.fastapi_app).post('/deploy-enclaves', json={'number_of_enclaves': 1})
+
+    assert response.status_code == 500
+    assert admission.snapshot()['pending_jobs'] == 0
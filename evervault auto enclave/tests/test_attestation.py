@@ -0,0 +1,153 @@
+import datetime
+import time
+
+import pytest
+
+cbor2 = pytest.importorskip('cbor2')
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+from cryptography.x509.oid import NameOID
+
+from attestation import AttestationVerifier, PCRAllowList, pcr_tuple
+
+PCRS = {0: b'\x00' * 48, 1: b'\x01' * 48, 2: b'\x02' * 48, 8: b'\x08' * 48}
+BUILD_HASH = 'a' * 64
+
+
+def make_cert(subject, key, issuer=None, issuer_key=None):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, subject)])
+    return (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(issuer.subject if issuer else name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(issuer_key or key, hashes.SHA384())
+    )
+
+
+class Enclave:
+    """Signs attestation documents under a throwaway root"""
+
+    def __init__(self, root=None, root_key=None):
+        self.root_key = root_key or ec.generate_private_key(ec.SECP384R1())
+        self.root = root or make_cert('root', self.root_key)
+        self.key = ec.generate_private_key(ec.SECP384R1())
+        self.leaf = make_cert('enclave', self.key, self.root, self.root_key)
+
+    def document(self, pcrs=PCRS, nonce=None, timestamp=None, signing_key=None):
+        payload = cbor2.dumps({
+            'pcrs': pcrs,
+            'certificate': self.leaf.public_bytes(serialization.Encoding.DER),
+            'cabundle': [self.root.public_bytes(serialization.Encoding.DER)],
+            'timestamp': int((timestamp or time.time()) * 1000),
+            'nonce': nonce,
+        })
+        protected = cbor2.dumps({1: -35})
+        sig_structure = cbor2.dumps(['Signature1', protected, b'', payload])
+        r, s = decode_dss_signature((signing_key or self.key).sign(sig_structure, ec.ECDSA(hashes.SHA384())))
+        signature = r.to_bytes(48, 'big') + s.to_bytes(48, 'big')
+        return cbor2.dumps(cbor2.CBORTag(18, [protected, {}, payload, signature]))
+
+
+@pytest.fixture
+def enclave():
+    return Enclave()
+
+
+@pytest.fixture
+def verifier(store, enclave):
+    allowlist = PCRAllowList(store=store)
+    allowlist.add(BUILD_HASH, PCRS)
+    return AttestationVerifier(
+        allowlist,
+        root_cert_pem=enclave.root.public_bytes(serialization.Encoding.PEM),
+        store=store
+    )
+
+
+def test_pcr_tuple_accepts_names_and_document_keys():
+    named = {'pcr0': '00' * 48, 'pcr1': '01' * 48, 'pcr2': '02' * 48, 'pcr8': '08' * 48}
+    assert pcr_tuple(named) == pcr_tuple(PCRS)
+    assert pcr_tuple({k: v.upper() for k, v in named.items()}) == pcr_tuple(PCRS)
+    with pytest.raises(ValueError, match='PCR8'):
+        pcr_tuple({0: b'', 1: b'', 2: b''})
+
+
+def test_check_pcrs(verifier):
+    result = verifier.check_pcrs(PCRS)
+    assert result.verified and result.build_hash == BUILD_HASH
+
+    result = verifier.check_pcrs({**PCRS, 8: b'\xff' * 48})
+    assert not result.verified and result.reason == 'PCRs are not on the allow-list'
+
+    result = verifier.check_pcrs({0: PCRS[0]})
+    assert not result.verified and 'Missing' in result.reason
+
+
+def test_valid_document(verifier, enclave):
+    result = verifier.verify_document(enclave.document(nonce=b'n0nce'), nonce=b'n0nce')
+    assert result.verified, result.reason
+    assert result.build_hash == BUILD_HASH
+    assert not result.cached
+
+
+def test_chain_is_cached_but_signature_is_always_checked(verifier, enclave):
+    assert verifier.verify_document(enclave.document()).verified
+    assert verifier.verify_document(enclave.document()).cached
+
+    forged = enclave.document(signing_key=ec.generate_private_key(ec.SECP384R1()))
+    result = verifier.verify_document(forged)
+    assert not result.verified and result.reason == 'Invalid attestation document signature'
+
+
+def test_nonce_mismatch(verifier, enclave):
+    result = verifier.verify_document(enclave.document(nonce=b'old'), nonce=b'new')
+    assert not result.verified and result.reason == 'Nonce mismatch'
+
+
+def test_stale_document(verifier, enclave):
+    result = verifier.verify_document(enclave.document(timestamp=time.time() - verifier.max_age - 60))
+    assert not result.verified and result.reason == 'Attestation document is too old'
+
+
+def test_untrusted_pcrs(verifier, enclave):
+    result = verifier.verify_document(enclave.document(pcrs={**PCRS, 0: b'\xee' * 48}))
+    assert not result.verified and result.reason == 'PCRs are not on the allow-list'
+
+
+def test_chain_from_another_root(verifier):
+    result = verifier.verify_document(Enclave().document())
+    assert not result.verified
+    assert result.reason == 'Certificate chain does not start at the trusted root'
+
+
+def test_leaf_not_signed_by_root(verifier, enclave):
+    impostor = Enclave(root=enclave.root, root_key=ec.generate_private_key(ec.SECP384R1()))
+    result = verifier.verify_document(impostor.document())
+    assert not result.verified and result.reason.startswith('Bad signature on certificate')
+
+
+def test_cache_entries_from_another_secret_are_ignored(store, verifier):
+    impostor = Enclave()
+    other = AttestationVerifier(
+        verifier.allowlist,
+        root_cert_pem=impostor.root.public_bytes(serialization.Encoding.PEM),
+        cache_secret=b'someone else',
+        store=store
+    )
+    assert other.verify_document(impostor.document()).verified
+
+    result = verifier.verify_document(impostor.document())
+    assert not result.verified
+    assert result.reason == 'Certificate chain does not start at the trusted root'
+
+
+def test_malformed_document(verifier):
+    result = verifier.verify_document(b'not cbor')
+    assert not result.verified and result.reason.startswith('Malformed attestation document')
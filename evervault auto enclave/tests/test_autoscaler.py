@@ -0,0 +1,178 @@
+import time
+from unittest import mock
+
+import pytest
+
+from admission import WORKER_SLOTS_KEY, AdmissionController
+from autoscaler import Autoscaler, LocalProcessActuator, ScalingMetrics, ScalingPolicy
+from celery_app import celery_app
+
+
+def backlog(jobs=0, enclaves=0, oldest=0.0, enclave_seconds=180.0):
+    return ScalingMetrics(
+        queue_depth=jobs, pending_jobs=jobs, pending_enclaves=enclaves,
+        oldest_job_age=oldest, enclave_seconds=enclave_seconds
+    )
+
+
+@pytest.fixture
+def policy():
+    return ScalingPolicy(
+        min_workers=1, max_workers=6, concurrency=1, target_drain=900,
+        max_job_age=600, up_cooldown=30, down_cooldown=300, max_step=2
+    )
+
+
+def test_wanted_drains_backlog_within_target(policy):
+    # 20 enclaves at 180s each is 3600s of work: 4 workers clear it in 900s
+    assert policy.wanted(backlog(jobs=10, enclaves=20), current=1) == 4
+    # ...but one job only ever runs on one worker
+    assert policy.wanted(backlog(jobs=1, enclaves=20), current=1) == 1
+
+
+def test_wanted_is_clamped_to_bounds():
+    policy = ScalingPolicy(min_workers=2, max_workers=4)
+    assert policy.wanted(backlog(), current=3) == 2
+    assert policy.wanted(backlog(jobs=100, enclaves=500), current=3) == 4
+
+
+def test_old_job_adds_a_worker(policy):
+    # Too little work to need a second worker, but the oldest job has waited too long
+    assert policy.wanted(backlog(jobs=2, enclaves=2, oldest=601), current=1) == 2
+    assert policy.wanted(backlog(jobs=0, enclaves=0, oldest=601), current=1) == 1
+
+
+def test_scale_up_is_immediate_but_stepped(policy):
+    metrics = backlog(jobs=10, enclaves=30)
+    assert policy.desired(metrics, current=1, now=1000) == 3
+    # Within up_cooldown the fleet holds
+    assert policy.desired(metrics, current=3, now=1010) == 3
+    assert policy.desired(metrics, current=3, now=1031) == 5
+
+
+def test_scale_down_waits_for_cooldown_and_steps_by_one(policy):
+    policy.desired(backlog(jobs=10, enclaves=30), current=2, now=0)
+    idle = backlog()
+
+    assert policy.desired(idle, current=4, now=100) == 4
+    assert policy.desired(idle, current=4, now=350) == 4
+    # Lower count wanted for down_cooldown and the last change is old enough
+    assert policy.desired(idle, current=4, now=400) == 3
+    # The next step down waits a full cooldown again
+    assert policy.desired(idle, current=3, now=500) == 3
+    assert policy.desired(idle, current=3, now=700) == 2
+
+
+def test_burst_resets_scale_down_timer(policy):
+    idle = backlog()
+    assert policy.desired(idle, current=3, now=0) == 3
+    # A burst wanting exactly the current size interrupts the lower streak
+    assert policy.desired(backlog(jobs=3, enclaves=15), current=3, now=200) == 3
+    # Without the reset this would step down (310s since the streak began)
+    assert policy.desired(idle, current=3, now=310) == 3
+    assert policy.desired(idle, current=3, now=609) == 3
+    assert policy.desired(idle, current=3, now=610) == 2
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.setenv('AUTOSCALE_MIN_WORKERS', '3')
+    monkeypatch.setenv('AUTOSCALE_MAX_WORKERS', '2')
+    monkeypatch.setenv('AUTOSCALE_MAX_STEP', '0')
+    policy = ScalingPolicy.from_env()
+    assert (policy.min_workers, policy.max_workers, policy.max_step) == (3, 3, 1)
+
+
+@pytest.fixture
+def actuator():
+    actuator = LocalProcessActuator(drain_timeout=60)
+
+    def spawn():
+        actuator._next_id += 1
+        process = mock.Mock()
+        process.poll.return_value = None
+        actuator.workers[f'worker-{actuator._next_id}'] = process
+
+    actuator._spawn = spawn
+    with mock.patch.object(celery_app, 'control') as control:
+        actuator.control = control
+        yield actuator
+
+
+def test_scale_in_drains_newest_worker(actuator):
+    actuator.scale_to(3)
+    actuator.scale_to(2)
+
+    assert actuator.active() == 2
+    assert list(actuator.draining) == ['worker-3']
+    actuator.control.cancel_consumer.assert_called_once_with('celery', destination=['worker-3'], reply=False)
+
+
+def test_scale_out_resumes_draining_worker(actuator):
+    actuator.scale_to(2)
+    actuator.scale_to(1)
+    actuator.scale_to(2)
+
+    assert actuator.active() == 2
+    assert actuator.draining == {}
+    assert len(actuator.workers) == 2
+    actuator.control.add_consumer.assert_called_once_with('celery', destination=['worker-2'], reply=False)
+
+
+def test_signalled_worker_is_never_resumed(actuator):
+    actuator.scale_to(2)
+    actuator.scale_to(1)
+    actuator.control.inspect.return_value.active.return_value = {'worker-2': []}
+    actuator.reap()
+    actuator.workers['worker-2'].send_signal.assert_called_once()
+    assert actuator.draining['worker-2'] == float('inf')
+
+    actuator.scale_to(2)
+
+    # A fresh worker makes up the count; the stopping one stays on its way out
+    actuator.control.add_consumer.assert_not_called()
+    assert actuator.active() == 2
+    assert sorted(actuator.workers) == ['worker-1', 'worker-2', 'worker-3']
+    assert list(actuator.draining) == ['worker-2']
+
+
+def test_busy_draining_worker_is_stopped_at_deadline(actuator):
+    actuator.scale_to(2)
+    actuator.scale_to(1)
+    actuator.control.inspect.return_value.active.return_value = {'worker-2': [{'id': 'job-1'}]}
+
+    actuator.reap()
+    actuator.workers['worker-2'].send_signal.assert_not_called()
+
+    with mock.patch('autoscaler.time.monotonic', return_value=time.monotonic() + 61):
+        actuator.reap()
+    actuator.workers['worker-2'].send_signal.assert_called_once()
+
+    actuator.workers['worker-2'].poll.return_value = 0
+    actuator.reap()
+    assert list(actuator.workers) == ['worker-1']
+    assert actuator.draining == {}
+
+
+def test_step_publishes_running_slots_with_ttl(actuator, store):
+    policy = ScalingPolicy(min_workers=1, max_workers=4, concurrency=2, up_cooldown=0, max_step=4)
+    autoscaler = Autoscaler(policy, actuator, lambda: backlog(jobs=3, enclaves=12), interval=15, store=store)
+    admission = AdmissionController(store=store, worker_slots=1)
+
+    state = autoscaler.step()
+
+    assert state['desired'] == 2
+    assert admission.current_worker_slots() == 4
+    # Once the autoscaler stops refreshing it, admission falls back to WORKER_SLOTS
+    with mock.patch('store.time.time', return_value=time.time() + 61):
+        assert store.get(WORKER_SLOTS_KEY) is None
+        assert admission.current_worker_slots() == 1
+
+
+def test_dry_run_changes_nothing(actuator, store):
+    autoscaler = Autoscaler(ScalingPolicy(), actuator, lambda: backlog(jobs=5, enclaves=50), store=store, dry_run=True)
+
+    state = autoscaler.step()
+
+    assert state['desired'] > state['current'] == 0
+    assert actuator.workers == {}
+    assert store.get(WORKER_SLOTS_KEY) is None
@@ -0,0 +1,55 @@
+import pytest
+
+from bulk import get_templates, plan_bulk_job
+
+TEMPLATES = {'hello-enclave': 'https://example.com/hello', 'web': '/srv/templates/web'}
+
+
+def test_one_build_per_template_and_one_deploy_per_enclave():
+    plan = plan_bulk_job([
+        {'template': 'hello-enclave', 'count': 2},
+        {'template': 'web', 'count': 1, 'egress': False, 'name_prefix': 'web'},
+        {'template': 'hello-enclave', 'count': 1, 'name_prefix': 'extra'},
+    ], TEMPLATES)
+
+    assert [(build.template, build.source) for build in plan.builds] == [
+        ('hello-enclave', 'https://example.com/hello'),
+        ('web', '/srv/templates/web'),
+    ]
+    assert [(d.index, d.template, d.egress, d.name_prefix) for d in plan.deploys] == [
+        (0, 'hello-enclave', True, 'enclave'),
+        (1, 'hello-enclave', True, 'enclave'),
+        (2, 'web', False, 'web'),
+        (3, 'hello-enclave', True, 'extra'),
+    ]
+
+
+def test_defaults_to_one_hello_enclave():
+    plan = plan_bulk_job([{}], TEMPLATES)
+    assert [build.template for build in plan.builds] == ['hello-enclave']
+    assert len(plan.deploys) == 1
+
+
+def test_unknown_template_is_rejected():
+    with pytest.raises(ValueError, match='Unknown enclave template: nope'):
+        plan_bulk_job([{'template': 'nope'}], TEMPLATES)
+
+
+def test_to_dict_is_serializable():
+    plan = plan_bulk_job([{'template': 'web', 'count': 2}], TEMPLATES)
+    assert plan.to_dict() == {
+        'builds': [{'template': 'web', 'source': '/srv/templates/web'}],
+        'deploys': [
+            {'index': 0, 'template': 'web', 'egress': True, 'name_prefix': 'enclave'},
+            {'index': 1, 'template': 'web', 'egress': True, 'name_prefix': 'enclave'},
+        ]
+    }
+
+
+def test_extra_templates_from_env(monkeypatch):
+    monkeypatch.setenv('ENCLAVE_TEMPLATES', '{"web": "/srv/templates/web"}')
+    assert get_templates()['web'] == '/srv/templates/web'
+    assert 'hello-enclave' in get_templates()
+
+    monkeypatch.setenv('ENCLAVE_TEMPLATES', 'not json')
+    assert set(get_templates()) == {'hello-enclave'}
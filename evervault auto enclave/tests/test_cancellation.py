@@ -0,0 +1,105 @@
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from cancellation import CancellationToken, JobCancelled, WorkerDraining, request_cancel, run_cancellable
+
+# Stands in for a CLI that starts a helper (e.g. a docker build) and waits on it
+FORKING_CLI = '''
+import subprocess, sys, time
+child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+with open(sys.argv[1], "w") as f:
+    f.write(f"{child.pid}\\n")
+time.sleep(60)
+'''
+
+
+def alive(pid: int) -> bool:
+    """Running, as opposed to gone or a zombie waiting for a reaper"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture
+def forking_cli(tmp_path):
+    """Start the forking CLI under run_cancellable in a thread; yields (pids, outcome, thread)"""
+    pid_file = tmp_path / 'pids'
+    outcome = {}
+    pids = {}
+
+    def start(token):
+        def run():
+            try:
+                run_cancellable([sys.executable, '-c', FORKING_CLI, str(pid_file)], token)
+            except BaseException as e:
+                outcome['error'] = e
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        assert wait_for(lambda: pid_file.exists() and pid_file.read_text().endswith('\n'))
+        pids['child'] = int(pid_file.read_text())
+        # The CLI is the child's parent
+        with open(f"/proc/{pids['child']}/stat") as f:
+            pids['cli'] = int(f.read().rsplit(')', 1)[1].split()[1])
+        return pids, outcome, thread
+
+    return start
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='reads process state from /proc')
+def test_cancel_kills_the_whole_process_group(store, forking_cli):
+    token = CancellationToken('job-1', poll_interval=0.05, store=store)
+    pids, outcome, thread = forking_cli(token)
+    assert alive(pids['cli']) and alive(pids['child'])
+
+    request_cancel('job-1', store=store)
+    thread.join(timeout=5)
+
+    assert isinstance(outcome.get('error'), JobCancelled)
+    assert not alive(pids['cli'])
+    assert wait_for(lambda: not alive(pids['child']))
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='reads process state from /proc')
+def test_hand_off_kills_the_whole_process_group(store, forking_cli):
+    draining = threading.Event()
+    token = CancellationToken('job-1', poll_interval=0.05, store=store, hand_off=draining.is_set)
+    pids, outcome, thread = forking_cli(token)
+
+    draining.set()
+    thread.join(timeout=5)
+
+    assert isinstance(outcome.get('error'), WorkerDraining)
+    assert not alive(pids['cli'])
+    assert wait_for(lambda: not alive(pids['child']))
+
+
+def test_cancelled_job_starts_nothing(store):
+    request_cancel('job-1', store=store)
+    with pytest.raises(JobCancelled):
+        run_cancellable([sys.executable, '-c', 'raise SystemExit("should not run")'], CancellationToken('job-1', store=store))
+
+
+def test_behaves_like_subprocess_run(store):
+    token = CancellationToken('job-1', store=store)
+    result = run_cancellable([sys.executable, '-c', 'print("hi")'], token)
+    assert result.stdout == 'hi\n'
+
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        run_cancellable([sys.executable, '-c', 'import sys; sys.stderr.write("nope"); sys.exit(3)'], token)
+    assert (error.value.returncode, error.value.stderr) == (3, 'nope')
@@ -0,0 +1,137 @@
+import subprocess
+from unittest import mock
+
+import pytest
+
+import tasks
+from credentials import CredentialPool, Credentials, is_shard_error
+
+
+def cli_error(stderr):
+    return subprocess.CalledProcessError(1, ['ev', 'enclave', 'deploy'], output='', stderr=stderr)
+
+
+@pytest.fixture
+def hash_pool(store):
+    return CredentialPool(['default', 'eu', 'us2'], placement='hash', store=store)
+
+
+@pytest.fixture
+def loaded_pool(store):
+    return CredentialPool(['default', 'eu', 'us2'], placement='least_loaded', failure_threshold=2, cooldown=60, store=store)
+
+
+def test_hash_placement_is_sticky_per_caller(hash_pool, store):
+    tenants = [f'tenant-{i}' for i in range(50)]
+    first = {tenant: hash_pool.pick(tenant) for tenant in tenants}
+
+    # Same answer every time, and from a fresh pool in another process
+    other = CredentialPool(['default', 'eu', 'us2'], placement='hash', store=store)
+    assert all(hash_pool.pick(tenant) == ref for tenant, ref in first.items())
+    assert all(other.pick(tenant) == ref for tenant, ref in first.items())
+    # Load doesn't move a hashed tenant
+    assert all(hash_pool.pick(tenant, {ref: 100}) == ref for tenant, ref in first.items())
+    assert set(first.values()) == {'default', 'eu', 'us2'}
+
+
+def test_adding_a_shard_only_moves_some_tenants(hash_pool, store):
+    tenants = [f'tenant-{i}' for i in range(300)]
+    grown = CredentialPool(['default', 'eu', 'us2', 'ap'], placement='hash', store=store)
+
+    moved = [tenant for tenant in tenants if hash_pool.pick(tenant) != grown.pick(tenant)]
+    # Tenants only move onto the new shard, and roughly 1/4 of them do
+    assert all(grown.pick(tenant) == 'ap' for tenant in moved)
+    assert 0 < len(moved) < len(tenants) / 2
+
+
+def test_hashed_tenant_fails_over_when_its_shard_is_unhealthy(hash_pool):
+    tenant = 'tenant-1'
+    home = hash_pool.pick(tenant)
+    for _ in range(hash_pool.failure_threshold):
+        hash_pool.record_failure(home)
+
+    fallback = hash_pool.pick(tenant)
+    assert fallback != home
+    assert hash_pool.pick(tenant) == fallback
+
+
+def test_least_loaded_picks_fewest_pending_enclaves(loaded_pool):
+    assert loaded_pool.pick('alice', {'default': 5, 'eu': 2, 'us2': 3}) == 'eu'
+    # Ties go to the earlier shard in the pool
+    assert loaded_pool.pick('alice', {'default': 1, 'eu': 0, 'us2': 0}) == 'eu'
+    assert loaded_pool.pick('alice') == 'default'
+
+
+def test_shard_is_skipped_after_consecutive_failures(loaded_pool):
+    loaded_pool.record_failure('default')
+    assert loaded_pool.pick('alice') == 'default'
+
+    loaded_pool.record_failure('default')
+    assert loaded_pool.healthy_refs() == ['eu', 'us2']
+    assert loaded_pool.pick('alice') == 'eu'
+    stats = loaded_pool.stats({'eu': 1})
+    assert stats['shards']['default'] == {'pending_enclaves': 0, 'healthy': False, 'consecutive_failures': 2}
+
+
+def test_shard_comes_back_after_cooldown(loaded_pool):
+    with mock.patch('credentials.time.time', return_value=1000):
+        loaded_pool.record_failure('eu')
+        loaded_pool.record_failure('eu')
+        assert 'eu' not in loaded_pool.healthy_refs()
+    with mock.patch('credentials.time.time', return_value=1000 + loaded_pool.cooldown + 1):
+        assert loaded_pool.healthy_refs() == ['default', 'eu', 'us2']
+
+
+def test_success_resets_failure_count(loaded_pool):
+    loaded_pool.record_failure('default')
+    loaded_pool.record_success('default')
+    loaded_pool.record_failure('default')
+
+    assert loaded_pool.health()['default']['failures'] == 1
+    assert loaded_pool.health()['default']['healthy']
+
+
+def test_all_shards_unhealthy_falls_back_to_every_shard(loaded_pool):
+    for ref in loaded_pool.refs:
+        loaded_pool.record_failure(ref)
+        loaded_pool.record_failure(ref)
+
+    assert loaded_pool.healthy_refs() == ['default', 'eu', 'us2']
+    assert loaded_pool.pick('alice', {'default': 3, 'eu': 1, 'us2': 2}) == 'eu'
+
+
+@pytest.mark.parametrize('stderr', [
+    'Error: status code: 503',
+    '429 Too Many Requests',
+    'Request failed: 401 Unauthorized',
+    'HTTP status 403',
+    'Error: Invalid API key',
+    'the api key is revoked',
+])
+def test_control_plane_and_auth_errors_count_against_shard(stderr):
+    assert is_shard_error(cli_error(stderr))
+
+
+@pytest.mark.parametrize('error', [
+    cli_error('Dockerfile parse error line 3: unknown instruction: RUNN'),
+    cli_error('failed to solve: process "/bin/sh -c npm ci" did not complete successfully'),
+    cli_error(None),
+    TimeoutError('status code: 503'),
+])
+def test_build_errors_do_not_count_against_shard(error):
+    assert not is_shard_error(error)
+
+
+@pytest.mark.parametrize('stderr, counted', [
+    ('Request failed: 401 Unauthorized', True),
+    ('Dockerfile parse error line 3: unknown instruction: RUNN', False),
+])
+def test_deploy_records_failure_only_for_shard_errors(loaded_pool, monkeypatch, tmp_path, stderr, counted):
+    monkeypatch.setattr(tasks, 'get_credential_pool', lambda: loaded_pool)
+    monkeypatch.setattr(tasks, 'run_ev_command', mock.Mock(side_effect=cli_error(stderr)))
+    credentials = Credentials(ref='eu', api_key='ev:key:test', app_uuid='app_eu')
+
+    with pytest.raises(Exception, match='Failed to initialize enclave'):
+        tasks.deploy_enclave(str(tmp_path), 'enclave-1', False, credentials, {}, mock.Mock(), build_hash='abc')
+
+    assert loaded_pool.health()['eu']['failures'] == (1 if counted else 0)
@@ -0,0 +1,92 @@
+import asyncio
+
+from events import JobEventBus, format_sse
+
+
+def make_bus(store, **kwargs):
+    return JobEventBus(store=store, poll_interval=0.02, **kwargs)
+
+
+async def collect(bus, room, last_event_id='', timeout=2):
+    async def drain():
+        return [item async for item in bus.subscribe(room, last_event_id) if item is not None]
+    return await asyncio.wait_for(drain(), timeout)
+
+
+def test_jobs_map_to_their_room(store):
+    bus = make_bus(store)
+    bus.register_job('job-1', 'room-1')
+    assert bus.room_for('job-1') == 'room-1'
+    # Another relay process sharing the store sees it too
+    assert make_bus(store).room_for('job-1') == 'room-1'
+    assert bus.room_for('job-2') is None
+
+
+def test_resume_after_disconnect_with_last_event_id(store):
+    bus = make_bus(store)
+    ids = [bus.publish('room-1', 'deployment_update', {'step': step}) for step in range(3)]
+
+    async def scenario():
+        # The client saw the first event, then lost its connection
+        subscription = bus.subscribe('room-1')
+        first = await asyncio.wait_for(subscription.__anext__(), 1)
+        await subscription.aclose()
+        assert first == (ids[0], 'deployment_update', {'step': 0})
+
+        # Another process publishes the rest while it is away
+        make_bus(store).publish('room-1', 'deployment_complete', {'status': 'done'})
+        return await collect(bus, 'room-1', last_event_id=first[0])
+
+    items = asyncio.run(scenario())
+    assert [data for _, _, data in items] == [{'step': 1}, {'step': 2}, {'status': 'done'}]
+    assert [event_id for event_id, _, _ in items][:2] == ids[1:]
+
+
+def test_terminal_event_ends_the_stream(store):
+    bus = make_bus(store)
+
+    async def scenario():
+        subscriber = asyncio.create_task(collect(bus, 'room-1'))
+        await asyncio.sleep(0.05)
+        await bus.publish_async('room-1', 'deployment_update', {'step': 0})
+        await bus.publish_async('room-1', 'deployment_error', {'error': 'boom'})
+        # Events after the terminal one are never delivered
+        bus.publish('room-1', 'deployment_update', {'step': 1})
+        return await subscriber
+
+    items = asyncio.run(scenario())
+    assert [event for _, event, _ in items] == ['deployment_update', 'deployment_error']
+    assert bus.stats() == {'event_rooms_subscribed': 0, 'event_subscribers': 0}
+
+
+def test_resuming_after_the_terminal_event_returns_at_once(store):
+    bus = make_bus(store)
+    bus.publish('room-1', 'deployment_update', {'step': 0})
+    last = bus.publish('room-1', 'deployment_complete', {'status': 'done'})
+    assert bus.is_closed('room-1')
+    assert asyncio.run(collect(bus, 'room-1', last_event_id=last, timeout=0.5)) == []
+
+
+def test_events_from_other_processes_are_polled(store):
+    bus = make_bus(store)
+    other = make_bus(store)
+
+    async def scenario():
+        subscriber = asyncio.create_task(collect(bus, 'room-1'))
+        await asyncio.sleep(0.05)
+        # Published elsewhere: no local wakeup, the subscriber has to poll for it
+        await other.publish_async('room-1', 'deployment_complete', {'status': 'done'})
+        return await subscriber
+
+    assert [event for _, event, _ in asyncio.run(scenario())] == ['deployment_complete']
+
+
+def test_log_is_capped(store):
+    bus = make_bus(store, max_events=3)
+    for step in range(5):
+        bus.publish('room-1', 'deployment_update', {'step': step})
+    assert [data['step'] for _, _, data in bus.read('room-1')] == [2, 3, 4]
+
+
+def test_format_sse():
+    assert format_sse('1-0', 'deployment_update', {'a': 1}) == 'id: 1-0\nevent: deployment_update\ndata: {"a": 1}\n\n'
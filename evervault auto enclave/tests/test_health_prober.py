@@ -0,0 +1,168 @@
+import asyncio
+import socket
+
+from aiohttp import web
+
+from health_prober import HealthProber, ProbeState
+from registry import get_enclave, list_enclaves, register_enclave, update_enclave
+
+
+class StubEnclaves:
+    """Local HTTP server standing in for enclave /health endpoints"""
+
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.hits = {}
+
+    async def health(self, request):
+        name = request.match_info['name']
+        self.hits[name] = self.hits.get(name, 0) + 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if name.startswith('slow'):
+                await asyncio.sleep(1)
+            await asyncio.sleep(self.delay)
+            if name.startswith('broken'):
+                return web.Response(status=503, text='unavailable')
+            return web.json_response({'status': 'ok'})
+        finally:
+            self.in_flight -= 1
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_get('/{name}/health', self.health)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        return f"127.0.0.1:{self.runner.addresses[0][1]}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+def closed_port_address() -> str:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return f"127.0.0.1:{sock.getsockname()[1]}"
+
+
+async def probe_round(store, enclaves, **kwargs):
+    """Register the enclaves, run the prober until each was probed once, and return the changes it published"""
+    for enclave in enclaves:
+        register_enclave(enclave, 'app_test', room_id=f"room-{enclave['name']}", store=store)
+    changes = []
+
+    async def on_change(record):
+        changes.append(record)
+
+    prober = HealthProber(
+        url_template='http://{domain}/{name}/health',
+        min_interval=60,
+        on_change=on_change,
+        source=lambda: list_enclaves(store),
+        sink=lambda name, **fields: update_enclave(name, store, **fields),
+        **kwargs
+    )
+    running = asyncio.create_task(prober.run())
+    try:
+        for _ in range(200):
+            if prober.probes_sent >= len(enclaves):
+                break
+            await asyncio.sleep(0.05)
+        # Let the last probes record their results
+        await asyncio.sleep(0.1)
+    finally:
+        prober.stop()
+        await running
+    return prober, changes
+
+
+def test_one_round_against_stub_servers(store):
+    async def scenario():
+        stubs = StubEnclaves()
+        address = await stubs.start()
+        try:
+            enclaves = [
+                {'name': 'ok-1', 'domain': address},
+                {'name': 'slow-1', 'domain': address},
+                {'name': 'broken-1', 'domain': address},
+                {'name': 'refused-1', 'domain': closed_port_address()},
+            ]
+            return await probe_round(store, enclaves, timeout=0.2, failure_threshold=1)
+        finally:
+            await stubs.stop()
+
+    prober, changes = asyncio.run(scenario())
+    states = prober.states
+
+    assert prober.probes_sent == 4
+    assert {name: state.status for name, state in states.items()} == {
+        'ok-1': 'healthy', 'slow-1': 'unhealthy', 'broken-1': 'unhealthy', 'refused-1': 'unhealthy'
+    }
+    # The slow enclave is cut off at the probe timeout, not after its 1s sleep
+    assert states['slow-1'].last_error == 'TimeoutError'
+    assert states['slow-1'].last_latency < 0.8
+    assert states['broken-1'].last_error == 'HTTP 503'
+    assert states['refused-1'].last_error
+
+    # Every status change is written to the registry and published with its room
+    assert sorted(record['name'] for record in changes) == ['broken-1', 'ok-1', 'refused-1', 'slow-1']
+    assert get_enclave('ok-1', store)['health'] == 'healthy'
+    record = get_enclave('broken-1', store)
+    assert record['health'] == 'unhealthy' and record['health_error'] == 'HTTP 503'
+    assert all(record['room'] == f"room-{record['name']}" for record in changes)
+
+
+def test_concurrency_is_bounded(store):
+    async def scenario():
+        stubs = StubEnclaves(delay=0.2)
+        address = await stubs.start()
+        try:
+            enclaves = [{'name': f'ok-{i}', 'domain': address} for i in range(6)]
+            prober, _ = await probe_round(store, enclaves, concurrency=2)
+            return prober, stubs
+        finally:
+            await stubs.stop()
+
+    prober, stubs = asyncio.run(scenario())
+    assert prober.probes_sent == 6
+    assert stubs.max_in_flight == 2
+    assert all(count == 1 for count in stubs.hits.values())
+
+
+def test_status_changes_only_after_the_failure_threshold():
+    async def scenario():
+        published = []
+
+        async def on_change(record):
+            published.append(record['health'])
+
+        prober = HealthProber(
+            min_interval=10, max_interval=40, failure_threshold=2,
+            on_change=on_change, sink=lambda name, **fields: {'name': name, **fields}
+        )
+        state = ProbeState(name='e', url='http://e/health', interval=10)
+
+        await prober._record(state, True, 0.01, None)
+        assert (state.status, state.interval) == ('healthy', 10)
+        # Healthy probes back off, up to max_interval
+        await prober._record(state, True, 0.01, None)
+        await prober._record(state, True, 0.01, None)
+        await prober._record(state, True, 0.01, None)
+        assert state.interval == 40
+
+        # One failure drops back to the fast schedule but doesn't flip the status
+        await prober._record(state, False, 0.01, 'HTTP 500')
+        assert (state.status, state.interval) == ('healthy', 10)
+        await prober._record(state, False, 0.01, 'HTTP 500')
+        assert state.status == 'unhealthy'
+
+        await prober._record(state, True, 0.01, None)
+        assert (state.status, state.consecutive_failures) == ('healthy', 0)
+        return published
+
+    assert asyncio.run(scenario()) == ['healthy', 'unhealthy', 'healthy']
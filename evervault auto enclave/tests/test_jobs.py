@@ -0,0 +1,77 @@
+from unittest import mock
+
+import pytest
+from fastapi.testclient import TestClient
+
+from admission import AdmissionController
+from cancellation import CANCEL_KEY
+
+
+@pytest.fixture
+def api(store, monkeypatch):
+    import main
+
+    admission = AdmissionController(store=store)
+    monkeypatch.setattr(main, 'get_admission_controller', lambda: admission)
+    monkeypatch.setattr(main.event_bus, 'store', store)
+    monkeypatch.setattr(main, 'request_cancel', lambda job_id: store.set(CANCEL_KEY.format(job_id=job_id), 1))
+    monkeypatch.setattr(main.celery_app.control, 'revoke', mock.Mock())
+    main.event_bus.register_job('job-1', 'room-1')
+    admission.try_admit('job-1', 'alice', 1)
+    return main, admission, TestClient(main.fastapi_app)
+
+
+def task_state(state):
+    return mock.patch('main.celery_app.AsyncResult', return_value=mock.Mock(state=state))
+
+
+def test_unknown_job_is_404(api):
+    _, _, client = api
+    assert client.delete('/jobs/nope').status_code == 404
+
+
+@pytest.mark.parametrize('state', ['PENDING', 'STARTED', 'RETRY'])
+def test_unfinished_job_is_cancelled(api, store, state):
+    main, admission, client = api
+    with task_state(state):
+        response = client.delete('/jobs/job-1')
+
+    assert response.status_code == 202
+    assert response.json() == {'job_id': 'job-1', 'status': 'cancelling'}
+    assert store.exists(CANCEL_KEY.format(job_id='job-1'))
+    main.celery_app.control.revoke.assert_called_once_with('job-1')
+    # The slot is held until the worker has stopped the job
+    assert admission.snapshot()['pending_jobs'] == 1
+
+
+@pytest.mark.parametrize('state', ['SUCCESS', 'FAILURE', 'REVOKED'])
+def test_finished_job_is_409(api, store, state):
+    main, admission, client = api
+    with task_state(state):
+        response = client.delete('/jobs/job-1')
+
+    assert response.status_code == 409
+    assert response.json()['detail']['status'] == state
+    assert not store.exists(CANCEL_KEY.format(job_id='job-1'))
+    main.celery_app.control.revoke.assert_not_called()
+    assert admission.snapshot()['pending_jobs'] == 1
+
+
+def test_job_with_a_closed_event_log_is_409(api):
+    main, _, client = api
+    main.event_bus.publish('room-1', 'deployment_complete', {'room': 'room-1'})
+    # e.g. the task result has already expired
+    with task_state('PENDING'):
+        assert client.delete('/jobs/job-1').status_code == 409
+
+
+def test_revoked_job_that_never_ran_is_released(api, monkeypatch):
+    import tasks
+
+    _, admission, _ = api
+    monkeypatch.setattr(tasks, 'get_admission_controller', lambda: admission)
+    monkeypatch.setattr(tasks, 'sio', mock.MagicMock())
+    tasks.on_task_revoked(sender=tasks.deploy_enclaves_task, request=mock.Mock(id='job-1', args=['room-1', 1]))
+
+    assert admission.snapshot()['pending_jobs'] == 0
+    tasks.sio.emit.assert_called_once()
@@ -0,0 +1,130 @@
+import subprocess
+
+import pytest
+
+from limiter import AdaptiveLimiter, call_with_retries, is_transient_cli_error
+
+
+def cli_error(stderr='', stdout=''):
+    return subprocess.CalledProcessError(1, ['ev', 'enclave', 'deploy'], stdout, stderr)
+
+
+@pytest.fixture
+def limiter(store):
+    return AdaptiveLimiter(
+        'test', store=store, min_limit=1, max_limit=4, initial_limit=2,
+        target_latency=10, decrease_cooldown=30, poll_interval=0.01
+    )
+
+
+def test_acquire_stops_at_the_limit(limiter):
+    first, second = limiter.try_acquire(), limiter.try_acquire()
+    assert first and second
+    assert limiter.try_acquire() is None
+    assert limiter.in_flight() == 2
+
+    limiter.release(first, latency=1, success=True)
+    assert limiter.try_acquire() is not None
+
+
+def test_fast_successes_grow_the_limit_up_to_max(limiter):
+    for _ in range(50):
+        limiter.release(limiter.try_acquire(), latency=1, success=True)
+    assert limiter.limit() == 4
+
+
+def test_additive_increase_is_one_slot_per_window(limiter):
+    limiter.release(limiter.try_acquire(), latency=1, success=True)
+    assert limiter.limit() == pytest.approx(2.5)
+
+
+def test_slow_success_halves_the_limit_once_per_cooldown(limiter, store):
+    store.set(limiter.limit_key, 4)
+    limiter.release(limiter.try_acquire(), latency=60, success=True)
+    assert limiter.limit() == 2
+    # Same incident: the cooldown keeps a burst of slow calls from collapsing the limit
+    limiter.release(limiter.try_acquire(), latency=60, success=True)
+    assert limiter.limit() == 2
+
+
+def test_decrease_respects_the_minimum(limiter, store):
+    store.set(limiter.limit_key, 1.5)
+    limiter.release(limiter.try_acquire(), latency=1, success=False, overloaded=True)
+    assert limiter.limit() == 1
+
+
+def test_slot_decreases_only_on_transient_errors(limiter, store):
+    with pytest.raises(subprocess.CalledProcessError):
+        with limiter.slot():
+            raise cli_error(stderr='Dockerfile parse error on line 3')
+    assert limiter.limit() == 2
+    assert limiter.in_flight() == 0
+
+    with pytest.raises(subprocess.CalledProcessError):
+        with limiter.slot():
+            raise cli_error(stderr='Error: 503 Service Unavailable')
+    assert limiter.limit() == 1
+    assert limiter.in_flight() == 0
+
+
+def test_acquire_can_be_interrupted_or_time_out(limiter):
+    limiter.try_acquire()
+    limiter.try_acquire()
+    with pytest.raises(InterruptedError):
+        limiter.acquire(should_stop=lambda: True)
+    with pytest.raises(TimeoutError):
+        limiter.acquire(timeout=0.05)
+
+
+def test_expired_leases_are_reclaimed(limiter, store):
+    store.hset(limiter.leases_key, 'dead-worker', 0)
+    assert limiter.in_flight() == 0
+    assert store.hgetall(limiter.leases_key) == {}
+
+
+@pytest.mark.parametrize('stderr', [
+    'Error: 503 Service Unavailable',
+    'request failed with status 429',
+    'HTTP/1.1 502',
+    'Error: too many requests, slow down',
+    'connect: connection refused',
+])
+def test_transient_errors(stderr):
+    assert is_transient_cli_error(cli_error(stderr=stderr))
+
+
+@pytest.mark.parametrize('stderr', [
+    'Step 3/7 : COPY failed: sha256:ab503cd4294f not found',
+    'Error: 401 Unauthorized',
+    'HEALTHCHECK --timeout=3s is not supported',
+])
+def test_permanent_errors(stderr):
+    assert not is_transient_cli_error(cli_error(stderr=stderr))
+
+
+def test_only_stderr_is_checked():
+    assert not is_transient_cli_error(cli_error(stdout='PCR0 = "503 Service Unavailable"'))
+    assert not is_transient_cli_error(ValueError('503 Service Unavailable'))
+
+
+def test_call_with_retries_retries_transient_errors_only():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise cli_error(stderr='Error: 503 Service Unavailable')
+        return 'ok'
+
+    assert call_with_retries(flaky, attempts=4, sleep=lambda delay: None) == 'ok'
+    assert len(calls) == 3
+
+    calls.clear()
+
+    def broken():
+        calls.append(1)
+        raise cli_error(stderr='Dockerfile not found')
+
+    with pytest.raises(subprocess.CalledProcessError):
+        call_with_retries(broken, attempts=4, sleep=lambda delay: None)
+    assert len(calls) == 1
@@ -0,0 +1,52 @@
+import logging
+import logging.handlers
+
+import pytest
+
+
+class Capture(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+@pytest.fixture
+def main():
+    import main
+    return main
+
+
+@pytest.fixture
+def capture(main):
+    root = logging.getLogger()
+    original = root.handlers
+    handler = Capture()
+    root.handlers = [handler]
+    yield handler
+    main.stop_log_listener()
+    root.handlers = original
+
+
+def test_import_leaves_root_handlers_alone(main):
+    assert not any(isinstance(h, logging.handlers.QueueHandler) for h in logging.getLogger().handlers)
+
+
+def test_listener_restores_handlers_on_stop(main, capture):
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    main.start_log_listener()
+    main.start_log_listener()
+    assert len(root.handlers) == 1 and isinstance(root.handlers[0], logging.handlers.QueueHandler)
+
+    main.logger.warning('while running')
+    main.stop_log_listener()
+    assert root.handlers == handlers
+    assert capture.messages == ['while running']
+
+    # Records after shutdown still reach the original handlers
+    main.logger.warning('after shutdown')
+    assert capture.messages == ['while running', 'after shutdown']
+    main.stop_log_listener()
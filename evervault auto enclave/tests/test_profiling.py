@@ -0,0 +1,101 @@
+import threading
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.concurrency import run_in_threadpool
+
+from profiling import ProfilingMiddleware, SamplingProfiler, profiled_in_thread
+
+
+def spin(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+def handler_work():
+    spin(0.2)
+
+
+def pool_work():
+    spin(0.2)
+
+
+def make_client(tmp_path):
+    profiler = SamplingProfiler(output_dir=str(tmp_path), token='secret', interval=0.002)
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+    @app.get('/sync')
+    @profiled_in_thread(profiler)
+    def sync_handler():
+        handler_work()
+        return {'ok': True}
+
+    @app.get('/async')
+    async def async_handler():
+        await run_in_threadpool(profiled_in_thread(profiler)(pool_work))
+        return {'ok': True}
+
+    return TestClient(app)
+
+
+def read_profile(tmp_path, response):
+    assert response.status_code == 200
+    return (tmp_path / response.headers['x-profile-id']).read_text()
+
+
+def test_sync_handler_frames_are_sampled(tmp_path):
+    client = make_client(tmp_path)
+    profile = read_profile(tmp_path, client.get('/sync', headers={'X-Profile': 'secret'}))
+    assert 'handler_work' in profile
+    assert 'sync_handler' in profile
+
+
+def test_threadpool_calls_are_sampled(tmp_path):
+    client = make_client(tmp_path)
+    profile = read_profile(tmp_path, client.get('/async', headers={'X-Profile': 'secret'}))
+    assert 'pool_work' in profile
+
+
+def test_unprofiled_requests_leave_no_profile(tmp_path):
+    client = make_client(tmp_path)
+    response = client.get('/sync')
+    assert response.status_code == 200
+    assert 'x-profile-id' not in response.headers
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_profiles_are_written_off_the_event_loop(tmp_path):
+    profiler = SamplingProfiler(output_dir=str(tmp_path), token='secret')
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+    threads = {}
+
+    @app.get('/loop')
+    async def loop_handler():
+        threads['loop'] = threading.get_ident()
+        return {'ok': True}
+
+    write = profiler._write
+
+    def record_write(session):
+        threads['write'] = threading.get_ident()
+        return write(session)
+
+    profiler._write = record_write
+    read_profile(tmp_path, TestClient(app).get('/loop', headers={'X-Profile': 'secret'}))
+    assert threads['write'] != threads['loop']
+
+
+def test_threads_only_join_the_session_they_work_for(tmp_path):
+    profiler = SamplingProfiler(output_dir=str(tmp_path), token='secret')
+    with profiler.session('a') as a:
+        with profiler.attach_thread():
+            # Attaching on the session's own thread is a no-op
+            assert a.attached == set()
+    # Outside any profiled request there is nothing to attach to
+    with profiler.attach_thread():
+        pass
+    assert a.attached == set()
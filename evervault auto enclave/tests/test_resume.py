@@ -0,0 +1,121 @@
+import json
+import os
+import sys
+import uuid
+from unittest import mock
+
+import pytest
+from celery.app.task import gethostname
+
+import limiter
+import store as store_module
+import tasks
+from drain import DrainState, clear_drain, load_checkpoint, save_checkpoint, start_drain
+
+FAKE_EV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fake_ev.py')
+
+
+@pytest.fixture
+def ev_state(tmp_path, monkeypatch, store):
+    """Run bulk jobs eagerly against fake_ev and a fresh in-process store"""
+    template = tmp_path / 'template'
+    template.mkdir()
+    (template / 'Dockerfile').write_text('FROM node:18-alpine\n')
+    state = tmp_path / 'ev_state.json'
+
+    monkeypatch.setenv('ENCLAVE_TEMPLATES', json.dumps({'hello-enclave': str(template)}))
+    monkeypatch.setenv('FAKE_EV_STATE', str(state))
+    monkeypatch.setenv('FAKE_EV_INIT_SECONDS', '0')
+    monkeypatch.setenv('FAKE_EV_DEPLOY_SECONDS', '0')
+    monkeypatch.setenv('EVERVAULT_API_KEY', 'ev:key:test')
+    monkeypatch.setenv('EVERVAULT_APP_UUID', 'app_test')
+    monkeypatch.setenv('BULK_MAX_PARALLEL', '1')
+    monkeypatch.setattr(tasks, 'EV_CLI', [sys.executable, FAKE_EV])
+    monkeypatch.setattr(tasks, 'sio', mock.MagicMock())
+    monkeypatch.setattr(tasks, 'get_admission_controller', mock.MagicMock())
+    # See a drain as soon as it starts rather than on the next 1s poll
+    monkeypatch.setattr(tasks, 'DrainState', lambda hostname: DrainState(hostname, poll_interval=0))
+    monkeypatch.setattr(store_module, '_store', store)
+    monkeypatch.setattr(limiter, '_limiters', {})
+    return state
+
+
+def deployed_names(state):
+    return [enclave['name'] for enclave in json.loads(state.read_text())['enclaves']]
+
+
+def run_bulk(job_id, count):
+    return tasks.deploy_bulk_task.apply(('room-1', [{'template': 'hello-enclave', 'count': count}]), task_id=job_id)
+
+
+def test_resume_skips_finished_enclaves(ev_state):
+    job_id = str(uuid.uuid4())
+    save_checkpoint(job_id, {
+        'names': ['enclave-a', 'enclave-b', 'enclave-c'],
+        'done': {'0': {'name': 'enclave-a', 'uuid': 'enclave_a'}},
+        'failures': [],
+    })
+
+    result = run_bulk(job_id, 3).get()
+
+    assert result['status'] == 'completed'
+    assert sorted(enclave['name'] for enclave in result['enclaves']) == ['enclave-a', 'enclave-b', 'enclave-c']
+    assert sorted(deployed_names(ev_state)) == ['enclave-b', 'enclave-c']
+    assert load_checkpoint(job_id) is None
+
+
+def test_drain_checkpoints_progress_and_hands_off(ev_state, monkeypatch):
+    job_id = str(uuid.uuid4())
+    deploy_enclave = tasks.deploy_enclave
+
+    def deploy_then_drain(*args, **kwargs):
+        enclave = deploy_enclave(*args, **kwargs)
+        start_drain(gethostname(), 300)
+        return enclave
+
+    monkeypatch.setattr(tasks, 'deploy_enclave', deploy_then_drain)
+    with mock.patch.object(tasks.deploy_bulk_task, 'retry', side_effect=tasks.Retry('handoff')) as retry:
+        run_bulk(job_id, 3)
+    retry.assert_called_once()
+
+    checkpoint = load_checkpoint(job_id)
+    assert list(checkpoint['done']) == ['0']
+    assert checkpoint['in_flight'] == []
+    assert deployed_names(ev_state) == [checkpoint['names'][0]]
+
+    # The worker that picks the job up finishes the rest under the same names
+    clear_drain(gethostname())
+    monkeypatch.setattr(tasks, 'deploy_enclave', deploy_enclave)
+    result = run_bulk(job_id, 3).get()
+
+    assert [enclave['name'] for enclave in result['enclaves']] == checkpoint['names']
+    assert deployed_names(ev_state) == checkpoint['names']
+
+
+def test_partial_enclave_is_deleted_and_redeployed(ev_state):
+    job_id = str(uuid.uuid4())
+    # A deploy that was killed after the enclave was created
+    ev_state.write_text(json.dumps({'enclaves': [{'name': 'enclave-a'}]}))
+    save_checkpoint(job_id, {
+        'names': ['enclave-a', 'enclave-b'], 'done': {}, 'failures': [], 'in_flight': [0]
+    })
+
+    result = run_bulk(job_id, 2).get()
+
+    assert [enclave['name'] for enclave in result['enclaves']] == ['enclave-a', 'enclave-b']
+    assert deployed_names(ev_state) == ['enclave-a', 'enclave-b']
+
+
+def test_undeletable_partial_enclave_gets_a_new_name(ev_state, monkeypatch):
+    job_id = str(uuid.uuid4())
+    ev_state.write_text(json.dumps({'enclaves': [{'name': 'enclave-a'}]}))
+    save_checkpoint(job_id, {
+        'names': ['enclave-a', 'enclave-b'], 'done': {}, 'failures': [], 'in_flight': [0]
+    })
+    monkeypatch.setattr(tasks, 'clean_up_partial_enclaves', lambda names, *args: list(names))
+
+    result = run_bulk(job_id, 2).get()
+
+    names = [enclave['name'] for enclave in result['enclaves']]
+    assert 'enclave-a' not in names and 'enclave-b' in names
+    assert deployed_names(ev_state).count('enclave-a') == 1
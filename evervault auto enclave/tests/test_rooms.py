@@ -0,0 +1,123 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from rooms import RoomFull, RoomManager
+
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    clock = FakeClock()
+    # Only rooms.py sees the fake clock; asyncio and the store keep real time
+    with mock.patch('rooms.time', mock.Mock(time=clock)):
+        yield clock
+
+
+@pytest.fixture
+def rooms(clock):
+    return RoomManager(max_subscribers=2, idle_ttl=60)
+
+
+def test_idle_rooms_follow_last_activity(rooms, clock):
+    rooms.join('sid-1', 'job-a')
+    clock.advance(30)
+    rooms.join('sid-2', 'job-b')
+
+    clock.advance(31)
+    assert rooms.idle_rooms() == ['job-a']
+    # Traffic on a room pushes its eviction back
+    rooms.touch('job-a')
+    clock.advance(30)
+    assert rooms.idle_rooms() == ['job-b']
+    assert rooms.idle_rooms(now=0) == []
+    assert rooms.rooms['job-a'].created_at == 0
+
+
+def test_subscribers_are_capped_per_room(rooms):
+    rooms.join('sid-1', 'job-a')
+    rooms.join('sid-2', 'job-a')
+    # Rejoining doesn't count twice
+    rooms.join('sid-2', 'job-a')
+
+    with pytest.raises(RoomFull):
+        rooms.join('sid-3', 'job-a')
+    assert rooms.subscribers('job-a') == 2
+    assert 'sid-3' not in rooms.member_rooms
+
+    rooms.leave('sid-1', 'job-a')
+    rooms.join('sid-3', 'job-a')
+    assert rooms.subscribers('job-a') == 2
+
+
+def test_close_and_disconnect_drop_all_bookkeeping(rooms):
+    rooms.join('sid-1', 'job-a')
+    rooms.join('sid-1', 'job-b')
+    rooms.join('sid-2', 'job-a')
+
+    assert rooms.close('job-a') == {'sid-1', 'sid-2'}
+    assert rooms.member_rooms == {'sid-1': {'job-b'}}
+    assert rooms.close('job-a') == set()
+
+    rooms.disconnect('sid-1')
+    assert rooms.rooms == {} and rooms.member_rooms == {}
+    assert rooms.stats() == {
+        'rooms': 0, 'subscriptions': 0, 'subscribed_clients': 0,
+        'rooms_closed_total': 1, 'rooms_evicted_total': 0
+    }
+
+
+def test_churn_leaves_nothing_behind(rooms, clock):
+    # Clients that vanish without a terminal event or disconnect are the leak
+    # the idle sweep exists for
+    for i in range(10000):
+        rooms.join(f'sid-{i}', f'job-{i}')
+        if i % 3 == 0:
+            rooms.close(f'job-{i}')
+        elif i % 3 == 1:
+            rooms.disconnect(f'sid-{i}')
+        clock.advance(0.01)
+
+    assert rooms.stats()['rooms'] == 3333
+    clock.advance(61)
+    for room in rooms.idle_rooms():
+        rooms.close(room)
+
+    assert rooms.rooms == {}
+    assert rooms.member_rooms == {}
+
+
+def test_sweep_evicts_idle_rooms(clock, monkeypatch):
+    import main
+    rooms = RoomManager(idle_ttl=60)
+    close_room = mock.AsyncMock()
+    monkeypatch.setattr(main, 'room_manager', rooms)
+    monkeypatch.setattr(main.sio, 'close_room', close_room)
+    monkeypatch.setenv('ROOM_SWEEP_INTERVAL_SECONDS', '0')
+
+    rooms.join('sid-1', 'job-a')
+    clock.advance(30)
+    rooms.join('sid-2', 'job-b')
+    clock.advance(31)
+
+    async def sweep_once():
+        task = asyncio.create_task(main.evict_idle_rooms())
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    asyncio.run(sweep_once())
+
+    close_room.assert_awaited_once_with('job-a', namespace='/deployment')
+    assert list(rooms.rooms) == ['job-b']
+    assert rooms.stats()['rooms_evicted_total'] == 1
@@ -0,0 +1,148 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+import logging
+from bisect import bisect_left
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+LAG_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class LoopMonitor:
+    """
+    Measures event-loop lag and catches callbacks that block the loop.
+
+    A ticker coroutine sleeps for `interval` and records how late it wakes up
+    (the lag any other coroutine would have seen). A watchdog thread checks
+    when the ticker last ran; if the loop has been stuck for more than
+    `block_threshold`, it grabs the loop thread's current stack, which is the
+    code doing the blocking, and keeps it with the stall's final duration.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.05,
+        block_threshold: float = 0.1,
+        window: int = 1200,
+        max_reports: int = 20
+    ):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.bucket_counts = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.count = 0
+        self.max_lag_ms = 0.0
+        self.blocked_total = 0
+        self.reports: Deque[Dict[str, Any]] = deque(maxlen=max_reports)
+        self._last_tick = time.monotonic()
+        self._pending_report: Optional[Dict[str, Any]] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    @classmethod
+    def from_env(cls) -> 'LoopMonitor':
+        return cls(
+            interval=float(os.getenv('LOOP_MONITOR_INTERVAL_MS', '50')) / 1000,
+            block_threshold=float(os.getenv('LOOP_BLOCK_THRESHOLD_MS', '100')) / 1000
+        )
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._tick())
+        self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    async def _tick(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._last_tick = now
+            self.record((now - started - self.interval) * 1000)
+
+    def record(self, lag_ms: float):
+        lag_ms = max(0.0, lag_ms)
+        self.samples.append(lag_ms)
+        self.bucket_counts[bisect_left(LAG_BUCKETS_MS, lag_ms)] += 1
+        self.count += 1
+        self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+        report = self._pending_report
+        if report is not None:
+            # The stall is over; the ticker's lag is its full length
+            report['blocked_ms'] = round(lag_ms, 1)
+            self._pending_report = None
+            logger.warning(
+                f"Event loop blocked for {lag_ms:.0f}ms in:\n{''.join(report['stack'][-6:])}"
+            )
+
+    def _watch(self):
+        poll = min(self.interval, self.block_threshold) / 2
+        while not self._stopped.wait(poll):
+            stalled = time.monotonic() - self._last_tick - self.interval
+            if stalled < self.block_threshold or self._pending_report is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            report = {
+                'detected_at': time.time(),
+                'blocked_ms': round(stalled * 1000, 1),
+                'stack': traceback.format_stack(frame)
+            }
+            del frame
+            self.blocked_total += 1
+            self.reports.append(report)
+            self._pending_report = report
+
+    def percentile(self, pct: float) -> float:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+    def stats(self, include_stacks: bool = True) -> Dict[str, Any]:
+        buckets: Dict[str, int] = {}
+        cumulative = 0
+        for bound, count in zip([*map(str, LAG_BUCKETS_MS), '+Inf'], self.bucket_counts):
+            cumulative += count
+            buckets[bound] = cumulative
+        reports: List[Dict[str, Any]] = [
+            report if include_stacks else {k: v for k, v in report.items() if k != 'stack'}
+            for report in self.reports
+        ]
+        return {
+            'interval_ms': self.interval * 1000,
+            'block_threshold_ms': self.block_threshold * 1000,
+            'samples': self.count,
+            'lag_ms': {
+                'p50': round(self.percentile(50), 2),
+                'p99': round(self.percentile(99), 2),
+                'max': round(self.max_lag_ms, 2)
+            },
+            # Cumulative counts of samples with lag <= each bound (ms)
+            'lag_histogram_ms': buckets,
+            'blocked_total': self.blocked_total,
+            'blocked_recent': reports
+        }
@@ -0,0 +1,305 @@
+import asyncio
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Session of the request being handled, when it is profiled. Copied into the
+# threadpool along with the rest of the request's context
+_current_session: ContextVar[Optional['ProfileSession']] = ContextVar('profile_session', default=None)
+
+
+class ProfileSession:
+    """Stack samples collected for one profiled request or task"""
+
+    def __init__(self, key: int, name: str, thread_id: int, thread_prefixes: Tuple[str, ...] = ()):
+        self.key = key
+        self.name = name
+        self.thread_id = thread_id
+        # Threads whose name starts with one of these (e.g. a task's own
+        # thread pools) are sampled into this session too
+        self.thread_prefixes = tuple(thread_prefixes)
+        # Worker threads currently running this session's work (see attach_thread)
+        self.attached: Set[int] = set()
+        self.started_at = time.time()
+        self.samples: Counter = Counter()
+        stamp = datetime.fromtimestamp(self.started_at).strftime('%Y%m%d-%H%M%S')
+        safe_name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name)[:80]
+        self.file_name = f"{stamp}-{safe_name}-{key}.folded"
+
+
+class SamplingProfiler:
+    """
+    Opt-in sampling profiler that writes flamegraph-ready output.
+
+    While at least one session is active, a single background thread wakes up
+    every `interval` seconds, grabs the stack of each profiled thread from
+    sys._current_frames() and counts it. Nothing runs when no session is
+    active, so leaving this wired into production costs one check per
+    request. Finished sessions are written to `output_dir` in collapsed
+    ("folded") stack format, one `frame;frame;frame count` line per stack,
+    which flamegraph.pl, speedscope and inferno read directly.
+
+    Sessions sample the thread the work starts on, plus any worker thread
+    attached to them while it runs the session's work (sync handlers and
+    run_in_threadpool calls, see profiled_in_thread). For async handlers the
+    starting thread is the event loop thread, so concurrent requests on the
+    same loop show up in each other's profiles; their threadpool work doesn't.
+    """
+
+    def __init__(
+        self,
+        output_dir: str = 'profiles',
+        token: str = '',
+        sample_rate: float = 0.0,
+        interval: float = 0.005,
+        max_files: int = 200
+    ):
+        self.output_dir = output_dir
+        self.token = token
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_files = max_files
+        self._sessions: Dict[int, ProfileSession] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._next_id = 0
+
+    @classmethod
+    def from_env(cls) -> 'SamplingProfiler':
+        return cls(
+            output_dir=os.getenv('PROFILE_DIR', 'profiles'),
+            token=os.getenv('PROFILE_TOKEN', ''),
+            sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', '0')),
+            interval=float(os.getenv('PROFILE_INTERVAL_MS', '5')) / 1000,
+            max_files=int(os.getenv('PROFILE_MAX_FILES', '200'))
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token) or self.sample_rate > 0
+
+    def check_token(self, value: Optional[str]) -> bool:
+        return bool(self.token) and value is not None and hmac.compare_digest(value, self.token)
+
+    def should_profile(self, token: Optional[str] = None) -> bool:
+        """Profile when the caller presents the profiling token, or by sample rate"""
+        if self.check_token(token):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, name: str, thread_id: int = None, thread_prefixes: Tuple[str, ...] = ()) -> ProfileSession:
+        with self._lock:
+            self._next_id += 1
+            session = ProfileSession(self._next_id, name, thread_id or threading.get_ident(), thread_prefixes)
+            self._sessions[session.key] = session
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._sample_loop, name='profiler', daemon=True)
+                self._thread.start()
+        return session
+
+    def stop(self, session: ProfileSession) -> Optional[str]:
+        """End a session and write it out; returns the profile's file name"""
+        self._end(session)
+        return self._save(session)
+
+    async def stop_async(self, session: ProfileSession) -> Optional[str]:
+        """stop() for the event loop: sampling ends at once, the file is written from a worker thread"""
+        self._end(session)
+        return await asyncio.to_thread(self._save, session)
+
+    def _end(self, session: ProfileSession):
+        with self._lock:
+            self._sessions.pop(session.key, None)
+
+    def _save(self, session: ProfileSession) -> Optional[str]:
+        try:
+            return self._write(session)
+        except OSError as e:
+            logger.error(f"Error writing profile {session.name}: {e}")
+            return None
+
+    @contextmanager
+    def session(self, name: str):
+        session = self.start(name)
+        context_token = _current_session.set(session)
+        try:
+            yield session
+        finally:
+            _current_session.reset(context_token)
+            self.stop(session)
+
+    @contextmanager
+    def attach_thread(self):
+        """Sample the calling thread into the current request's profile while it works for it"""
+        session = _current_session.get()
+        ident = threading.get_ident()
+        if session is None or ident == session.thread_id:
+            yield
+            return
+        with self._lock:
+            session.attached.add(ident)
+        try:
+            yield
+        finally:
+            with self._lock:
+                session.attached.discard(ident)
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while True:
+            with self._lock:
+                sessions = [(session, [session.thread_id, *session.attached]) for session in self._sessions.values()]
+                if not sessions:
+                    # Exit while holding the lock so start() can't miss us
+                    self._thread = None
+                    return
+            frames = sys._current_frames()
+            thread_names = None
+            for session, thread_ids in sessions:
+                if session.thread_prefixes:
+                    if thread_names is None:
+                        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+                    thread_ids += [
+                        ident for ident, name in thread_names.items()
+                        if name.startswith(session.thread_prefixes) and ident not in thread_ids
+                    ]
+                for thread_id in thread_ids:
+                    frame = frames.get(thread_id)
+                    if frame is not None and thread_id != own_id:
+                        session.samples[self._fold(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+    @staticmethod
+    def _fold(frame) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def _write(self, session: ProfileSession) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, session.file_name), 'w') as f:
+            for stack, count in session.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        self._trim()
+        logger.info(f"Wrote profile {session.file_name} ({sum(session.samples.values())} samples)")
+        return session.file_name
+
+    def _trim(self):
+        files = sorted(self.list_profiles(), key=lambda p: p['modified'])
+        for profile in files[:max(0, len(files) - self.max_files)]:
+            try:
+                os.remove(os.path.join(self.output_dir, profile['name']))
+            except OSError:
+                pass
+
+    def list_profiles(self) -> List[Dict[str, object]]:
+        if not os.path.isdir(self.output_dir):
+            return []
+        profiles = []
+        for name in os.listdir(self.output_dir):
+            if name.endswith('.folded'):
+                stat = os.stat(os.path.join(self.output_dir, name))
+                profiles.append({'name': name, 'bytes': stat.st_size, 'modified': stat.st_mtime})
+        return sorted(profiles, key=lambda p: p['modified'], reverse=True)
+
+    def profile_path(self, name: str) -> Optional[str]:
+        """Path of a stored profile, or None for unknown (or path-traversing) names"""
+        if os.path.basename(name) != name or not name.endswith('.folded'):
+            return None
+        path = os.path.join(self.output_dir, name)
+        return path if os.path.isfile(path) else None
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles HTTP requests carrying a valid X-Profile
+    header (or a sampled fraction of all requests) and names the resulting
+    profile in an X-Profile-Id response header.
+
+    Threads named with one of `thread_prefixes` (e.g. a shared crypto pool)
+    are sampled into every profiled request.
+    """
+
+    def __init__(self, app, profiler: SamplingProfiler, thread_prefixes: Tuple[str, ...] = ()):
+        self.app = app
+        self.profiler = profiler
+        self.thread_prefixes = tuple(thread_prefixes)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.profiler.enabled:
+            return await self.app(scope, receive, send)
+
+        token = None
+        for key, value in scope.get('headers', ()):
+            if key == b'x-profile':
+                token = value.decode('latin-1')
+                break
+        if not self.profiler.should_profile(token):
+            return await self.app(scope, receive, send)
+
+        session = self.profiler.start(f"{scope['method']} {scope['path']}", thread_prefixes=self.thread_prefixes)
+        context_token = _current_session.set(session)
+
+        async def send_with_profile_id(message):
+            if message['type'] == 'http.response.start':
+                headers = list(message.get('headers', []))
+                headers.append((b'x-profile-id', session.file_name.encode('latin-1')))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            _current_session.reset(context_token)
+            await self.profiler.stop_async(session)
+
+
+def profiled(profiler: SamplingProfiler, name: str = None):
+    """Decorator that profiles a sampled fraction of calls to an async handler"""
+    def decorator(fn):
+        label = name or fn.__name__
+
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if not profiler.enabled or not profiler.should_profile():
+                return await fn(*args, **kwargs)
+            session = profiler.start(label)
+            context_token = _current_session.set(session)
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                _current_session.reset(context_token)
+                await profiler.stop_async(session)
+        return wrapper
+    return decorator
+
+
+def profiled_in_thread(profiler: SamplingProfiler):
+    """
+    Decorator for sync handlers and functions handed to run_in_threadpool:
+    the worker thread running them is sampled into the calling request's
+    profile, which otherwise only sees the idle event loop.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with profiler.attach_thread():
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
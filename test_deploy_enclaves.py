@@ -1,17 +1,54 @@
 import requests
+import json
 import os
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
+def follow_job_events(base_url, job_id):
+    """Follow a job's progress over Server-Sent Events until it completes or fails"""
+    last_event_id = None
+    while True:
+        headers = {"Accept": "text/event-stream"}
+        if last_event_id:
+            headers["Last-Event-ID"] = last_event_id
+        try:
+            with requests.get(f"{base_url}/jobs/{job_id}/events", headers=headers, stream=True, timeout=(5, 60)) as response:
+                response.raise_for_status()
+                event = {}
+                for line in response.iter_lines(decode_unicode=True):
+                    if line:
+                        field, _, value = line.partition(": ")
+                        event[field] = value
+                        continue
+                    if "data" not in event:
+                        event = {}
+                        continue
+                    last_event_id = event.get("id", last_event_id)
+                    data = json.loads(event["data"])
+                    print(f"[{event.get('event')}] {data.get('message') or data.get('error') or data}")
+                    if event.get("event") == "deployment_complete":
+                        return data.get("data", {})
+                    if event.get("event") == "deployment_error":
+                        raise Exception(data.get("error"))
+                    if event.get("event") == "deployment_cancelled":
+                        raise Exception("Deployment was cancelled")
+                    event = {}
+        except requests.exceptions.HTTPError:
+            raise
+        except requests.exceptions.RequestException as e:
+            # Reconnect and resume from the last event we saw
+            print(f"Event stream interrupted ({e}), resuming after event {last_event_id}")
+
 def test_deploy_enclaves():
     # Get API credentials from environment variables
     api_key = os.getenv("EVERVAULT_API_KEY")
     app_uuid = os.getenv("EVERVAULT_APP_UUID")
     
     # API endpoint URL (adjust if running on different port)
-    url = "http://localhost:8000/deploy-enclaves"
+    base_url = "http://localhost:8000"
+    url = f"{base_url}/deploy-enclaves"
     
     # Request headers
     headers = {
@@ -38,8 +75,10 @@ def test_deploy_enclaves():
         
         # Check if request was successful
         if response.status_code == 200:
+            print("\nFollowing deployment progress...")
+            result = follow_job_events(base_url, response.json()["job_id"])
             print("\nSuccessfully deployed enclaves!")
-            enclaves = response.json().get("enclaves", [])
+            enclaves = result.get("enclaves", [])
             for i, enclave in enumerate(enclaves, 1):
                 print(f"\nEnclave {i}:")
                 print(f"Domain: {enclave.get('domain')}")